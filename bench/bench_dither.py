@@ -0,0 +1,117 @@
+"""Compare the dithering of tepracli with the former per-pixel loop of example/pic2bin.py.
+
+The results of each method on a fixed gradient are checked against golden digests,
+error diffusion must agree with a plain loop in raster order on random images, and
+the NumPy and Numba implementations must agree if Numba is installed.
+
+usage: python bench/bench_dither.py [width ...]
+"""
+
+import hashlib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'client'))
+
+import numpy as np
+
+from bench_encoder import measure
+from tepracli import height
+from tepracli.dither import BAYER, _kernels, _lut, dither, methods, numba
+
+# SHA-256 of the results of each method on golden_image()
+_GOLDEN = {
+    'floyd-steinberg': '8c6ddd6ccd1e445b639e87134e7e732010da1865c48c3ce2559fcf74825d5d65',
+    'atkinson': 'a54019cfb33afd87ac32bbddd31999186c12f64513b80792a2df072f04405820',
+    'bayer': 'bcb37c6653bc90d4727c226b9fcf97ea581cb8d439916747d05561c534eb2cfb',
+}
+
+
+def dither_per_pixel(gray):
+    """The dithering which example/pic2bin.py had used until tepracli.dither was introduced."""
+    lut = np.arange(256, dtype='float32')
+    lut = pow((lut / 255), 2.2)
+
+    h, w = gray.shape
+    binalized = np.zeros((h, w, 1), np.uint8)
+    cumulative_err = 0
+    for y in range(h):
+        for x in range(w):
+            linear_val = lut[gray[y, x]]
+            if linear_val + cumulative_err < 0.5:
+                cumulative_err += linear_val
+                binalized[y, x] = 0
+            else:
+                cumulative_err -= 1.0 - linear_val
+                binalized[y, x] = 255
+    return binalized
+
+
+def diffuse_per_pixel(gray, method):
+    """Error diffusion pixel by pixel in raster order to check the wavefronts of dither()."""
+    h, w = gray.shape
+    linear = _lut(2.2)[gray]
+    out = np.zeros((h, w), np.uint8)
+    for y in range(h):
+        for x in range(w):
+            white = linear[y, x] >= 0.5
+            out[y, x] = 255 if white else 0
+            err = linear[y, x] - white
+            for dy, dx, weight in _kernels[method]:
+                if y + dy < h and 0 <= x + dx < w:
+                    linear[y + dy, x + dx] += err * weight
+    return out
+
+
+def golden_image(width=300):
+    """A horizontal gradient modulated by a vertical wave, the same on every platform."""
+    x = np.arange(width)[None, :]
+    y = np.arange(height)[:, None]
+    v = x * 255 // max(1, width - 1) + (y * 7 % 64) - 32
+    return np.clip(v, 0, 255).astype(np.uint8)
+
+
+def photo(width, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width), dtype=np.uint8)
+
+
+def main():
+    widths = [int(w) for w in sys.argv[1:]] or [84, 300, 1000, 4000]
+
+    gray = golden_image()
+    for method in methods:
+        digest = hashlib.sha256(dither(gray, method).tobytes()).hexdigest()
+        if digest != _GOLDEN[method]:
+            print(f'{method}: differs from the golden result ({digest})', file=sys.stderr)
+            return 1
+
+    for seed in range(3):
+        gray = photo(97, seed=seed)
+        for method in methods:
+            if method == BAYER:
+                continue
+            expected = diffuse_per_pixel(gray, method)
+            for jit in (False, True) if numba is not None else (False,):
+                assert np.array_equal(dither(gray, method, jit=jit), expected), (seed, method, jit)
+
+    for width in widths:
+        gray = photo(width, seed=width)
+        before = measure(dither_per_pixel, gray, repeat=1)
+        line = f'width={width:5d}px  per-pixel={before * 1000:9.3f}ms'
+
+        for method in methods:
+            expected = dither(gray, method, jit=False)
+            if numba is not None and not np.array_equal(expected, dither(gray, method)):
+                print(f'width={width} {method}: NumPy != Numba', file=sys.stderr)
+                return 1
+            after = measure(lambda: dither(gray, method, jit=False))
+            line += f'  {method}={after * 1000:7.3f}ms'
+            if numba is not None:
+                line += f' (numba {measure(dither, gray, method) * 1000:.3f}ms)'
+        print(line)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
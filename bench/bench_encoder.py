@@ -0,0 +1,71 @@
+"""Compare the bulk encoder of tepracli with the former per-pixel loop.
+
+usage: python bench/bench_encoder.py [width ...]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'client'))
+
+from PIL import Image
+
+from tepracli import height
+from tepracli.encoder import encode
+
+
+def encode_per_pixel(merged):
+    """The encoder which tepracli had used until the bulk encoder was introduced."""
+    im = merged.rotate(-90, expand=True)
+    encoded = b''
+    for y in range(im.height):
+        aggregated = 0
+        for shift, x in enumerate(range(im.width - 1, -1, -1)):
+            if im.getpixel((x, y)) <= 127:
+                aggregated += 1 << shift
+        line = aggregated.to_bytes(8, 'big')
+        encoded += line
+    return encoded
+
+
+def random_label(width, seed=0):
+    rnd = random.Random(seed)
+    return Image.frombytes('L', (width, height), rnd.randbytes(width * height))
+
+
+def measure(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    widths = [int(w) for w in sys.argv[1:]] or [84, 300, 1000, 4000]
+
+    for width in widths:
+        im = random_label(width, seed=width)
+
+        # Both encoders must produce the identical payload
+        expected, actual = encode_per_pixel(im), encode(im)
+        if expected != actual:
+            print(f'width={width}: MISMATCH', file=sys.stderr)
+            return 1
+
+        before = measure(encode_per_pixel, im)
+        after = measure(encode, im)
+        print(
+            f'width={width:5d}px  per-pixel={before * 1000:9.3f}ms  '
+            f'bulk={after * 1000:7.3f}ms  x{before / after:.0f}'
+        )
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""Compare the encodings of POST /prints by the payload size and the decode time.
+
+Labels of texts, QR codes and a dithered gradient are encoded in each encoding
+(zlib, rle, identity) and decoded by the readers of stream.py on the stand-in
+modules of the simulator. Each payload is also printed to a simulated LR30 and
+posted to main.py served by python -m sim to check that the raster is intact.
+
+usage: python bench/bench_encoding.py [--widths W ...] [--repeat 3]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from bench_encoder import measure
+from bench_pipeline import (
+    SimulatedPrinter,
+    SimulatedServer,
+    load_font,
+    render_qrs_of,
+    render_text_of,
+)
+from PIL import Image
+from tepracli.dither import dither_image
+from tepracli.encoder import compress, encode, encodings
+from tepracli.raster import binarize, compose
+
+from stream import BufferReader, open_reader
+
+
+def gradient_of(width):
+    im = Image.linear_gradient('L').rotate(90).resize((width, 64))
+    return dither_image(im)
+
+
+def labels_of(width, font):
+    yield 'text', binarize(compose([render_text_of(width, font)]))
+    yield 'qr', binarize(compose(render_qrs_of(width)))
+    yield 'gradient', gradient_of(width)
+
+
+async def decode(encoding, payload):
+    reader = open_reader(encoding, BufferReader(payload).read, len(payload))
+    out = bytearray()
+    while True:
+        pair = await reader.read_pair()
+        if pair is None:
+            return bytes(out)
+        out += pair
+
+
+def print_through(printer, encoding, payload):
+    reader = open_reader(encoding, BufferReader(payload).read, len(payload))
+    ok, err = printer._loop.run_until_complete(printer.tepra.print_stream(reader, 0))
+    if not ok:
+        raise RuntimeError('print failed: {}'.format(err))
+    return printer.printer.jobs[-1].raster
+
+
+def post_through(server, encoding, payload):
+    pid, err = server.client.post_print(payload, encoding)
+    if err:
+        raise RuntimeError(err)
+    server.wait(pid)
+
+
+def run(widths, repeat):
+    font = load_font()
+    printer = SimulatedPrinter()
+    server = SimulatedServer()
+    print(
+        '{:10s} {:>6s} {:9s} {:>8s} {:>6s} {:>11s}'.format(
+            'label', 'width', 'encoding', 'bytes', 'ratio', 'decode ms'
+        )
+    )
+    try:
+        for width in widths:
+            for kind, label in labels_of(width, font):
+                lines = encode(label)
+                smallest = compress(lines)[1]
+                for encoding in encodings:
+                    payload, _ = compress(lines, (encoding,))
+                    if asyncio.run(decode(encoding, payload)) != lines:
+                        raise RuntimeError('{} decoded into a different raster'.format(encoding))
+                    if print_through(printer, encoding, payload) != lines:
+                        raise RuntimeError('{} printed a different raster'.format(encoding))
+                    post_through(server, encoding, payload)
+
+                    seconds = measure(lambda: asyncio.run(decode(encoding, payload)), repeat=repeat)
+                    print(
+                        '{:10s} {:6d} {:9s} {:8d} {:6.3f} {:11.3f}{}'.format(
+                            kind,
+                            width,
+                            encoding,
+                            len(payload),
+                            len(payload) / len(lines),
+                            seconds * 1000,
+                            ' *' if encoding == smallest else '',
+                        )
+                    )
+    finally:
+        server.close()
+        printer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--widths', type=int, nargs='+', default=[84, 300, 1000, 4000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    run(args.widths, args.repeat)
+    print('* = chosen by tepracli, {:.1f} s in total'.format(time.perf_counter() - started))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Print labels across several simulated bridges with tepracli.aio.Fleet.
+
+Each bridge is main.py served by python -m sim on localhost in a subprocess with a
+LR30 of its own, the n-th one printing a line in --line-ms * (n + 1) ms so that the
+faster ones should take more labels. --kill stops one of the bridges in the middle
+of the run to see its labels go to the others.
+
+usage: python bench/bench_fleet.py [--bridges 3] [--labels 24] [--width 84]
+                                   [--line-ms 2] [--max-pending 2] [--kill]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import zlib
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(root, 'client'))
+
+from bench_encoder import random_label
+from tepracli.aio import Fleet
+from tepracli.encoder import encode
+
+
+class Bridge:
+    """main.py served by python -m sim on localhost in a subprocess."""
+
+    def __init__(self, line_ms):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.origin = '127.0.0.1:{}'.format(self.port)
+
+        args = ['--port', str(self.port), '--latency-ms', '1', '--chunk-ms', '0.1']
+        args += ['--line-ms', str(line_ms), '--settle-ms', '0']
+        self._proc = subprocess.Popen(
+            [sys.executable, '-m', 'sim'] + args,
+            cwd=root,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.1):
+                    return
+            except OSError:
+                time.sleep(0.1)
+        self.close()
+        raise RuntimeError('the simulated server did not start')
+
+    def close(self):
+        if self._proc.poll() is None:
+            self._proc.terminate()
+            self._proc.wait()
+
+
+async def run(bridges, labels, kill, max_pending):
+    origins = [b.origin for b in bridges]
+    async with Fleet(origins, max_pending=max_pending, poll_interval=0.05, max_errors=2) as fleet:
+        if kill:
+            # Stop the last bridge once the fleet is busy
+            async def stop():
+                await asyncio.sleep(1)
+                bridges[-1].close()
+
+            asyncio.get_running_loop().create_task(stop())
+
+        started = time.monotonic()
+        results = await fleet.print_all(labels)
+        elapsed = time.monotonic() - started
+        return results, elapsed, {o: s.to_dict() for o, s in fleet.stats.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--bridges', type=int, default=3)
+    parser.add_argument('--labels', type=int, default=24)
+    parser.add_argument('--width', type=int, default=84)
+    parser.add_argument('--line-ms', type=float, default=2)
+    parser.add_argument('--max-pending', type=int, default=2)
+    parser.add_argument('--kill', action='store_true', help='Stop a bridge in the middle.')
+    args = parser.parse_args()
+
+    labels = [
+        (zlib.compress(encode(random_label(args.width, seed=i))), 0) for i in range(args.labels)
+    ]
+    bridges = [Bridge(args.line_ms * (n + 1)) for n in range(args.bridges)]
+    try:
+        results, elapsed, stats = asyncio.run(run(bridges, labels, args.kill, args.max_pending))
+    finally:
+        for b in bridges:
+            b.close()
+
+    failed = [(i, origin, err) for i, (origin, err) in enumerate(results) if err]
+    for i, origin, err in failed:
+        print('label {} failed on {}: {}'.format(i, origin or '-', err), file=sys.stderr)
+    print(json.dumps(stats, indent=2))
+    print(
+        '{} labels in {:.2f} s ({:.2f} labels/s), {} failed'.format(
+            len(labels), elapsed, len(labels) / elapsed, len(failed)
+        )
+    )
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""Compare the pacing of chunks sent to the printer on the simulated LR30.
+
+ - legacy: a fixed gap of 20 ms after every chunk as Tepra had used before Pacer
+ - pipelined: the default Pacer which keeps a window of chunks in flight
+
+usage: python bench/bench_pacing.py [lines ...]
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import sim
+
+sim.install()
+
+from sim.printer import SimulatedLR30
+from tepra import CompletionTracker, Pacer, Tepra
+
+
+async def print_once(pacer, image, **printer_kwargs):
+    sim.reset()
+    printer = sim.attach(SimulatedLR30(**printer_kwargs))
+
+    with tempfile.TemporaryDirectory() as d:
+        tracker = CompletionTracker(line_ms=printer.line_ms, depth_line_ms=0)
+        t = Tepra(pacer=pacer, handles_path=os.path.join(d, 'handles.json'), tracker=tracker)
+        t.activate()
+        if not await t.connect():
+            raise RuntimeError('failed to connect to the simulated printer')
+
+        start = time.monotonic()
+        ok, err = await t.print(image, 0)
+        job = printer.jobs[-1]
+        elapsed = (job.lines_done_at / 1000) - start
+
+    if not ok:
+        raise RuntimeError('print failed: {}'.format(err))
+    return elapsed, job.raster == image, printer
+
+
+def main():
+    counts = [int(n) for n in sys.argv[1:]] or [200, 1000]
+    cases = [
+        ('legacy', lambda: Pacer(gap_ms=20), {}),
+        ('pipelined', Pacer, {}),
+        ('pipelined, slow link', Pacer, {'latency_ms': 30}),
+    ]
+
+    for lines in counts:
+        image = random.Random(lines).randbytes(lines * 8)
+        for name, pacer, printer_kwargs in cases:
+            elapsed, match, printer = asyncio.run(print_once(pacer(), image, **printer_kwargs))
+            print(
+                f'lines={lines:5d} {name:21s} {lines / elapsed:8.1f} lines/s'
+                f'  raster {"OK" if match else "MISMATCH"}'
+                f'  dropped={printer.dropped} enomem={printer.enomem}'
+            )
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
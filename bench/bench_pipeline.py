@@ -0,0 +1,288 @@
+"""Time each stage of the label pipeline from rendering to printing.
+
+Stages for each label width:
+
+ - render_text, render_qr, render_image: tepracli renders the parts of the label,
+   each of them about a third of the width
+ - render_cached: the text and the QR codes are taken from the render cache
+ - compose, binarize, encode, compress: tepracli turns the parts into the payload
+ - http: POST /prints to main.py running on CPython (python -m sim) on localhost
+ - inflate: the server decompresses the payload by a pair of lines
+ - print: Tepra prints the payload to a simulated LR30 over a fast simulated link
+
+The results are written as JSON. Pass the JSON of a former run as --baseline to
+report the stages that got slower by more than --tolerance.
+
+usage: python bench/bench_pipeline.py [--widths W ...] [--output results.json]
+                                      [--baseline results.json] [--tolerance 0.25]
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(root, 'client'))
+sys.path.insert(0, root)
+
+from bench_encoder import measure, random_label
+from tepracli import Client
+from tepracli.cache import CachedRenderer, RenderCache
+from tepracli.encoder import encode
+from tepracli.raster import binarize, compose
+from tepracli.render import load_font, render_image, render_qr, render_text
+
+import sim
+
+sim.install()
+
+from sim.printer import SimulatedLR30
+from stream import BufferReader, InflateReader
+from tepra import CompletionTracker, Tepra
+
+# A simulated link fast enough not to hide the time spent by Tepra itself
+_FAST_LINK = {'latency_ms': 1.0, 'packet_ms': 0.0, 'chunk_ms': 0.1, 'line_ms': 0.0}
+
+_TEXT = 'TEPRA Lite LR30 tepra-lite-esp32 '
+
+
+def text_of(width, font):
+    """Returns a text as wide as the width roughly."""
+    chars = max(1, width * len(_TEXT) // render_text(_TEXT, font).width)
+    return (_TEXT * (chars // len(_TEXT) + 1))[:chars]
+
+
+def render_text_of(width, font):
+    return render_text(text_of(width, font), font)
+
+
+def render_qrs_of(width, render=render_qr):
+    qrs = [render('https://example.com/{}'.format(0))]
+    while sum(im.width for im in qrs) < width:
+        qrs.append(render('https://example.com/{}'.format(len(qrs))))
+    return qrs
+
+
+def png_of(width):
+    buf = io.BytesIO()
+    random_label(width, seed=width).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+async def inflate(payload):
+    reader = InflateReader(BufferReader(payload).read, len(payload))
+    while await reader.read_pair() is not None:
+        pass
+    return reader.inflated
+
+
+class SimulatedPrinter:
+    """Tepra connected to a SimulatedLR30 in this process."""
+
+    def __init__(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.printer = sim.attach(SimulatedLR30(**_FAST_LINK))
+        self.tepra = Tepra(
+            handles_path=os.path.join(self._dir.name, 'handles.json'),
+            tracker=CompletionTracker(line_ms=_FAST_LINK['line_ms'], depth_line_ms=0),
+        )
+        self.tepra.activate()
+        self._loop = asyncio.new_event_loop()
+        if not self._loop.run_until_complete(self.tepra.connect()):
+            raise RuntimeError('failed to connect to the simulated printer')
+
+    def print(self, payload):
+        reader = InflateReader(BufferReader(payload).read, len(payload))
+        ok, err = self._loop.run_until_complete(self.tepra.print_stream(reader, 0))
+        if not ok:
+            raise RuntimeError('print failed: {}'.format(err))
+
+    def close(self):
+        self._loop.close()
+        self._dir.cleanup()
+
+
+class SimulatedServer:
+    """main.py served by python -m sim on localhost in a subprocess."""
+
+    def __init__(self):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+
+        args = ['--port', str(self.port)]
+        for k, v in _FAST_LINK.items():
+            if k != 'packet_ms':
+                args += ['--' + k.replace('_', '-'), str(v)]
+
+        self._proc = subprocess.Popen(
+            [sys.executable, '-m', 'sim'] + args,
+            cwd=root,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self.client = Client('127.0.0.1:{}'.format(self.port))
+
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.1):
+                    return
+            except OSError:
+                time.sleep(0.1)
+        self.close()
+        raise RuntimeError('the simulated server did not start')
+
+    def post(self, payload):
+        pid, err = self.client.post_print(payload)
+        if err:
+            raise RuntimeError(err)
+        return pid
+
+    def wait(self, pid):
+        while True:
+            pr, err = self.client.get_print(pid)
+            if err:
+                raise RuntimeError(err)
+            if pr['status'] == 'failed':
+                raise RuntimeError(pr['error'])
+            if pr['status'] == 'done':
+                return
+            time.sleep(0.01)
+
+    def close(self):
+        self._proc.terminate()
+        self._proc.wait()
+
+
+def run(widths, repeat):
+    font = load_font()
+    results = []
+
+    def record(stage, width, seconds, size=None):
+        results.append({'stage': stage, 'width': width, 'seconds': seconds, 'bytes': size})
+        rate = ' {:10.1f} KB/s'.format(size / seconds / 1024) if size and seconds else ''
+        print('width={:5d} {:14s} {:9.3f} ms{}'.format(width, stage, seconds * 1000, rate))
+
+    printer = SimulatedPrinter()
+    server = SimulatedServer()
+    cache_dir = tempfile.TemporaryDirectory()
+    renderer = CachedRenderer(RenderCache(cache_dir.name))
+    try:
+        for width in widths:
+            part = max(1, width // 3)
+
+            text = render_text_of(part, font)
+            qrs = render_qrs_of(part)
+            png = png_of(max(64, part))  # render_image() scales it to a multiple of 64px
+            record('render_text', width, measure(render_text_of, part, font, repeat=repeat))
+            record('render_qr', width, measure(render_qrs_of, part, repeat=repeat))
+            image = measure(lambda: render_image(io.BytesIO(png)), repeat=repeat)
+            record('render_image', width, image)
+
+            content = text_of(part, font)
+            renderer.text(content)  # Fill the cache
+            render_qrs_of(part, renderer.qr)
+            cached = lambda: (renderer.text(content), render_qrs_of(part, renderer.qr))
+            record('render_cached', width, measure(cached, repeat=repeat))
+
+            parts = [text] + qrs + [render_image(io.BytesIO(png))]
+            label = compose(parts)
+            record('compose', width, measure(compose, parts, repeat=repeat))
+
+            merged = binarize(label)
+            record('binarize', width, measure(binarize, label, repeat=repeat))
+
+            encoded = encode(merged)
+            record('encode', width, measure(encode, merged, repeat=repeat), len(encoded))
+
+            payload = zlib.compress(encoded)
+            record('compress', width, measure(zlib.compress, encoded, repeat=repeat), len(encoded))
+
+            def post_only():
+                start = time.perf_counter()
+                pid = server.post(payload)
+                elapsed = time.perf_counter() - start
+                server.wait(pid)  # Keep the queue empty for the next request
+                return elapsed
+
+            record('http', width, min(post_only() for _ in range(repeat)), len(payload))
+
+            n = asyncio.run(inflate(payload))
+            if n != len(encoded):
+                raise RuntimeError('inflated {} Bytes, expected {}'.format(n, len(encoded)))
+            record(
+                'inflate', width, measure(lambda: asyncio.run(inflate(payload)), repeat=repeat), n
+            )
+
+            printer.print(payload)
+            if printer.printer.jobs[-1].raster != encoded:
+                raise RuntimeError('the simulated printer received a different raster')
+            record('print', width, measure(printer.print, payload, repeat=repeat), n)
+    finally:
+        server.close()
+        printer.close()
+        cache_dir.cleanup()
+
+    return results
+
+
+def compare(baseline, results, tolerance):
+    """Returns the results slower than the baseline by more than the tolerance."""
+    before = {(r['stage'], r['width']): r['seconds'] for r in baseline['results']}
+    regressions = []
+    for r in results:
+        b = before.get((r['stage'], r['width']))
+        if b and r['seconds'] > b * (1 + tolerance):
+            regressions.append((r['stage'], r['width'], b, r['seconds']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--widths', type=int, nargs='+', default=[84, 300, 1000, 4000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write the results into this JSON file.')
+    parser.add_argument('--baseline', help='Compare with the results of a former run.')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = run(args.widths, args.repeat)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for stage, width, before, after in regressions:
+            print(
+                'REGRESSION width={} {}: {:.3f} ms -> {:.3f} ms'.format(
+                    width, stage, before * 1000, after * 1000
+                ),
+                file=sys.stderr,
+            )
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
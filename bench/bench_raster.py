@@ -0,0 +1,87 @@
+"""Compare the raster stages of tepracli with the former implementations.
+
+ - binarize(): the single-pass binarization and the former putpixel loop
+ - compose(): the single-canvas layout and the former merge loop
+
+usage: python bench/bench_raster.py [width ...]
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'client'))
+
+from PIL import Image
+
+from bench_encoder import measure, random_label
+from tepracli import min_width, height
+from tepracli.raster import binarize, compose
+
+
+def binarize_per_pixel(merged):
+    """The binarization which tepracli had used until binarize() was introduced."""
+    merged = merged.copy()
+    for x in range(merged.width):
+        for y in range(merged.height):
+            merged.putpixel((x, y), 255 if merged.getpixel((x, y)) >= 127 else 0)
+    return merged
+
+
+def compose_quadratic(rendered):
+    """The layout which tepracli had used until compose() was introduced."""
+    merged = rendered[0]
+    for im in rendered[1:]:
+        new = Image.new('L', (merged.width + im.width, height))
+        new.paste(merged, (0, 0))
+        new.paste(im, (merged.width, 0))
+        merged = new
+
+    assumed_width = max(min_width, merged.width)
+    if assumed_width % 2:
+        assumed_width += 1
+
+    if merged.width != assumed_width:
+        new = Image.new('L', (assumed_width, height), color='white')
+        new.paste(merged, (assumed_width // 2 - merged.width // 2, 0))
+        merged = new
+
+    return merged
+
+
+def main():
+    widths = [int(w) for w in sys.argv[1:]] or [84, 300, 1000, 4000]
+
+    for width in widths:
+        im = random_label(width, seed=width)
+
+        # Both binarizations must produce the identical image including the pixels valued 127
+        if binarize_per_pixel(im).tobytes() != binarize(im).tobytes():
+            print(f'width={width}: MISMATCH', file=sys.stderr)
+            return 1
+
+        before = measure(binarize_per_pixel, im)
+        after = measure(binarize, im)
+        print(
+            f'width={width:5d}px  per-pixel={before * 1000:9.3f}ms  '
+            f'bulk={after * 1000:7.3f}ms  x{before / after:.0f}'
+        )
+
+    for count in (1, 10, 100, 500):
+        rendered = [random_label(31 + n % 7, seed=n) for n in range(count)]
+
+        if compose_quadratic(rendered).tobytes() != compose(rendered).tobytes():
+            print(f'parts={count}: MISMATCH', file=sys.stderr)
+            return 1
+
+        before = measure(compose_quadratic, rendered)
+        after = measure(compose, rendered)
+        print(
+            f'parts={count:5d}    quadratic={before * 1000:9.3f}ms  '
+            f'linear={after * 1000:7.3f}ms  x{before / after:.0f}'
+        )
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -29,6 +29,7 @@ setup(
     packages=find_packages(),
     package_data={'tepracli': ['assets/ss3.ttf']},
     include_package_data=True,
-    install_requires=['click', 'pillow', 'qrcode[pil]', 'requests'],
+    install_requires=['click', 'numpy', 'pillow', 'qrcode[pil]', 'requests'],
+    extras_require={'numba': ['numba']},
     entry_points={'console_scripts': ['tepracli = tepracli.__main__:cmd']},
 )
@@ -1,17 +1,123 @@
-from typing import Tuple
+import json
+import os
+import socket
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from tepracli.encoder import ZLIB, compress, encode_batch, encodings
 
 min_width = 84
 height = 64  # px
 
 
+class Resolver:
+    """Resolves host names into IPv4 addresses and caches them for ttl seconds.
+
+    Resolving tepra.local with mDNS can take a while, so the cache is optionally
+    saved to a JSON file to be shared by runs of the CLI.
+    """
+
+    def __init__(self, ttl: float = 300, path: Optional[str] = None):
+        self.ttl = ttl
+        self._path = path
+        self._cache = None  # type: Optional[Dict[str, Tuple[str, float]]]
+
+    def _load(self) -> Dict[str, Tuple[str, float]]:
+        if self._cache is None:
+            self._cache = {}
+            if self._path:
+                try:
+                    with open(self._path) as f:
+                        self._cache = {k: tuple(v) for k, v in json.load(f).items()}
+                except (OSError, ValueError):
+                    pass
+        return self._cache
+
+    def _save(self):
+        if not self._path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self._path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._cache, f)
+            os.replace(tmp, self._path)
+        except OSError:
+            pass  # The cache is only an optimization
+
+    def resolve(self, host: str) -> str:
+        cache = self._load()
+        addr, expires = cache.get(host, (None, 0))
+        if addr is not None and time.time() < expires:
+            return addr
+
+        addr = socket.gethostbyname(host)
+        cache[host] = (addr, time.time() + self.ttl)
+        self._save()
+        return addr
+
+    def forget(self, host: str):
+        """Drop the cached address, e.g. after it failed to connect."""
+        if self._load().pop(host, None) is not None:
+            self._save()
+
+
 class Client:
-    def __init__(self, origin):
+    """A client of tepra-lite-esp32 reusing a connection for the requests.
+
+    origin is a host name or an address with an optional port. Connection errors are
+    retried retries times with an exponential backoff from backoff seconds. timeout
+    is (connect, read) in seconds as requests takes.
+    """
+
+    def __init__(
+        self,
+        origin: str,
+        timeout=(3.05, 30),
+        retries: int = 3,
+        backoff: float = 0.5,
+        resolver: Optional[Resolver] = None,
+    ):
         self.origin = origin
+        self.timeout = timeout
+        self._resolver = resolver if resolver is not None else Resolver()
+        self.encodings = encodings  # Narrowed down to the ones the server accepts
+
+        # Only failures to connect are retried as a request might have been processed otherwise
+        retry = Retry(
+            total=retries, connect=retries, read=0, redirect=0, status=0, backoff_factor=backoff
+        )
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(max_retries=retry))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._session.close()
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        host, sep, port = self.origin.partition(':')
+        addr = self._resolver.resolve(host)
+        try:
+            return self._session.request(
+                method, f'http://{addr}{sep}{port}{path}', timeout=self.timeout, **kwargs
+            )
+        except requests.ConnectionError:
+            # The address may have changed, e.g. the ESP32 got another one by DHCP
+            self._resolver.forget(host)
+            raise
 
     def get_battery(self) -> Tuple[int, str]:
-        res = requests.get(f'http://{self.origin}/battery')
+        res = self._request('GET', '/battery')
         if res.status_code != 200:
             return 0, f'the server returned non-200: {res.status_code}'
 
@@ -23,21 +129,82 @@ class Client:
         return bat, ''
 
     def post_depth(self, depth: int) -> str:
-        res = requests.post(f'http://{self.origin}/depth', json={'depth': depth})
+        res = self._request('POST', '/depth', json={'depth': depth})
         j = res.json()
         err = j.get('error', '')
         if err:
             return f'Printer returned an error: {err}'
         return ''
 
-    def post_print(self, compressed_image: bytes) -> str:
-        res = requests.post(
-            f'http://{self.origin}/prints',
-            compressed_image,
-            headers={'Content-Type': 'application/octet-stream'},
+    def post_print(self, compressed_image: bytes, encoding: str = ZLIB) -> Tuple[int, str]:
+        """Queue an image to print. Returns the ID of the print to check its status."""
+        res = self._post_print(compressed_image, encoding)
+        j = res.json()
+        err = j.get('error', '')
+        if err:
+            return 0, f'Printer returned an error: {err}'
+        return j['print']['id'], ''
+
+    def _post_print(self, payload: bytes, encoding: str) -> requests.Response:
+        return self._request(
+            'POST',
+            '/prints',
+            data=payload,
+            headers={'Content-Type': 'application/octet-stream', 'Content-Encoding': encoding},
         )
+
+    def post_lines(self, lines: bytes) -> Tuple[int, str]:
+        """Queue encoded lines compressed in the smallest encoding the server accepts.
+
+        A server answering 415 tells the encodings it accepts. A former server only
+        accepts zlib and answers 400 to the others, so it falls back to zlib then.
+        """
+
+        payload, encoding = compress(lines, self.encodings)
+        res = self._post_print(payload, encoding)
+        if res.status_code in (400, 415) and encoding != ZLIB:
+            accepted = res.json().get('encodings') if res.status_code == 415 else None
+            self.encodings = tuple(e for e in self.encodings if e in (accepted or (ZLIB,)))
+            payload, encoding = compress(lines, self.encodings)
+            res = self._post_print(payload, encoding)
+
         j = res.json()
         err = j.get('error', '')
         if err:
-            return f'Printer returned an error: {err}'
-        return ''
+            return 0, f'Printer returned an error: {err}'
+        return j['print']['id'], ''
+
+    def get_print(self, pid: int) -> Tuple[dict, str]:
+        """Get the status of a print: queued, printing, done or failed."""
+        res = self._request('GET', f'/prints/{pid}')
+        j = res.json()
+        err = j.get('error', '')
+        if err:
+            return {}, f'Printer returned an error: {err}'
+        return j['print'], ''
+
+    def post_batch(self, labels: List[Tuple[bytes, int]]) -> Tuple[dict, str]:
+        """Queue labels given as (compressed image, depth) to print back to back.
+
+        Returns the batch with the IDs of its prints.
+        """
+        res = self._request(
+            'POST',
+            '/batches',
+            data=encode_batch(labels),
+            headers={'Content-Type': 'application/vnd.tepra-batch'},
+        )
+        j = res.json()
+        err = j.get('error', '')
+        if err:
+            return {}, f'Printer returned an error: {err}'
+        return j['batch'], ''
+
+    def get_batch(self, bid: int) -> Tuple[dict, str]:
+        """Get the status of a batch and each of its prints."""
+        res = self._request('GET', f'/batches/{bid}')
+        j = res.json()
+        err = j.get('error', '')
+        if err:
+            return {}, f'Printer returned an error: {err}'
+        return j['batch'], ''
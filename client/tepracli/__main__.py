@@ -1,16 +1,22 @@
-import gzip
-import importlib
 import pathlib
-import socket
 import sys
-import zlib
-from io import BytesIO
+import time
 
 import click
-import qrcode
-from PIL import Image, ImageDraw, ImageFont
 
-from tepracli import Client, min_width, height
+from tepracli import Client, Resolver
+from tepracli.cache import CachedRenderer, RenderCache, default_directory
+from tepracli.dither import dither_image, methods as dither_methods
+from tepracli.encoder import encode
+from tepracli.raster import binarize, compose, default_threshold
+from tepracli.render import (
+    default_fontsize,
+    load_font,
+    render_image,
+    render_qr,
+    render_space,
+    render_text,
+)
 
 
 # Based on: https://stackoverflow.com/questions/65742330/preserving-the-order-of-user-provided-parameters-with-python-click
@@ -31,6 +37,11 @@ class OrderedParamsCommand(click.Command):
         return super().parse_args(ctx, args)
 
 
+def cached_resolver() -> Resolver:
+    """Returns a resolver sharing resolved addresses among runs, e.g. of tepra.local."""
+    return Resolver(path=str(default_directory() / 'hosts.json'))
+
+
 @click.group()
 @click.pass_context
 def cmd(ctx):
@@ -46,9 +57,8 @@ def cmd(ctx):
 )
 @click.pass_context
 def battery(ctx, address):
-    actual_address = socket.gethostbyname(address)
-    c = Client(actual_address)
-    bat, err = c.get_battery()
+    with Client(address, resolver=cached_resolver()) as c:
+        bat, err = c.get_battery()
     if err:
         print(f'Failed to get remaining battery: {err}')
     else:
@@ -63,19 +73,49 @@ def battery(ctx, address):
     help='The IP address or the URL of TEPRA Lite LR30. (default = tepra.local)',
 )
 @click.option('--preview', is_flag=True, help='Generate preview.png without printing.')
-@click.option('--font', '-f', type=click.Path(exists=True, path_type=pathlib.Path), help='Path to a font file. (default = bundled Adobe Source Sans)')
+@click.option('--wait', '-w', is_flag=True, help='Wait until the label is printed.')
+@click.option(
+    '--font',
+    '-f',
+    type=click.Path(exists=True, path_type=pathlib.Path),
+    help='Path to a font file. (default = bundled Adobe Source Sans)',
+)
 @click.option(
-    '--fontsize', '-S', default=30, type=click.IntRange(0), help='Font size. [px] (default = 30)'
+    '--fontsize',
+    '-S',
+    default=default_fontsize,
+    type=click.IntRange(0),
+    help=f'Font size. [px] (default = {default_fontsize})',
 )
 @click.option(
     '--depth', '-d', default=0, type=click.IntRange(-3, 3), help='Depth of color. (default = 0)'
 )
+@click.option(
+    '--threshold',
+    '-t',
+    default=default_threshold,
+    type=click.IntRange(0, 255),
+    help=f'Pixels darker than this value turn black. (default = {default_threshold})',
+)
+@click.option(
+    '--dither',
+    type=click.Choice(dither_methods),
+    help='Dither images instead of thresholding, e.g. for photos.',
+)
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    help='Directory to cache rendered texts and QR codes. (default = ~/.cache/tepracli)',
+)
+@click.option('--no-cache', is_flag=True, help='Render every part without the cache.')
 @click.option('--message', '-m', multiple=True, help='Print a text.')
 @click.option('--space', '-s', multiple=True, help='Leave space between parts. [px]')
 @click.option('--qr', '-q', multiple=True, help='Draw a QR code.')
 @click.option('--image', '-i', multiple=True, help='Paste an image.')
 @click.pass_context
-def do_print(ctx, address, preview, font, fontsize, depth, **_):
+def do_print(
+    ctx, address, preview, wait, font, fontsize, depth, threshold, dither, cache_dir, no_cache, **_
+):
     if ctx.obj.get('parts') is None:
         print(
             'Please specify at least one part with -m/--message, -s/--space, and -q/--qr',
@@ -83,99 +123,62 @@ def do_print(ctx, address, preview, font, fontsize, depth, **_):
         )
         sys.exit(1)
 
-    if not font:
-        font = importlib.resources.files('tepracli.assets').joinpath('ss3.ttf.gz')
-
-    if font.suffixes[-1] == '.gz':
-        with open(font, 'rb') as gz:
-            font = BytesIO(gzip.decompress(gz.read()))
-
-    font = ImageFont.truetype(font, fontsize)
+    if no_cache:
+        font = load_font(font, fontsize)
+        text, qr = lambda content: render_text(content, font), render_qr
+    else:
+        # The font is loaded only if a text isn't in the cache
+        renderer = CachedRenderer(RenderCache(cache_dir), font, fontsize)
+        text, qr = renderer.text, renderer.qr
 
     rendered = []
 
     for typ, content in ctx.obj['parts']:
         if typ.name == 'message':
-            actual_width = font.getmask(content).getbbox()[2] + 2  # add 2px for safe anti-aliasing
-            im = Image.new('L', (actual_width, height), 'white')
-            draw = ImageDraw.Draw(im)
-            draw.text(
-                (actual_width // 2, height // 2), content, font=font, fill='black', anchor='mm'
-            )
-            rendered.append(im)
+            rendered.append(text(content))
         elif typ.name == 'space':
-            im = Image.new('L', (int(content), height), 'white')
-            rendered.append(im)
+            rendered.append(render_space(int(content)))
         elif typ.name == 'qr':
-            qr = qrcode.QRCode(error_correction=qrcode.ERROR_CORRECT_L, box_size=1, border=0)
-            qr.add_data(content)
-            qr.make()
-            im = qr.make_image()
-            # rendered.append(im)
-            if im.height <= height // 2:
-                im = im.resize((im.width * 2, im.height * 2), resample=Image.NEAREST)
-            elif im.height > 64:
-                print(
-                    f'Generated QR code exceeds 64px ({im.height}px). Please try a shorter string.',
-                    file=sys.stderr,
-                )
+            try:
+                rendered.append(qr(content))
+            except ValueError as e:
+                print(e, file=sys.stderr)
                 sys.exit(1)
-            newim = Image.new('L', (im.width, 64), 'white')
-            newim.paste(im, (0, 64 // 2 - im.height // 2))
-            rendered.append(newim)
         elif typ.name == 'image':
-            im = Image.open(content)
-            new_width = height * int(im.size[0] / im.size[1])
-            new_height = height
-            rendered.append(im.resize((new_width, new_height)))
-
-    merged = rendered[0]
-    for im in rendered[1:]:
-        new = Image.new('L', (merged.width + im.width, height))
-        new.paste(merged, (0, 0))
-        new.paste(im, (merged.width, 0))
-        merged = new
-
-    # Valid image
-    # 1. The image must be more than 84px in width
-    # 2. The image width must be aligned to multiple of 2
-    assumed_width = max(min_width, merged.width)
-    if assumed_width % 2:
-        assumed_width += 1
-
-    if merged.width != assumed_width:
-        new = Image.new('L', (assumed_width, height), color='white')
-        new.paste(merged, (assumed_width // 2 - merged.width // 2, 0))
-        merged = new
-
-    for x in range(merged.width):
-        for y in range(merged.height):
-            merged.putpixel((x, y), 255 if merged.getpixel((x, y)) >= 127 else 0)
+            rendered.append(render_image(content))
+
+    merged = compose(rendered)
+    merged = dither_image(merged, dither) if dither else binarize(merged, threshold)
 
     if preview:
         merged.save('preview.png')
         sys.exit(0)
 
-    im = merged.rotate(-90, expand=True)
-    encoded = b''
-    for y in range(im.height):
-        aggregated = 0
-        for shift, x in enumerate(range(im.width - 1, -1, -1)):
-            if im.getpixel((x, y)) <= 127:
-                aggregated += 1 << shift
-        line = aggregated.to_bytes(8, 'big')
-        encoded += line
+    encoded = encode(merged)
 
-    actual_address = socket.gethostbyname(address)
-    c = Client(actual_address)
+    # The connection is kept alive for the requests below
+    c = Client(address, resolver=Resolver() if no_cache else cached_resolver())
 
     err = c.post_depth(depth)
     if err:
         print(f'Failed to POST depth: {err}', file=sys.stderr)
 
-    err = c.post_print(zlib.compress(encoded))
+    pid, err = c.post_lines(encoded)
     if err:
         print(f'Failed to POST print: {err}', file=sys.stderr)
+        sys.exit(1)
+
+    while wait:
+        pr, err = c.get_print(pid)
+        if err:
+            print(f'Failed to GET print: {err}', file=sys.stderr)
+            sys.exit(1)
+        elif pr['status'] == 'failed':
+            print(f'Failed to print: {pr["error"]}', file=sys.stderr)
+            sys.exit(1)
+        elif pr['status'] == 'done':
+            break
+        time.sleep(0.5)
 
 
 cmd()
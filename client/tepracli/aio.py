@@ -0,0 +1,448 @@
+"""An asyncio client of tepra-lite-esp32 and a dispatcher for many of them.
+
+AsyncClient speaks HTTP/1.1 over asyncio streams and keeps the connection alive
+between requests. Fleet spreads labels across several bridges, each with its own
+LR30, sending a label to a bridge only when it's reachable, has enough battery
+and has room in its queue.
+"""
+
+import asyncio
+import json
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tepracli import Resolver
+from tepracli.encoder import ZLIB, encode_batch
+
+# Methods safe to send again when it's unknown whether the server processed them
+_idempotent = ('GET', 'HEAD')
+
+
+class HttpError(Exception):
+    pass
+
+
+class AsyncClient:
+    """An asyncio version of tepracli.Client.
+
+    Requests are sent one at a time over a kept-alive connection. A request failing
+    on a reused connection, which the server may have closed for being idle, is sent
+    once more over a new connection if it's idempotent or failed before it was fully
+    written, not to print a label twice. timeout is in seconds for each request.
+    """
+
+    def __init__(self, origin: str, timeout: float = 30, resolver: Optional[Resolver] = None):
+        self.origin = origin
+        self.timeout = timeout
+        self._resolver = resolver if resolver is not None else Resolver()
+        self._lock = asyncio.Lock()
+        self._reader = None  # type: Optional[asyncio.StreamReader]
+        self._writer = None  # type: Optional[asyncio.StreamWriter]
+        self._written = False  # Whether the current request was fully written
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _connect(self):
+        host, _, port = self.origin.partition(':')
+        addr = await asyncio.get_running_loop().run_in_executor(None, self._resolver.resolve, host)
+        try:
+            self._reader, self._writer = await asyncio.open_connection(addr, int(port or 80))
+        except OSError:
+            self._resolver.forget(host)
+            raise
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes = b'',
+        content_type: Optional[str] = None,
+        encoding: Optional[str] = None,
+    ) -> Tuple[int, bytes]:
+        """Returns the status code and the body.
+
+        Raises OSError, HttpError or asyncio.TimeoutError.
+        """
+        async with self._lock:
+            if self._reader is not None and self._reader.at_eof():
+                await self.close()  # Closed by the server while idle
+            reused = self._writer is not None
+            self._written = False
+            try:
+                if not reused:
+                    await self._connect()
+                return await self._timed_exchange(method, path, body, content_type, encoding)
+            except (OSError, asyncio.IncompleteReadError, HttpError):
+                # The server may have processed a request it received
+                if not reused or (self._written and method not in _idempotent):
+                    raise
+            # Send it again over a new connection as the old one was closed by the server
+            await self._connect()
+            return await self._timed_exchange(method, path, body, content_type, encoding)
+
+    async def _timed_exchange(
+        self, method, path, body, content_type, encoding
+    ) -> Tuple[int, bytes]:
+        try:
+            return await asyncio.wait_for(
+                self._exchange(method, path, body, content_type, encoding), self.timeout
+            )
+        except BaseException:
+            # Don't leave a response half read on the connection
+            await self.close()
+            raise
+
+    async def _exchange(self, method, path, body, content_type, encoding) -> Tuple[int, bytes]:
+        host = self.origin.partition(':')[0]
+        head = f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n'
+        if content_type:
+            head += f'Content-Type: {content_type}\r\n'
+        if encoding:
+            head += f'Content-Encoding: {encoding}\r\n'
+        self._writer.write(head.encode() + b'\r\n' + body)
+        await self._writer.drain()
+        self._written = True
+
+        status_line = await self._reader.readline()
+        items = status_line.decode('ascii', 'replace').split(None, 2)
+        if len(items) < 2 or not items[1].isdigit():
+            raise HttpError(f'invalid status line: {status_line!r}')
+        status = int(items[1])
+
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                raise HttpError('the connection was closed in the headers')
+            if line in (b'\r\n', b'\n'):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = headers.get('content-length')
+        if length is None:
+            # Responses of a server without keep-alive end with the connection
+            data = await self._reader.read()
+            await self.close()
+        else:
+            data = await self._reader.readexactly(int(length))
+            if headers.get('connection', '').lower() == 'close':
+                await self.close()
+        return status, data
+
+    async def _json(
+        self, method, path, body=b'', content_type=None, encoding=None
+    ) -> Tuple[dict, str]:
+        _, j, err = await self._status_json(method, path, body, content_type, encoding)
+        return j, err
+
+    async def _status_json(
+        self, method, path, body=b'', content_type=None, encoding=None
+    ) -> Tuple[int, dict, str]:
+        """Returns the status code, 0 if there's no valid response, the body and an error."""
+        try:
+            status, data = await self.request(method, path, body, content_type, encoding)
+            j = json.loads(data)
+        except (OSError, asyncio.TimeoutError, HttpError, ValueError) as e:
+            return 0, {}, f'failed to request {method} {path}: {e!r}'
+        if isinstance(j, dict) and j.get('error'):
+            return status, j, f'Printer returned an error: {j["error"]}'
+        if status >= 400:
+            return status, {}, f'the server returned {status}'
+        return status, j, ''
+
+    async def get_battery(self) -> Tuple[int, str]:
+        j, err = await self._json('GET', '/battery')
+        if err:
+            return 0, err
+        bat = j.get('battery')
+        if bat is None:
+            return 0, f'unexpected body: {j}'
+        return bat, ''
+
+    async def post_depth(self, depth: int) -> str:
+        body = json.dumps({'depth': depth}).encode()
+        _, err = await self._json('POST', '/depth', body, 'application/json')
+        return err
+
+    async def post_print(self, compressed_image: bytes, encoding: str = ZLIB) -> Tuple[int, str]:
+        """Queue an image to print. Returns the ID of the print to check its status."""
+        j, err = await self._json(
+            'POST', '/prints', compressed_image, 'application/octet-stream', encoding
+        )
+        if err:
+            return 0, err
+        return j['print']['id'], ''
+
+    async def get_print(self, pid: int) -> Tuple[dict, str]:
+        """Get the status of a print: queued, printing, done or failed."""
+        j, err = await self._json('GET', f'/prints/{pid}')
+        return ({}, err) if err else (j['print'], '')
+
+    async def _list(self, path) -> Tuple[list, str]:
+        try:
+            status, data = await self.request('GET', path)
+            items = json.loads(data)
+        except (OSError, asyncio.TimeoutError, HttpError, ValueError) as e:
+            return [], f'failed to request GET {path}: {e!r}'
+        if status != 200 or not isinstance(items, list):
+            return [], f'the server returned {status}'
+        return items, ''
+
+    async def get_prints(self) -> Tuple[list, str]:
+        """Get the prints in the queue and the finished ones, except those of batches."""
+        return await self._list('/prints')
+
+    async def get_batches(self) -> Tuple[list, str]:
+        """Get the batches in the queue and the finished ones."""
+        return await self._list('/batches')
+
+    async def post_batch(self, labels: List[Tuple[bytes, int]]) -> Tuple[dict, str]:
+        """Queue labels given as (compressed image, depth) to print back to back."""
+        body = encode_batch(labels)
+        j, err = await self._json('POST', '/batches', body, 'application/vnd.tepra-batch')
+        return ({}, err) if err else (j['batch'], '')
+
+    async def get_batch(self, bid: int) -> Tuple[dict, str]:
+        """Get the status of a batch and each of its prints."""
+        j, err = await self._json('GET', f'/batches/{bid}')
+        return ({}, err) if err else (j['batch'], '')
+
+
+class PrinterStats:
+    """What a bridge of a Fleet has printed."""
+
+    def __init__(self):
+        self.labels = 0
+        self.failed = 0
+        self.bytes = 0
+        self.busy = 0.0  # Seconds with labels sent and not printed yet
+        self.battery = None  # type: Optional[int]
+        self.pending = None  # type: Optional[int]
+        self.available = True
+        self.in_flight = 0  # Labels sent by the Fleet and not printed yet
+        self._busy_since = 0.0
+
+    def sent(self):
+        if not self.in_flight:
+            self._busy_since = time.monotonic()
+        self.in_flight += 1
+
+    def finished(self):
+        self.in_flight -= 1
+        if not self.in_flight:
+            self.busy += time.monotonic() - self._busy_since
+
+    @property
+    def labels_per_s(self) -> float:
+        return self.labels / self.busy if self.busy else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'labels': self.labels,
+            'failed': self.failed,
+            'bytes': self.bytes,
+            'busy_s': round(self.busy, 3),
+            'labels_per_s': round(self.labels_per_s, 3),
+            'battery': self.battery,
+            'pending': self.pending,
+            'in_flight': self.in_flight,
+            'available': self.available,
+        }
+
+
+class Fleet:
+    """Spreads labels across bridges of tepra-lite-esp32 with an AsyncClient for each.
+
+    A worker per bridge takes the next label when the bridge has less than
+    max_pending prints queued or printing, counting those of batches and of other
+    clients, and at least min_battery percent of battery, checking them every
+    poll_interval seconds. A label is followed until it's printed in the background,
+    so with max_pending > 1 the next one is sent while it prints. A bridge answering
+    503 for a full queue is tried again after poll_interval. A bridge failing to
+    respond max_errors times in a row, or taking no label for max_wait seconds, is
+    given up. A label it failed to take goes to the others, while a label it took is
+    reported as failed not to print it twice.
+    """
+
+    def __init__(
+        self,
+        origins: Iterable[str],
+        min_battery: int = 10,
+        max_pending: int = 1,
+        poll_interval: float = 0.2,
+        max_errors: int = 3,
+        timeout: float = 30,
+        resolver: Optional[Resolver] = None,
+        max_wait: float = 60,
+    ):
+        resolver = resolver if resolver is not None else Resolver()
+        self.clients = {o: AsyncClient(o, timeout, resolver) for o in origins}
+        self.stats = {o: PrinterStats() for o in self.clients}
+        self.min_battery = min_battery
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.max_errors = max_errors
+        self.max_wait = max_wait
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await asyncio.gather(*(c.close() for c in self.clients.values()))
+
+    async def poll(self, origin: str) -> bool:
+        """Update the battery and the number of pending prints of a bridge.
+
+        Returns False if the bridge is unreachable. The battery is None until the
+        bridge knows it.
+        """
+        client, stats = self.clients[origin], self.stats[origin]
+        try:
+            status, data = await client.request('GET', '/battery')
+            battery = json.loads(data).get('battery') if status == 200 else None
+            status, data = await client.request('GET', '/prints')
+            prints = json.loads(data) if status == 200 else []
+            status, data = await client.request('GET', '/batches')
+            batches = json.loads(data) if status == 200 else []
+        except (OSError, asyncio.TimeoutError, HttpError, ValueError):
+            return False
+
+        # GET /prints doesn't list the prints of batches, which the Fleet sends labels as
+        prints += [pr for batch in batches for pr in batch['prints']]
+        stats.battery = battery
+        stats.pending = sum(1 for pr in prints if pr['status'] in ('queued', 'printing'))
+        return True
+
+    async def status(self) -> Dict[str, dict]:
+        """Poll every bridge and return their statistics."""
+        await asyncio.gather(*(self.poll(o) for o in self.clients))
+        return {o: s.to_dict() for o, s in self.stats.items()}
+
+    async def print_all(self, labels: Iterable[Tuple[bytes, int]]) -> List[Tuple[str, str]]:
+        """Print labels given as (compressed image, depth) across the bridges.
+
+        Returns (origin, error) for each label in the order of the labels. error is
+        empty if the label is printed.
+        """
+
+        labels = list(labels)
+        queue = asyncio.Queue()
+        for i, label in enumerate(labels):
+            queue.put_nowait((i, label))
+        results = [('', 'no printer was available')] * len(labels)
+
+        sending = [0]  # Labels being posted, which come back to the queue on failure
+        await asyncio.gather(*(self._work(o, queue, results, sending) for o in self.clients))
+        return results
+
+    async def _ready(self, origin: str, queue: asyncio.Queue, sending: list, deadline) -> bool:
+        """Wait until the bridge can take a label.
+
+        Returns False if it's given up, or if no label is left to take.
+        """
+        stats = self.stats[origin]
+        errors = 0
+        while True:
+            if queue.empty() and not sending[0]:
+                return False
+            if not await self.poll(origin):
+                errors += 1
+                if errors >= self.max_errors:
+                    stats.available = False
+                    return False
+            elif stats.battery is not None and stats.battery < self.min_battery:
+                stats.available = False
+                return False
+            elif stats.battery is not None and stats.pending < self.max_pending:
+                return True
+            else:
+                errors = 0
+            if time.monotonic() >= deadline:
+                # The battery stays unknown or the queue is kept full by others
+                stats.available = False
+                return False
+            await asyncio.sleep(self.poll_interval)
+
+    async def _work(self, origin: str, queue: asyncio.Queue, results: list, sending: list):
+        client, stats = self.clients[origin], self.stats[origin]
+        tracking = []  # Tasks waiting for the labels sent to the bridge to be printed
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while True:
+                if queue.empty():
+                    if not sending[0]:
+                        return
+                    # A label being sent by another bridge may come back to the queue
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                if not await self._ready(origin, queue, sending, deadline):
+                    return
+                try:
+                    i, (payload, depth) = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    continue
+
+                sending[0] += 1
+                try:
+                    body = encode_batch([(payload, depth)])
+                    status, j, err = await client._status_json(
+                        'POST', '/batches', body, 'application/vnd.tepra-batch'
+                    )
+                    if err:
+                        # Put it back while it counts as being sent, so the others don't quit
+                        queue.put_nowait((i, (payload, depth)))
+                finally:
+                    sending[0] -= 1
+                if status == 503:
+                    # The queue is filled by others, so back off and try again
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                if err:
+                    # The bridge may be lost
+                    stats.available = False
+                    return
+
+                # Send the next label while it's printed if max_pending allows
+                stats.sent()
+                deadline = time.monotonic() + self.max_wait
+                pr = j['batch']['prints'][0]
+                tracking.append(asyncio.ensure_future(self._track(origin, i, pr, payload, results)))
+        finally:
+            await asyncio.gather(*tracking)
+
+    async def _track(self, origin: str, i: int, pr: dict, payload: bytes, results: list):
+        client, stats = self.clients[origin], self.stats[origin]
+        err = ''
+        try:
+            while pr['status'] not in ('done', 'failed'):
+                await asyncio.sleep(self.poll_interval)
+                pr, err = await client.get_print(pr['id'])
+                if err:
+                    break
+        finally:
+            stats.finished()
+
+        if err or pr['status'] == 'failed':
+            stats.failed += 1
+            results[i] = (origin, err or pr['error'])
+        else:
+            stats.labels += 1
+            stats.bytes += len(payload)
+            results[i] = (origin, '')
@@ -0,0 +1,196 @@
+import gzip
+import hashlib
+import os
+import pathlib
+import tempfile
+from importlib.metadata import version
+from typing import Optional
+
+import PIL
+from PIL import Image
+
+from tepracli.render import (
+    default_font_path,
+    default_fontsize,
+    load_font,
+    render_qr,
+    render_text,
+)
+
+default_max_bytes = 32 * 1024 * 1024
+
+
+def default_directory() -> pathlib.Path:
+    base = os.environ.get('XDG_CACHE_HOME') or pathlib.Path.home() / '.cache'
+    return pathlib.Path(base) / 'tepracli'
+
+
+class RenderCache:
+    """Stores rendered 64px-tall parts as PNG files in a directory.
+
+    The least recently used parts are evicted when the parts exceed max_bytes in
+    total. A part is marked as used by touching its file, so the cache can be shared
+    among processes. The total is counted by a scan of the directory at the first
+    put and tallied by the puts after it, so parts added by other processes are
+    counted at the next scan. Decompressed fonts are kept in the fonts/ subdirectory
+    apart from the parts and never evicted. Failures to write are ignored as the cache
+    is only an optimization.
+    """
+
+    def __init__(self, directory: Optional[pathlib.Path] = None, max_bytes=default_max_bytes):
+        self.directory = pathlib.Path(directory or default_directory())
+        self.max_bytes = max_bytes
+        self._parts = self.directory / 'parts'
+        self._fonts = self.directory / 'fonts'
+        self._total = None  # Bytes of the parts, known after the first scan
+
+    @staticmethod
+    def key(*fields) -> str:
+        h = hashlib.sha256()
+        for f in fields:
+            h.update(repr(f).encode())
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        path = self._parts / (key + '.png')
+        try:
+            with Image.open(path) as im:
+                im.load()
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return im
+
+    def put(self, key: str, im: Image.Image):
+        path = self._parts / (key + '.png')
+        try:
+            self._parts.mkdir(parents=True, exist_ok=True)
+            self._write(path, lambda f: im.save(f, 'PNG'))
+
+            # Scan the parts only once and when the tally exceeds max_bytes, not on every put
+            if self._total is None:
+                self.evict()
+            else:
+                self._total += path.stat().st_size
+                if self._total > self.max_bytes:
+                    self.evict()
+        except OSError:
+            pass  # e.g. a read-only or full disk, the part is rendered again next time
+
+    def evict(self):
+        """Remove the least recently used parts until they fit in 3/4 of max_bytes.
+
+        Evicting below max_bytes leaves room for the next parts not to scan the
+        directory again on every put once the cache is full.
+        """
+
+        entries = []
+        total = 0
+        with os.scandir(self._parts) as it:
+            for e in it:
+                # Skip the temporary files being written by _write() of other processes
+                if not e.name.endswith('.png'):
+                    continue
+                try:
+                    st = e.stat()
+                except FileNotFoundError:
+                    continue  # Another process evicted it
+                entries.append((st.st_mtime, st.st_size, e.path))
+                total += st.st_size
+
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * 3 // 4:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass  # Another process evicted it
+                total -= size
+        self._total = total
+
+    def font(self, path: pathlib.Path, digest: str) -> pathlib.Path:
+        """Returns the path of the font decompressed from a gzipped font.
+
+        The gzipped font itself is returned if it can't be cached, which load_font()
+        decompresses in memory.
+        """
+        decompressed = self._fonts / (digest + '.ttf')
+        if not decompressed.exists():
+            with open(path, 'rb') as gz:
+                data = gzip.decompress(gz.read())
+            try:
+                self._fonts.mkdir(parents=True, exist_ok=True)
+                self._write(decompressed, lambda f: f.write(data))
+            except OSError:
+                return path
+        return decompressed
+
+    @staticmethod
+    def _write(path: pathlib.Path, write):
+        # Write into a temporary file and rename it not to expose a partial file
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+
+class CachedRenderer:
+    """Renders texts and QR codes through a RenderCache.
+
+    Parts are keyed by their type, content, the hash of the font file, the font size
+    and the versions of the renderers. The font is loaded only when a text misses.
+    """
+
+    def __init__(
+        self,
+        cache: RenderCache,
+        font_path: Optional[pathlib.Path] = None,
+        fontsize: int = default_fontsize,
+    ):
+        self._cache = cache
+        self._font_path = font_path
+        self._fontsize = fontsize
+        self._font = None
+        self._font_digest = None
+
+    def _digest(self) -> str:
+        if self._font_digest is None:
+            path = self._font_path or default_font_path()
+            with open(path, 'rb') as f:
+                self._font_digest = hashlib.sha256(f.read()).hexdigest()
+        return self._font_digest
+
+    def _load_font(self):
+        if self._font is None:
+            path = self._font_path or default_font_path()
+            if path.suffixes[-1:] == ['.gz']:
+                path = self._cache.font(path, self._digest())
+            self._font = load_font(path, self._fontsize)
+        return self._font
+
+    def text(self, content: str) -> Image.Image:
+        key = self._cache.key('text', content, self._digest(), self._fontsize, PIL.__version__)
+        im = self._cache.get(key)
+        if im is None:
+            im = render_text(content, self._load_font())
+            self._cache.put(key, im)
+        return im
+
+    def qr(self, content: str) -> Image.Image:
+        """Draw a QR code. Raises ValueError if it doesn't fit in 64px as render_qr."""
+        key = self._cache.key('qr', content, version('qrcode'), PIL.__version__)
+        im = self._cache.get(key)
+        if im is None:
+            im = render_qr(content)
+            self._cache.put(key, im)
+        return im
@@ -0,0 +1,149 @@
+"""Convert images into compressed payloads of POST /prints in parallel.
+
+Each image is resized to 64px in height, dithered, packed into lines and
+compressed with zlib into <stem>.bin in the output directory. A manifest in the
+output directory records the SHA-256 of each input with the conversion options,
+so that unchanged inputs are skipped next time.
+"""
+
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+from tepracli import height
+from tepracli.dither import FLOYD_STEINBERG, default_gamma, dither_image
+from tepracli.encoder import encode
+from tepracli.raster import compose
+
+manifest_name = '.pic2bin.json'
+extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp')
+
+# Bump it when the output of the same input and options changes
+_version = 1
+
+CONVERTED, SKIPPED, FAILED = 'converted', 'skipped', 'failed'
+
+
+def find_images(pattern: str) -> List[pathlib.Path]:
+    """Returns the images in a directory or matching a glob pattern, sorted by path."""
+    if os.path.isdir(pattern):
+        paths = (p for p in pathlib.Path(pattern).iterdir() if p.suffix.lower() in extensions)
+    else:
+        paths = (pathlib.Path(p) for p in glob.glob(pattern, recursive=True))
+    return sorted(p for p in paths if p.is_file())
+
+
+def convert_image(im: Image.Image, method: str = FLOYD_STEINBERG, gamma=default_gamma) -> bytes:
+    """Returns the compressed payload of an image of any size."""
+    im = im.convert('L')
+    if im.height != height:
+        width = max(1, round(im.width * height / im.height))
+        im = im.resize((width, height), Image.LANCZOS)
+    return zlib.compress(encode(compose([dither_image(im, method, gamma)])))
+
+
+def _digest(data: bytes, method: str, gamma) -> str:
+    h = hashlib.sha256(data)
+    h.update(repr((_version, method, gamma)).encode())
+    return h.hexdigest()
+
+
+def _convert(job) -> Tuple[str, str, str]:
+    """Convert an image unless its digest is the known one. Runs in a worker process.
+
+    Returns (digest, status, error).
+    """
+    src, dst, known, method, gamma = job
+    try:
+        with open(src, 'rb') as f:
+            data = f.read()
+        digest = _digest(data, method, gamma)
+        if digest == known and os.path.exists(dst):
+            return digest, SKIPPED, ''
+
+        with Image.open(src) as im:
+            payload = convert_image(im, method, gamma)
+        _write(dst, payload)
+        return digest, CONVERTED, ''
+    except (OSError, ValueError, EOFError, SyntaxError, Image.DecompressionBombError) as e:
+        # Pillow raises OSError for truncated files, SyntaxError for some broken ones and
+        # DecompressionBombError for too many pixels. Fail only the image, not the batch
+        return '', FAILED, str(e)
+
+
+def _write(path, data: bytes):
+    # Write into a temporary file and rename it not to leave a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def convert_all(
+    sources: Iterable[pathlib.Path],
+    output_dir: pathlib.Path,
+    method: str = FLOYD_STEINBERG,
+    gamma=default_gamma,
+    jobs: Optional[int] = None,
+    force=False,
+) -> Dict[pathlib.Path, Tuple[str, str]]:
+    """Convert images into <stem>.bin in the output directory with a pool of processes.
+
+    Returns {source: (status, error)} where status is converted, skipped or failed.
+    Raises ValueError if two sources have the same stem.
+    """
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / manifest_name
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    sources = list(sources)
+    stems = {}
+    for src in sources:
+        if src.stem in stems:
+            raise ValueError(
+                '{} and {} would be converted into the same file'.format(stems[src.stem], src)
+            )
+        stems[src.stem] = src
+
+    work = [
+        (
+            str(src),
+            str(output_dir / (src.stem + '.bin')),
+            None if force else manifest.get(src.stem),
+            method,
+            gamma,
+        )
+        for src in sources
+    ]
+
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        chunksize = max(1, len(work) // ((jobs or os.cpu_count() or 1) * 4))
+        for src, (digest, status, err) in zip(
+            sources, executor.map(_convert, work, chunksize=chunksize)
+        ):
+            results[src] = (status, err)
+            if status == FAILED:
+                manifest.pop(src.stem, None)
+            else:
+                manifest[src.stem] = digest
+
+    _write(str(manifest_path), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return results
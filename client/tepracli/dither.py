@@ -0,0 +1,156 @@
+"""Dither grayscale images into black and white dots.
+
+Error diffusion (Floyd-Steinberg, Atkinson) diffuses the error of each pixel into
+its neighbors on the right and in the rows below in linear light. It's sequential
+by nature, but a pixel receives errors only from its left in the same row and from
+at most a pixel to the right in the rows above. So every pixel on a wavefront
+x + 2y = t is independent of each other and they're processed at once. A wavefront
+is a strided slice of the flattened image, so each step is a few NumPy operations
+on views, for width + 2 * height steps in total. Numba runs the same traversal
+compiled if it's installed, with the same results.
+
+Ordered dithering (Bayer) compares each pixel with a tiled threshold map at once.
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+from PIL import Image
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+FLOYD_STEINBERG = 'floyd-steinberg'
+ATKINSON = 'atkinson'
+BAYER = 'bayer'
+methods = (FLOYD_STEINBERG, ATKINSON, BAYER)
+
+default_gamma = 2.2
+
+# (dy, dx, weight) of the neighbors receiving the error
+_kernels = {
+    FLOYD_STEINBERG: ((0, 1, 7 / 16), (1, -1, 3 / 16), (1, 0, 5 / 16), (1, 1, 1 / 16)),
+    ATKINSON: tuple(
+        (dy, dx, 1 / 8) for dy, dx in ((0, 1), (0, 2), (1, -1), (1, 0), (1, 1), (2, 0))
+    ),
+}
+
+_pad = 2  # Errors diffused out of the image go to the padding and are discarded
+
+_luts = {}  # type: Dict[float, np.ndarray]
+
+
+def _lut(gamma: float) -> np.ndarray:
+    """Returns the table from 8-bit values into linear light (0.0 - 1.0)."""
+    lut = _luts.get(gamma)
+    if lut is None:
+        lut = _luts[gamma] = (np.arange(256, dtype=np.float64) / 255) ** gamma
+    return lut
+
+
+def _bayer(n: int) -> np.ndarray:
+    """Returns the n x n Bayer matrix normalized into thresholds in (0, 1)."""
+    m = np.zeros((1, 1), dtype=np.float64)
+    while m.shape[0] < n:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    return (m + 0.5) / m.size
+
+
+def _wavefronts(h: int, w: int):
+    """Yields the start and the stop of each wavefront in the flattened buffer of _layout()."""
+    stride = w + 2 * _pad - 2
+    for t in range(w + 2 * (h - 1)):
+        y0 = max(0, (t - w) // 2 + 1)
+        y1 = min(h - 1, t // 2)
+        yield y0 * stride + t + _pad, y1 * stride + t + _pad + 1
+
+
+def _layout(h: int, w: int) -> Tuple[int, int]:
+    return h + _pad, w + 2 * _pad
+
+
+def _diffuse_numpy(buf: np.ndarray, out: np.ndarray, h: int, w: int, kernel):
+    flat, dots = buf.reshape(-1), out.reshape(-1)
+    row = buf.shape[1]
+    stride = row - 2
+    offsets = [(dy * row + dx, weight) for dy, dx, weight in kernel]
+
+    for start, stop in _wavefronts(h, w):
+        v = flat[start:stop:stride]
+        white = v >= 0.5
+        err = v - white
+        dots[start:stop:stride] = white
+        for ofs, weight in offsets:
+            flat[start + ofs : stop + ofs : stride] += err * weight
+
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def _diffuse_numba(flat, dots, h, w, row, dys, dxs, weights):
+        stride = row - 2
+        n = len(weights)
+        err = np.empty(h, dtype=np.float64)
+        for t in range(w + 2 * (h - 1)):
+            y0 = max(0, (t - w) // 2 + 1)
+            y1 = min(h - 1, t // 2)
+            start = y0 * stride + t + _pad
+            count = y1 - y0 + 1
+            for i in range(count):
+                v = flat[start + i * stride]
+                white = v >= 0.5
+                err[i] = v - (1.0 if white else 0.0)
+                dots[start + i * stride] = white
+            # Diffuse in the same order as the NumPy implementation for the same results
+            for k in range(n):
+                ofs = dys[k] * row + dxs[k]
+                for i in range(count):
+                    flat[start + i * stride + ofs] += err[i] * weights[k]
+
+
+def dither(
+    gray: np.ndarray, method: str = FLOYD_STEINBERG, gamma=default_gamma, jit=True
+) -> np.ndarray:
+    """Dither a grayscale image (2D array of uint8) into black (0) and white (255).
+
+    Numba is used if it's installed and jit is True. Raises ValueError for an unknown
+    method.
+    """
+
+    if method not in methods:
+        raise ValueError('unknown dithering method: {}'.format(method))
+
+    gray = np.asarray(gray, dtype=np.uint8)
+    if gray.ndim == 3 and gray.shape[2] == 1:
+        gray = gray[:, :, 0]
+    h, w = gray.shape
+    linear = _lut(gamma)[gray]
+
+    if method == BAYER:
+        threshold = np.tile(_bayer(8), (h // 8 + 1, w // 8 + 1))[:h, :w]
+        return np.where(linear >= threshold, 255, 0).astype(np.uint8)
+
+    buf = np.zeros(_layout(h, w), dtype=np.float64)
+    buf[:h, _pad : _pad + w] = linear
+    out = np.zeros(buf.shape, dtype=np.bool_)
+    kernel = _kernels[method]
+
+    if jit and numba is not None:
+        dys = np.array([k[0] for k in kernel], dtype=np.int64)
+        dxs = np.array([k[1] for k in kernel], dtype=np.int64)
+        weights = np.array([k[2] for k in kernel], dtype=np.float64)
+        _diffuse_numba(buf.reshape(-1), out.reshape(-1), h, w, buf.shape[1], dys, dxs, weights)
+    else:
+        _diffuse_numpy(buf, out, h, w, kernel)
+
+    return np.where(out[:h, _pad : _pad + w], 255, 0).astype(np.uint8)
+
+
+def dither_image(im: Image.Image, method: str = FLOYD_STEINBERG, gamma=default_gamma):
+    """Dither a label image into black (0) and white (255) as binarize() does."""
+
+    if im.mode != 'L':
+        im = im.convert('L')
+    return Image.fromarray(dither(np.asarray(im), method, gamma), 'L')
@@ -0,0 +1,94 @@
+import itertools
+import struct
+import zlib
+from typing import Iterable, List, Tuple
+
+from PIL import Image
+
+line_bytes = 8  # 64px = 8 Bytes per line
+
+# Content-Encoding of the payload of POST /prints
+ZLIB = 'zlib'
+RLE = 'rle'
+IDENTITY = 'identity'
+encodings = (ZLIB, RLE, IDENTITY)
+
+# Pixels darker than or equal to this value become black dots
+_black_lut = [255 if v <= 127 else 0 for v in range(256)]
+
+
+def encode(im: Image.Image) -> bytes:
+    """Encode a 64px-tall label image into the raster format of tepra-lite-esp32.
+
+    The image is rotated clockwise so that every column becomes a line, then
+    packed into 8 Bytes per line (MSB first, 1 = black) with a single call of
+    Image.tobytes() on a 1-bit image instead of walking over each pixel.
+    """
+
+    if im.mode != 'L':
+        im = im.convert('L')
+
+    # In a 1-bit image, non-zero pixels are packed as 1 = black dots
+    packed = im.point(_black_lut, '1').rotate(-90, expand=True)
+    if packed.width != line_bytes * 8:
+        raise ValueError('invalid image height: {}px'.format(im.height))
+
+    return packed.tobytes()
+
+
+def encode_batch(labels: List[Tuple[bytes, int]]) -> bytes:
+    """Pack labels given as (compressed label, depth) into a batch for POST /batches.
+
+    Each label is the depth (int8), the length of the compressed label (uint32,
+    little endian) and the compressed label.
+    """
+
+    return b''.join(
+        struct.pack('<bI', depth, len(compressed)) + compressed for compressed, depth in labels
+    )
+
+
+def packbits(data: bytes) -> bytes:
+    """Compress lines with PackBits, the run-length encoding of the rle Content-Encoding.
+
+    A run of 3 or more Bytes becomes a header 257 - n and the Byte. Other Bytes are
+    gathered into literals of a header n - 1 and n Bytes. n is up to 128.
+    """
+
+    out = bytearray()
+    literal = bytearray()
+
+    def flush():
+        for i in range(0, len(literal), 128):
+            part = literal[i : i + 128]
+            out.append(len(part) - 1)
+            out.extend(part)
+        literal.clear()
+
+    for value, group in itertools.groupby(data):
+        n = sum(1 for _ in group)
+        if n < 3:
+            literal.extend(bytes((value,)) * n)
+            continue
+        flush()
+        while n >= 3:
+            k = min(n, 128)
+            out.append(257 - k)
+            out.append(value)
+            n -= k
+        literal.extend(bytes((value,)) * n)
+    flush()
+    return bytes(out)
+
+
+def compress(data: bytes, accepted: Iterable[str] = encodings) -> Tuple[bytes, str]:
+    """Returns the lines compressed in the smallest of the accepted encodings and the encoding.
+
+    The former one in accepted is taken on a tie. Raises ValueError if no encoding is known.
+    """
+
+    compressors = {ZLIB: zlib.compress, RLE: packbits, IDENTITY: bytes}
+    payloads = [(compressors[e](data), e) for e in accepted if e in compressors]
+    if not payloads:
+        raise ValueError('no known encoding is accepted: {}'.format(accepted))
+    return min(payloads, key=lambda p: len(p[0]))
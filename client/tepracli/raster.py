@@ -0,0 +1,47 @@
+from typing import List
+
+from PIL import Image
+
+from tepracli import min_width, height
+
+default_threshold = 127
+
+
+def compose(parts: List[Image.Image]) -> Image.Image:
+    """Lay out rendered parts side by side onto a single canvas.
+
+    The canvas is allocated once with the final width and every part is pasted
+    only once. A valid image must be ...
+    1. at least 84px in width
+    2. aligned to multiple of 2 in width
+    so the parts are centered on a white canvas if they don't fill it up.
+    """
+
+    actual_width = sum(im.width for im in parts)
+
+    assumed_width = max(min_width, actual_width)
+    if assumed_width % 2:
+        assumed_width += 1
+
+    canvas = Image.new('L', (assumed_width, height), color='white')
+
+    x = assumed_width // 2 - actual_width // 2
+    for im in parts:
+        canvas.paste(im, (x, 0))
+        x += im.width
+
+    return canvas
+
+
+def binarize(im: Image.Image, threshold: int = default_threshold) -> Image.Image:
+    """Binarize a label image into black (0) and white (255) in a single pass.
+
+    Pixels brighter than or equal to the threshold turn white and the others
+    turn black. The image is converted into grayscale beforehand if needed.
+    """
+
+    if im.mode != 'L':
+        im = im.convert('L')
+
+    lut = [255 if v >= threshold else 0 for v in range(256)]
+    return im.point(lut)
@@ -0,0 +1,67 @@
+import gzip
+import importlib.resources
+import pathlib
+from io import BytesIO
+from typing import Optional, Union
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+from tepracli import height
+
+default_fontsize = 30
+
+
+def default_font_path() -> pathlib.Path:
+    """Returns the path of the bundled Adobe Source Sans."""
+    return importlib.resources.files('tepracli.assets').joinpath('ss3.ttf.gz')
+
+
+def load_font(path: Optional[pathlib.Path] = None, size: int = default_fontsize):
+    """Load a TrueType font. The bundled Adobe Source Sans is used if the path is omitted."""
+
+    if not path:
+        path = default_font_path()
+
+    if path.suffixes[-1] == '.gz':
+        with open(path, 'rb') as gz:
+            path = BytesIO(gzip.decompress(gz.read()))
+
+    return ImageFont.truetype(path, size)
+
+
+def render_text(content: str, font) -> Image.Image:
+    actual_width = font.getmask(content).getbbox()[2] + 2  # add 2px for safe anti-aliasing
+    im = Image.new('L', (actual_width, height), 'white')
+    draw = ImageDraw.Draw(im)
+    draw.text((actual_width // 2, height // 2), content, font=font, fill='black', anchor='mm')
+    return im
+
+
+def render_space(width: int) -> Image.Image:
+    return Image.new('L', (width, height), 'white')
+
+
+def render_qr(content: str) -> Image.Image:
+    """Draw a QR code centered vertically. Raises ValueError if it doesn't fit in 64px."""
+
+    qr = qrcode.QRCode(error_correction=qrcode.ERROR_CORRECT_L, box_size=1, border=0)
+    qr.add_data(content)
+    qr.make()
+    im = qr.make_image()
+    if im.height <= height // 2:
+        im = im.resize((im.width * 2, im.height * 2), resample=Image.NEAREST)
+    elif im.height > 64:
+        raise ValueError(
+            f'Generated QR code exceeds 64px ({im.height}px). Please try a shorter string.'
+        )
+    newim = Image.new('L', (im.width, 64), 'white')
+    newim.paste(im, (0, 64 // 2 - im.height // 2))
+    return newim
+
+
+def render_image(fp: Union[str, pathlib.Path, BytesIO]) -> Image.Image:
+    im = Image.open(fp)
+    new_width = height * int(im.size[0] / im.size[1])
+    new_height = height
+    return im.resize((new_width, new_height))
@@ -1,8 +1,14 @@
-import sys
+import argparse
 import binascii
+import pathlib
+import sys
 import zlib
-import cv2
-import numpy as np
+
+from PIL import Image
+
+from tepracli.convert import FAILED, SKIPPED, convert_all, find_images
+from tepracli.dither import FLOYD_STEINBERG, dither, methods
+from tepracli.encoder import encode
 
 ENTER_KEY_WIN = 13
 ENTER_KEY_LINUX = 10
@@ -10,14 +16,60 @@ ESC_KEY = 27
 
 
 def main():
-    global ENTER_KEY_WIN, ENTER_KEY_LINUX, ESC_KEY
-    if len(sys.argv) <= 1:
-        print("usage: pic2bin.py <imagefile>", file=sys.stderr)
+    parser = argparse.ArgumentParser(
+        description="Convert a 64px-tall image into hello.bin previewing it in a window, "
+        "or convert images of any size into .bin files without a window with --batch."
+    )
+    parser.add_argument("image", help="An image, or a directory or a glob with --batch.")
+    parser.add_argument("method", nargs="?", default=FLOYD_STEINBERG, choices=methods)
+    parser.add_argument("--batch", action="store_true", help="Convert images headlessly.")
+    parser.add_argument("--output-dir", default="bin", help="Output directory of --batch.")
+    parser.add_argument("--jobs", "-j", type=int, help="Processes of --batch. (default: CPUs)")
+    parser.add_argument("--force", action="store_true", help="Convert unchanged images too.")
+    args = parser.parse_intermixed_args()
+
+    if args.batch:
+        return batch(args)
+    return preview(args.image, args.method)
+
+
+def batch(args):
+    sources = find_images(args.image)
+    if not sources:
+        print("No images found: {}".format(args.image), file=sys.stderr)
+        return 1
+
+    try:
+        results = convert_all(
+            sources, pathlib.Path(args.output_dir), args.method, jobs=args.jobs, force=args.force
+        )
+    except ValueError as e:
+        print(e, file=sys.stderr)
         return 1
 
-    windowname = sys.argv[1] + "    Enter : save    Esc : quit"
+    failed = skipped = 0
+    for src, (status, err) in results.items():
+        if status == FAILED:
+            failed += 1
+            print("{}: {}".format(src, err), file=sys.stderr)
+        elif status == SKIPPED:
+            skipped += 1
+    print(
+        "{} converted, {} unchanged, {} failed".format(
+            len(results) - skipped - failed, skipped, failed
+        )
+    )
+    return 1 if failed else 0
+
 
-    img = cv2.imread(sys.argv[1], cv2.IMREAD_COLOR)
+def preview(path, method):
+    import cv2
+
+    global ENTER_KEY_WIN, ENTER_KEY_LINUX, ESC_KEY
+
+    windowname = path + "    Enter : save    Esc : quit"
+
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
     if img is None:
         print("Image open error", file=sys.stderr)
         return 1
@@ -30,26 +82,9 @@ def main():
 
     cv2.namedWindow(windowname, cv2.WINDOW_AUTOSIZE | cv2.WINDOW_GUI_NORMAL)
 
-    lut = np.arange(256, dtype="float32")
-    lut = pow((lut / 255), 2.2)
+    binalized = dither(gray, method)
 
-    binalized = np.zeros((height, width, 1), np.uint8)
-
-    cumulative_err = 0
-    calc_done = False
     while True:
-        if not calc_done:
-            for y in range(height):
-                for x in range(width):
-                    linear_val = lut[gray[y, x]]
-                    if linear_val + cumulative_err < 0.5:
-                        cumulative_err += linear_val
-                        binalized[y, x] = 0
-                    else:
-                        cumulative_err -= 1.0 - linear_val
-                        binalized[y, x] = 255
-            calc_done = True
-
         frame = cv2.cvtColor(binalized, cv2.COLOR_GRAY2BGR)
         frame = cv2.vconcat([img, frame])
         cv2.imshow(windowname, frame)
@@ -61,22 +96,14 @@ def main():
         elif key == ESC_KEY:
             return 0
 
-    img_out = cv2.rotate(binalized, cv2.ROTATE_90_CLOCKWISE)
-    height, width = img_out.shape
-
-    encoded = b""
-    for y in range(height):
-        aggregated = 0
-        for shift, x in enumerate(range(width - 1, -1, -1)):
-            if img_out[y, x] <= 127:
-                aggregated += 1 << shift
-        line = aggregated.to_bytes(8, "big")
-        encoded += line
-        print(binascii.hexlify(line))
+    encoded = encode(Image.fromarray(binalized, "L"))
+    for i in range(0, len(encoded), 8):
+        print(binascii.hexlify(encoded[i : i + 8]))
 
     with open("hello.bin", "wb") as f:
         f.write(zlib.compress(encoded))
     return 0
 
 
-sys.exit(main())
+if __name__ == "__main__":
+    sys.exit(main())
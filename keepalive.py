@@ -0,0 +1,131 @@
+import uasyncio
+import uerrno
+from micropython import const
+
+from nanoweb.nanoweb import HttpError, Nanoweb, Request
+
+_IDLE_MS = const(5000)  # Close a connection idle for this long
+_MAX_REQUESTS = const(100)  # Close a connection after this many requests
+_MAX_DRAIN = const(64 * 1024)  # Read up to this many Bytes of an unread body before closing
+_DRAIN_CHUNK = const(512)
+
+
+class KeepAliveNanoweb(Nanoweb):
+    """Nanoweb serving requests one after another over a persistent connection.
+
+    A connection is kept alive after a response if the client asks for it (HTTP/1.1
+    unless Connection: close, HTTP/1.0 with Connection: keep-alive), the handler
+    consumed the whole body and framed the response with Content-Length. Handlers
+    tell the last with request.framed = True, and request.unread() returns the Bytes
+    of the body left unread to answer Connection: close. Otherwise it's closed after
+    the response as Nanoweb does. Set idle_ms to 0 to close every connection.
+    """
+
+    extract_headers = Nanoweb.extract_headers + ('Connection', 'Content-Encoding')
+
+    def __init__(self, port=80, address='0.0.0.0', idle_ms=_IDLE_MS, max_requests=_MAX_REQUESTS):
+        super().__init__(port, address)
+        self.idle_ms = idle_ms
+        self.max_requests = max_requests
+
+    async def handle(self, reader, writer):
+        try:
+            for i in range(self.max_requests):
+                # Wait for the next request only while the connection is idle
+                timeout = self.idle_ms if i else None
+                if not await self._handle_one(reader, writer, timeout, i + 1 < self.max_requests):
+                    break
+        except uasyncio.TimeoutError:
+            pass
+        except OSError as e:
+            if e.args[0] != uerrno.ECONNRESET:
+                raise
+        finally:
+            await writer.aclose()
+
+    async def _handle_one(self, reader, writer, timeout, more) -> bool:
+        """Serve a request. Returns if the connection can serve the next one."""
+        if timeout is None:
+            line = await reader.readline()
+        else:
+            line = await uasyncio.wait_for_ms(reader.readline(), timeout)
+        items = line.decode('ascii').split()
+        if len(items) != 3:
+            return False
+
+        request = Request()
+        request.write = writer.awrite
+        request.close = writer.aclose
+        request.method, request.url, version = items
+        request.framed = False
+
+        # Count the Bytes read to know if the body is left unread
+        consumed = [0]
+
+        async def read(n=-1):
+            data = await reader.read(n)
+            consumed[0] += len(data)
+            return data
+
+        request.read = read
+
+        def unread():
+            length = request.headers.get('Content-Length')
+            return int(length) - consumed[0] if length else 0
+
+        request.unread = unread
+
+        try:
+            if version not in ('HTTP/1.0', 'HTTP/1.1'):
+                raise HttpError(request, 505, 'Version Not Supported')
+
+            while True:
+                items = (await reader.readline()).decode('ascii').split(':', 1)
+                if len(items) == 2:
+                    header, value = items
+                    if header in self.extract_headers:
+                        request.headers[header] = value.strip()
+                elif len(items) == 1:
+                    break
+
+            connection = request.headers.get('Connection', '').lower()
+            if version == 'HTTP/1.1':
+                request.keep_alive = connection != 'close'
+            else:
+                request.keep_alive = connection == 'keep-alive'
+            request.keep_alive = request.keep_alive and more and self.idle_ms > 0
+
+            if self.callback_request:
+                self.callback_request(request)
+
+            if request.url in self.routes:
+                request.route = request.url
+                await self.generate_output(request, self.routes[request.url])
+            else:
+                for route, handler in self.routes.items():
+                    if route[-1] == '*' and request.url.startswith(route[:-1]):
+                        request.route = route
+                        await self.generate_output(request, handler)
+                        break
+                else:
+                    raise HttpError(request, 404, 'File Not Found')
+        except HttpError as e:
+            request, code, message = e.args
+            await self.callback_error(request, code, message)
+            return False
+
+        left = unread()
+        if 0 < left <= _MAX_DRAIN:
+            # Closing with unread data resets the connection, which may destroy the
+            # response before the client reads it
+            await self._drain(reader, left)
+            return False
+        return request.keep_alive and request.framed and left == 0
+
+    async def _drain(self, reader, n):
+        while n > 0:
+            timeout = self.idle_ms or _IDLE_MS
+            chunk = await uasyncio.wait_for_ms(reader.read(min(n, _DRAIN_CHUNK)), timeout)
+            if not chunk:
+                break
+            n -= len(chunk)
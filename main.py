@@ -1,38 +1,305 @@
-import deflate
 import gc
-import io
 import json
 import machine
+import metrics
 import time
 import uasyncio
 
-from nanoweb.nanoweb import Nanoweb
+from keepalive import KeepAliveNanoweb
 
 import wifi
-from tepra import Tepra, new_logger
+from stream import ZLIB, IDENTITY, BufferReader, encodings, open_reader
+from tepra import Tepra, configure_logging, log_buffer, new_logger
 from typ1ng import Optional, Tuple
 
 __version__ = '2.0.0'
 
 
+_MAX_QUEUED = 4  # Prints waiting in the queue at once
+_MAX_QUEUED_BYTES = 48 * 1024  # Compressed images held in the queue at once, larger ones stream
+_MAX_HISTORY = 16  # Finished prints to report their status
+_MAX_BATCH_LABELS = 256  # Labels in a batch
+_MAX_BATCH_HISTORY = 4  # Finished batches to report their status
+_BATCH_HEADER = 5  # Depth (int8) + length of the compressed label (uint32 LE)
+
+_request_read_ms = metrics.Histogram(
+    'tepra_request_read_ms',
+    'Time to read the body of POST /prints.',
+    (10, 50, 100, 500, 1000, 5000),
+)
+_decompress_ms = metrics.Histogram(
+    'tepra_decompress_ms', 'Time to decompress an image.', (10, 50, 100, 500, 1000, 5000)
+)
+_prints_total = metrics.Counter('tepra_prints_total', 'Prints finished successfully.')
+_prints_failed = metrics.Counter('tepra_prints_failed_total', 'Prints failed.')
+
+
 class Print:
+    QUEUED = 'queued'
+    PRINTING = 'printing'
+    DONE = 'done'
+    FAILED = 'failed'
+
     id: int
     size: Tuple[int, int]
-    done: bool
+    status: str
+    error: Optional[str]
 
-    def __init__(self, pid, size, done):
+    def __init__(self, pid, depth, payload, batch=None, encoding=ZLIB):
         self.id = pid
-        self.size = size
-        self.done = done
+        self.size = (64, 0)  # The number of lines is known after decompressing the payload
+        self.status = Print.QUEUED
+        self.error = None
+        self.depth = depth
+        self.payload = payload  # Compressed image, released after printing
+        self.encoding = encoding  # How the payload is compressed: zlib, rle or identity
+        self.batch = batch  # ID of the batch which the print belongs to
+
+    @property
+    def done(self) -> bool:
+        return self.status == Print.DONE
+
+    def finished(self) -> bool:
+        return self.status in (Print.DONE, Print.FAILED)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'width': self.size[0],
+            'height': self.size[1],
+            'done': self.done,
+            'status': self.status,
+            'error': self.error,
+            'encoding': self.encoding,
+            'batch': self.batch,
+        }
+
+
+class Batch:
+    """Labels printed back to back in a single session of the printer."""
+
+    id: int
+    prints: list
+
+    def __init__(self, bid, prints):
+        self.id = bid
+        self.prints = prints
+
+    @property
+    def status(self) -> str:
+        if all(pr.status == Print.QUEUED for pr in self.prints):
+            return Print.QUEUED
+        if not self.finished():
+            return Print.PRINTING
+        return Print.DONE if all(pr.done for pr in self.prints) else Print.FAILED
+
+    def finished(self) -> bool:
+        return all(pr.finished() for pr in self.prints)
 
     def to_dict(self):
-        return {'id': self.id, 'width': self.size[0], 'height': self.size[1], 'done': self.done}
+        return {
+            'id': self.id,
+            'status': self.status,
+            'prints': [pr.to_dict() for pr in self.prints],
+        }
+
+
+def parse_batch(body) -> (Optional[list], str):
+    """Split a batch into (depth, compressed label) without copying.
+
+    A batch is a sequence of labels, each of which is the depth (int8), the length
+    of the compressed label (uint32, little endian) and the label compressed with zlib.
+    """
+    labels = []
+    mv = memoryview(body)
+    ofs = 0
+    while ofs < len(body):
+        if len(labels) >= _MAX_BATCH_LABELS:
+            return None, 'too many labels in the batch'
+        if ofs + _BATCH_HEADER > len(body):
+            return None, 'the label #{} has a truncated header'.format(len(labels))
+
+        d = body[ofs] - 256 if body[ofs] > 127 else body[ofs]
+        n = body[ofs + 1] | body[ofs + 2] << 8 | body[ofs + 3] << 16 | body[ofs + 4] << 24
+        ofs += _BATCH_HEADER
+        if d < -3 or d > 3:
+            return None, 'the label #{} has an invalid depth: {}'.format(len(labels), d)
+        if n < 2 or ofs + n > len(body):
+            return None, 'the label #{} has an invalid length: {}'.format(len(labels), n)
+        if not is_zlib(body, ofs):
+            return None, 'the label #{} is not compressed with zlib'.format(len(labels))
+
+        labels.append((d, mv[ofs : ofs + n]))
+        ofs += n
+
+    if not labels:
+        return None, 'the batch has no labels'
+    return labels, ''
+
+
+def is_zlib(b, ofs=0) -> bool:
+    """Validate the zlib header not to queue what will never print."""
+    return b[ofs] & 0x0F == 8 and (b[ofs] << 8 | b[ofs + 1]) % 31 == 0
+
+
+class PrintQueue:
+    """A bounded queue of prints drained by a single worker.
+
+    Each entry of the queue is a list of prints: a single print or the labels of a
+    batch, which are printed back to back in a single session of the printer.
+    """
+
+    def __init__(self):
+        self._next_id = 1
+        self._next_batch_id = 1
+        self._prints = []  # Queued, printing and finished prints in the order of submission
+        self._batches = []
+        self._pending = []
+        self._queued_bytes = 0
+        self._printing = 0  # The worker and streamed prints holding or waiting for the printer
+        self._event = uasyncio.Event()
+
+    def _admit(self, size) -> str:
+        if len(self._pending) >= _MAX_QUEUED:
+            return 'too many prints in the queue'
+        if self._queued_bytes + size > _MAX_QUEUED_BYTES:
+            return 'too large images in the queue'
+        return ''
+
+    def _enqueue(self, prints):
+        self._pending.append(prints)
+        self._queued_bytes += sum(len(pr.payload) for pr in prints)
+        self._trim()
+        self._event.set()
+
+    def submit(self, payload, depth, encoding=ZLIB) -> (Optional[Print], str):
+        reason = self._admit(len(payload))
+        if reason:
+            return None, reason
+
+        pr = Print(self._next_id, depth, payload, encoding=encoding)
+        self._next_id += 1
+        self._prints.append(pr)
+        self._enqueue([pr])
+        return pr, ''
+
+    def idle(self) -> bool:
+        """Whether nothing is queued or printing, so a print can go to the printer at once."""
+        return not self._pending and not self._printing
+
+    async def stream(self, tepra, read, length, depth, encoding=ZLIB) -> Print:
+        """Print an image while its body arrives instead of queueing it.
+
+        The body is decoded by a pair of lines as it is read, so an image too large
+        to hold in the queue prints in constant memory. Returns the finished print.
+        """
+        pr = Print(self._next_id, depth, None, encoding=encoding)
+        self._next_id += 1
+        self._prints.append(pr)
+        self._printing += 1
+        try:
+            async with tepra.session() as session:
+                await self._print(session, pr, open_reader(encoding, read, length))
+        finally:
+            self._printing -= 1
+            if not pr.finished():
+                pr.status, pr.error = Print.FAILED, 'failed to print: interrupted'
+            self._trim()
+        return pr
+
+    def submit_batch(self, labels) -> (Optional[Batch], str):
+        """Queue labels given as a list of (depth, compressed label) to print at once."""
+        reason = self._admit(sum(len(payload) for _, payload in labels))
+        if reason:
+            return None, reason
+
+        batch = Batch(self._next_batch_id, [])
+        self._next_batch_id += 1
+        for d, payload in labels:
+            batch.prints.append(Print(self._next_id, d, payload, batch.id))
+            self._next_id += 1
+        self._batches.append(batch)
+        self._enqueue(batch.prints)
+        return batch, ''
+
+    def get(self, pid) -> Optional[Print]:
+        for pr in self._prints:
+            if pr.id == pid:
+                return pr
+        for batch in self._batches:
+            for pr in batch.prints:
+                if pr.id == pid:
+                    return pr
+        return None
+
+    def get_batch(self, bid) -> Optional[Batch]:
+        for batch in self._batches:
+            if batch.id == bid:
+                return batch
+        return None
+
+    def all(self) -> list:
+        return self._prints
+
+    def all_batches(self) -> list:
+        return self._batches
+
+    def _trim(self):
+        finished = [pr for pr in self._prints if pr.finished()]
+        for pr in finished[: max(0, len(finished) - _MAX_HISTORY)]:
+            self._prints.remove(pr)
+        finished = [batch for batch in self._batches if batch.finished()]
+        for batch in finished[: max(0, len(finished) - _MAX_BATCH_HISTORY)]:
+            self._batches.remove(batch)
+
+    async def _next(self) -> list:
+        while not self._pending:
+            self._event.clear()
+            await self._event.wait()
+        return self._pending.pop(0)
+
+    async def work(self, tepra):
+        """Print the queued images one by one. Cancel it to stop."""
+        while True:
+            prints = list(await self._next())  # Not to modify Batch.prints
+            self._printing += 1
+            try:
+                async with tepra.session() as session:
+                    while prints:
+                        await self._print(session, prints.pop(0))
+            finally:
+                self._printing -= 1
+                if prints:
+                    # Put back the labels not started yet, e.g. cancelled on disconnection
+                    self._pending.insert(0, prints)
+
+    async def _print(self, session, pr, reader=None):
+        pr.status = Print.PRINTING
+        log('Printing #{}', pr.id)
+
+        if reader is None:
+            reader = open_reader(pr.encoding, BufferReader(pr.payload).read, len(pr.payload))
+        success, reason = False, 'interrupted'
+        try:
+            success, reason = await session.print(reader, pr.depth)
+        finally:
+            pr.size = (64, reader.inflated // 8)
+            pr.status = Print.DONE if success else Print.FAILED
+            pr.error = None if success else 'failed to print: ' + reason
+            _decompress_ms.observe(reader.inflate_us // 1000)
+            (_prints_total if success else _prints_failed).inc()
+            if pr.payload is not None:
+                self._queued_bytes -= len(pr.payload)
+                pr.payload = None
+            gc.collect()
+            log('Finished #{}: {}', pr.id, pr.status)
 
 
 log = new_logger('Main   :')
-t = Tepra(debug=True)
-app = Nanoweb()
+t = Tepra()
+app = KeepAliveNanoweb()
 depth = 0
+prints = PrintQueue()
 
 
 def respond(fn):
@@ -49,20 +316,27 @@ def respond(fn):
             # Others = implies "200 OK"
             status, body = 200, res
 
-        # Start writing the response header
-        await req.write('HTTP/1.1 {}\r\n'.format(status))
-
         if isinstance(body, dict) or isinstance(body, list):
             # Dict or list = jsonified
-            await req.write('Content-Type: application/json\r\n\r\n')
-            await req.write(json.dumps(body))
+            typ, body = 'application/json', json.dumps(body)
         elif isinstance(body, Response):
-            await req.write('Content-Type: application/json\r\n\r\n')
-            await req.write(body.jsonify())
+            typ, body = 'application/json', body.jsonify()
         else:
             # Others = implies a plain text and be transmitted as-is
-            await req.write('Content-Type: text/plain\r\n\r\n')
-            await req.write(body)
+            typ = 'text/plain'
+        body = body.encode() if isinstance(body, str) else body
+
+        # Content-Length frames the response to keep the connection alive. A body left
+        # unread (e.g. a request rejected early) closes it, so tell the client so
+        if getattr(req, 'keep_alive', False) and req.unread():
+            req.keep_alive = False
+        connection = 'keep-alive' if getattr(req, 'keep_alive', False) else 'close'
+        await req.write(
+            'HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n'
+            'Connection: {}\r\n\r\n'.format(status, typ, len(body), connection)
+        )
+        await req.write(body)
+        req.framed = True
 
     return wrapper
 
@@ -100,15 +374,13 @@ async def handle_battery(req):
     if req.method != 'GET':
         return 405, Response(error='method not allowed')
     r = Response()
-    r.battery = None
 
-    success, bat = t.fetch_remaining_battery()
-    if success:
-        r.battery = bat
-        return 200, r
-    else:
-        r.error = 'failed to read'
-        return 500, r
+    # Answer from the cache kept fresh by Tepra.keep_battery_fresh() not to use the radio
+    r.battery, r.age_ms = t.remaining_battery()
+    if r.battery is None:
+        r.error = 'the battery level is not known yet'
+        return 503, r
+    return 200, r
 
 
 @app.route('/depth')
@@ -151,26 +423,164 @@ async def handle_prints(req):
     if req.method not in ('GET', 'POST'):
         return 405, Response(error='method not allowed')
 
+    if req.method == 'GET':
+        return 200, [pr.to_dict() for pr in prints.all()]
+
+    encoding = req.headers.get('Content-Encoding', ZLIB).lower()
+    if encoding not in encodings:
+        r = Response(error='unsupported content encoding: ' + encoding)
+        r.encodings = encodings
+        return 415, r
+
+    status, content_len = check_body(req, 'application/octet-stream')
+    if status != 200:
+        return status, content_len
+    if encoding == IDENTITY and content_len % 16:
+        return 400, Response(error='bad request, image data length must be aligned to 16')
+
+    if content_len > _MAX_QUEUED_BYTES:
+        # Too large to hold in the queue: print it while the body arrives as long as
+        # nothing else is to print. The response waits for the print to finish
+        if not prints.idle():
+            return 503, Response(error='queue is full: a large image waits for an empty queue')
+        pr = await prints.stream(t, req.read, content_len, depth, encoding)
+        if not pr.done:
+            return 500, Response(error=pr.error, print=pr.to_dict())
+        return 200, Response(print=pr.to_dict())
+
+    status, payload = await read_body(req, content_len)
+    if status != 200:
+        return status, payload
+
+    if encoding == ZLIB and (len(payload) < 2 or not is_zlib(payload)):
+        return 400, Response(error='bad request, the body is not compressed with zlib')
+
+    pr, reason = prints.submit(payload, depth, encoding)
+    if pr is None:
+        return 503, Response(error='queue is full: ' + reason)
+    return 202, Response(print=pr.to_dict())
+
+
+@app.route('/prints/*')
+@respond
+async def handle_print(req):
+    if req.method != 'GET':
+        return 405, Response(error='method not allowed')
+
+    try:
+        pid = int(req.url[len('/prints/') :])
+    except ValueError:
+        return 400, Response(error='bad request, invalid print id')
+
+    pr = prints.get(pid)
+    if pr is None:
+        return 404, Response(error='print not found')
+    return 200, Response(print=pr.to_dict())
+
+
+@app.route('/batches')
+@respond
+async def handle_batches(req):
+    gc.collect()
+
+    if req.method not in ('GET', 'POST'):
+        return 405, Response(error='method not allowed')
+
+    if req.method == 'GET':
+        return 200, [batch.to_dict() for batch in prints.all_batches()]
+
+    status, content_len = check_body(req, 'application/vnd.tepra-batch')
+    if status != 200:
+        return status, content_len
+    if content_len > _MAX_QUEUED_BYTES:
+        return 413, Response(error='batch too large')
+
+    status, body = await read_body(req, content_len)
+    if status != 200:
+        return status, body
+
+    labels, reason = parse_batch(body)
+    if labels is None:
+        return 400, Response(error='bad request, ' + reason)
+
+    batch, reason = prints.submit_batch(labels)
+    if batch is None:
+        return 503, Response(error='queue is full: ' + reason)
+    return 202, Response(batch=batch.to_dict())
+
+
+@app.route('/batches/*')
+@respond
+async def handle_batch(req):
+    if req.method != 'GET':
+        return 405, Response(error='method not allowed')
+
+    try:
+        bid = int(req.url[len('/batches/') :])
+    except ValueError:
+        return 400, Response(error='bad request, invalid batch id')
+
+    batch = prints.get_batch(bid)
+    if batch is None:
+        return 404, Response(error='batch not found')
+    return 200, Response(batch=batch.to_dict())
+
+
+def check_body(req, content_type):
+    """Validate the headers of a body.
+
+    Returns (200, the content length) or (status, Response) to respond with.
+    """
     typ = req.headers.get('Content-Type', '')
-    if typ != 'application/octet-stream':
+    if typ != content_type:
         log('bad request, invalid content type')
         return 400, Response(error='bad request, invalid content type')
 
     content_len = req.headers.get('Content-Length')
-    if content_len is None:
+    if content_len is None or int(content_len) == 0:
         log('bad request, content length is not specified or zero')
         return 400, Response(error='bad request, content length is not specified or zero')
+    return 200, int(content_len)
+
+
+async def read_body(req, content_len):
+    """Read the whole body into a buffer held until the worker prints it.
+
+    Returns (200, body) or (status, Response) to respond with.
+    """
+    started = time.ticks_ms()
+    body = bytearray(content_len)
+    mv = memoryview(body)
+    received = 0
+    while received < content_len:
+        chunk = await req.read(content_len - received)
+        if not chunk:
+            return 400, Response(error='bad request, the body ended before content length')
+        mv[received : received + len(chunk)] = chunk
+        received += len(chunk)
+    log('read from request body: {} bytes', received)
+    _request_read_ms.observe(time.ticks_diff(time.ticks_ms(), started))
+    metrics.sample_heap()
+    return 200, body
+
+
+@app.route('/metrics')
+@respond
+async def handle_metrics(req):
+    if req.method != 'GET':
+        return 405, Response(error='method not allowed')
+    return 200, metrics.render()
 
-    zl = await req.read(int(content_len))
-    log('read from request body: {} bytes', len(zl))
-    with deflate.DeflateIO(io.BytesIO(zl), deflate.ZLIB) as d:
-        body = d.read()
-    log('decompressed: {} bytes', len(body))
 
-    success, reason = t.print(body, depth)
-    if not success:
-        return 500, Response(error='failed to print: ' + reason)
-    return 200, Response()
+@app.route('/logs')
+@respond
+async def handle_logs(req):
+    if req.method != 'GET':
+        return 405, Response(error='method not allowed')
+    buf = log_buffer()
+    if buf is None:
+        return 404, Response(error='logs are not kept, set log_lines in config.json')
+    return 200, '\n'.join(buf.lines()) + '\n'
 
 
 async def main():
@@ -180,6 +590,19 @@ async def main():
     with open('config.json', 'r') as f:
         conf = json.load(f)
 
+    # Logs go to the console and optionally to RAM to fetch them from /logs
+    configure_logging(conf.get('log_console', True), conf.get('log_lines', 0))
+    t.set_debug(conf.get('debug', False))
+
+    # Optionally narrow down which printer to connect to and how to scan
+    t.configure_scan(**conf.get('scan', {}))
+
+    # Optionally tune how long to wait for the printer to finish a label
+    t.configure_completion(**conf.get('completion', {}))
+
+    # Keep connections alive for clients sending requests one after another
+    app.idle_ms = conf.get('keep_alive_ms', app.idle_ms)
+
     while True:
         # Bring up the Wi-Fi (it will do nothing if it's already connected)
         ok = wifi.up(conf['ssid'], conf['psk'], conf['hostname'])
@@ -194,14 +617,20 @@ async def main():
             log('Activated BLE')
 
             log('Scanning and connecting to a TEPRA Lite')
-            while not t.connect():
-                time.sleep_ms(1000)
+            while not await t.connect():
+                await uasyncio.sleep_ms(1000)
 
             log('Connected')
 
-            async with await app.run():
-                log('Launched API')
-                await t.wait_disconnection()
+            worker = uasyncio.create_task(prints.work(t))
+            battery = uasyncio.create_task(t.keep_battery_fresh(**conf.get('battery', {})))
+            try:
+                async with await app.run():
+                    log('Launched API')
+                    await t.wait_disconnection()
+            finally:
+                worker.cancel()
+                battery.cancel()
 
             log('Canceled API')
         finally:
@@ -209,5 +638,6 @@ async def main():
             log('Deactivated BLE')
 
 
-while True:
-    uasyncio.run(main())
+if __name__ == '__main__':
+    while True:
+        uasyncio.run(main())
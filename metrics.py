@@ -0,0 +1,99 @@
+import gc
+
+# Every metric created is registered here to be exposed by render()
+_registry = []
+
+
+class Counter:
+    """A value which only increases."""
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        _registry.append(self)
+
+    def inc(self, n=1):
+        self.value += n
+
+    def render(self) -> str:
+        return '# HELP {0} {1}\n# TYPE {0} counter\n{0} {2}\n'.format(
+            self.name, self.help, self.value
+        )
+
+
+class Gauge:
+    """A value which goes up and down."""
+
+    def __init__(self, name, help, value=0):
+        self.name = name
+        self.help = help
+        self.value = value
+        _registry.append(self)
+
+    def set(self, value):
+        self.value = value
+
+    def set_min(self, value):
+        if self.value is None or value < self.value:
+            self.value = value
+
+    def render(self) -> str:
+        if self.value is None:
+            return ''
+        return '# HELP {0} {1}\n# TYPE {0} gauge\n{0} {2}\n'.format(
+            self.name, self.help, self.value
+        )
+
+
+class Histogram:
+    """Counts observations by fixed buckets of upper bounds.
+
+    Observations are integers (e.g. milliseconds) not to allocate floats on the
+    heap. Observing only increments integers and allocates nothing.
+    """
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is for +Inf
+        self.sum = 0
+        self.count = 0
+        _registry.append(self)
+
+    def observe(self, value):
+        i = 0
+        n = len(self.buckets)
+        while i < n and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self) -> str:
+        lines = ['# HELP {0} {1}\n# TYPE {0} histogram\n'.format(self.name, self.help)]
+        cumulative = 0
+        for le, n in zip(self.buckets, self.counts):
+            cumulative += n
+            lines.append('{}_bucket{{le="{}"}} {}\n'.format(self.name, le, cumulative))
+        lines.append('{}_bucket{{le="+Inf"}} {}\n'.format(self.name, self.count))
+        lines.append('{0}_sum {1}\n{0}_count {2}\n'.format(self.name, self.sum, self.count))
+        return ''.join(lines)
+
+
+heap_free = Gauge('tepra_heap_free_bytes', 'Free heap when scraped.')
+heap_free_min = Gauge('tepra_heap_free_min_bytes', 'Lowest free heap sampled so far.', None)
+
+
+def sample_heap():
+    """Record the free heap for the low-water mark. Call it where the heap usage peaks."""
+    heap_free_min.set_min(gc.mem_free())
+
+
+def render() -> str:
+    """Returns every metric in the text format of Prometheus."""
+    free = gc.mem_free()
+    heap_free.set(free)
+    heap_free_min.set_min(free)
+    return ''.join(m.render() for m in _registry)
@@ -0,0 +1,87 @@
+"""Run tepra-lite-esp32 on CPython against a simulated LR30.
+
+    import sim
+    sim.install()  # Stand-in MicroPython modules must be installed before importing tepra
+
+    from sim.printer import SimulatedLR30
+    printer = sim.attach(SimulatedLR30(latency_ms=5))
+
+    from tepra import Tepra
+    ...
+
+See sim/__main__.py for running main.py and bench/ for benchmarks.
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+_mpy = os.path.join(os.path.dirname(__file__), 'mpy')
+_fallback = os.path.join(os.path.dirname(__file__), 'fallback')
+_started = time.monotonic()
+
+
+def _ticks_ms():
+    return int((time.monotonic() - _started) * 1000)
+
+
+def _ticks_us():
+    return int((time.monotonic() - _started) * 1000000)
+
+
+def _ticks_diff(ticks1, ticks2):
+    return ticks1 - ticks2
+
+
+def _sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+
+def _mem_alloc():
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return 0
+
+
+def install():
+    """Install stand-ins of MicroPython modules and make the modules in the root importable.
+
+    "time" and "gc" are built in CPython and can't be shadowed, so the functions
+    which only MicroPython has are patched onto them.
+    """
+
+    for path in (root, _mpy):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    # Prefer the nanoweb submodule if it's checked out
+    if _fallback not in sys.path:
+        sys.path.append(_fallback)
+
+    time.ticks_ms = _ticks_ms
+    time.ticks_us = _ticks_us
+    time.ticks_diff = _ticks_diff
+    time.sleep_ms = _sleep_ms
+
+    # CPython doesn't tell the size of the heap. Use tracemalloc if it's tracing.
+    gc.mem_alloc = _mem_alloc
+    gc.mem_free = lambda: 0
+
+
+def attach(peripheral):
+    """Make a simulated peripheral (e.g. sim.printer.SimulatedLR30) reachable over BLE."""
+    import bluetooth
+
+    bluetooth.attach(peripheral)
+    return peripheral
+
+
+def reset():
+    """Detach all peripherals and forget the BLE instance."""
+    import bluetooth
+
+    bluetooth.detach_all()
+    bluetooth.BLE._instance = None
@@ -0,0 +1,67 @@
+"""Run main.py of tepra-lite-esp32 against a simulated LR30 on localhost.
+
+usage: python -m sim [--port PORT] [--latency-ms MS] [--drop-rate RATE] ...
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+
+import sim
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m sim', description=__doc__.splitlines()[0])
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency-ms', type=float, default=8.0)
+    parser.add_argument('--chunk-ms', type=float, default=2.0)
+    parser.add_argument('--line-ms', type=float, default=2.0)
+    parser.add_argument('--settle-ms', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--debug', action='store_true', help='Print debug logs.')
+    parser.add_argument('--log-lines', type=int, default=0, help='Keep logs for GET /logs.')
+    args = parser.parse_args()
+
+    sim.install()
+    from sim.printer import SimulatedLR30
+
+    sim.attach(
+        SimulatedLR30(
+            latency_ms=args.latency_ms,
+            chunk_ms=args.chunk_ms,
+            line_ms=args.line_ms,
+            settle_ms=args.settle_ms,
+            drop_rate=args.drop_rate,
+            seed=args.seed,
+        )
+    )
+
+    # main.py reads config.json and writes handles.json in the working directory
+    workdir = tempfile.mkdtemp(prefix='tepra-sim-')
+    with open(os.path.join(sim.root, 'config.json')) as f:
+        conf = json.load(f)
+    conf.update(debug=args.debug, log_lines=args.log_lines)
+    # Tell Tepra how fast the simulated printer prints to estimate when a print finishes
+    conf.setdefault('completion', {}).update(line_ms=args.line_ms, depth_line_ms=0)
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(conf, f)
+    os.chdir(workdir)
+
+    import main as server
+
+    server.app.address, server.app.port = args.address, args.port
+    try:
+        asyncio.run(server.main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
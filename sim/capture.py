@@ -0,0 +1,180 @@
+"""Read ATT packets out of a pcapng captured with nRF Sniffer for Bluetooth LE.
+
+Only what's needed to follow a GATT client talking to LR30 is parsed:
+
+    pcapng block -> Nordic BLE header (LINKTYPE_NORDIC_BLE) -> LL data PDU -> L2CAP -> ATT
+
+Retransmitted LL PDUs are dropped so that every ATT packet appears once.
+"""
+
+import struct
+from collections import namedtuple
+
+_BLOCK_SHB = 0x0A0D0D0A
+_BLOCK_IDB = 0x00000001
+_BLOCK_EPB = 0x00000006
+_OPT_IF_TSRESOL = 9
+_LINKTYPE_NORDIC_BLE = 272
+
+_NORDIC_EVENT_PACKET = 0x06
+_FLAG_CRC_OK = 0x01
+_FLAG_MASTER_TO_SLAVE = 0x02
+_FLAG_ENCRYPTED = 0x04
+
+_ADV_ACCESS_ADDRESS = 0x8E89BED6
+_LLID_CONTINUATION = 0x01
+_LLID_START = 0x02
+_CID_ATT = 0x0004
+
+# ATT opcodes
+ATT_READ_RESPONSE = 0x0B
+ATT_WRITE_REQUEST = 0x12
+ATT_WRITE_RESPONSE = 0x13
+ATT_NOTIFICATION = 0x1B
+ATT_WRITE_COMMAND = 0x52
+
+CENTRAL, PERIPHERAL = 'central', 'peripheral'
+
+# time_us: timestamp in microseconds, sender: CENTRAL or PERIPHERAL,
+# opcode: ATT opcode, handle: attribute handle or None, value: the rest of the PDU
+AttPacket = namedtuple('AttPacket', ('time_us', 'sender', 'opcode', 'handle', 'value'))
+
+# ATT opcodes followed by an attribute handle
+_WITH_HANDLE = (0x0A, 0x0C, ATT_WRITE_REQUEST, ATT_NOTIFICATION, 0x1D, ATT_WRITE_COMMAND)
+
+
+class CaptureError(Exception):
+    pass
+
+
+def _read_blocks(data):
+    """Yields (block type, body) of each block with the byte order of its section."""
+    endian = '<'
+    ofs = 0
+    while ofs + 12 <= len(data):
+        if struct.unpack_from('<I', data, ofs)[0] == _BLOCK_SHB:
+            magic = data[ofs + 8 : ofs + 12]
+            endian = '<' if magic == b'\x4d\x3c\x2b\x1a' else '>'
+
+        block_type, length = struct.unpack_from(endian + 'II', data, ofs)
+        if length < 12 or ofs + length > len(data):
+            raise CaptureError('broken block at offset {}'.format(ofs))
+
+        yield endian, block_type, data[ofs + 8 : ofs + length - 4]
+        ofs += length
+
+
+def _tsresol(endian, options):
+    """Returns the unit of timestamps in seconds from the options of an IDB."""
+    ofs = 0
+    while ofs + 4 <= len(options):
+        code, length = struct.unpack_from(endian + 'HH', options, ofs)
+        if code == 0:
+            break
+        if code == _OPT_IF_TSRESOL:
+            v = options[ofs + 4]
+            return 2.0 ** -(v & 0x7F) if v & 0x80 else 10.0**-v
+        ofs += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def read_frames(data):
+    """Yields (time_us, flags, LL PDU without access address and CRC) from a pcapng."""
+    interfaces = []  # (link type, timestamp unit) of each interface
+
+    for endian, block_type, body in _read_blocks(data):
+        if block_type == _BLOCK_SHB:
+            interfaces = []
+
+        elif block_type == _BLOCK_IDB:
+            link_type = struct.unpack_from(endian + 'H', body)[0]
+            interfaces.append((link_type, _tsresol(endian, body[8:])))
+
+        elif block_type == _BLOCK_EPB:
+            if_id, ts_high, ts_low, cap_len = struct.unpack_from(endian + 'IIII', body)
+            link_type, unit = interfaces[if_id]
+            if link_type != _LINKTYPE_NORDIC_BLE:
+                raise CaptureError('unsupported link type: {}'.format(link_type))
+
+            time_us = round(((ts_high << 32) | ts_low) * unit * 1e6)
+            frame = _nordic_ble(body[20 : 20 + cap_len])
+            if frame is not None:
+                yield (time_us,) + frame
+
+
+def _nordic_ble(packet):
+    """Strips the Nordic BLE header (protocol version 2 or later) from a packet.
+
+    Returns (flags, LL PDU) or None if it's not a BLE packet.
+    """
+
+    if len(packet) < 7:
+        return None
+    header_len = packet[1]
+    packet_id = packet[1 + header_len - 1]
+    if packet_id != _NORDIC_EVENT_PACKET:
+        return None
+
+    ofs = 1 + header_len
+    event_len = packet[ofs]
+    flags = packet[ofs + 1]
+
+    # Access address (4) + LL PDU + CRC (3)
+    ll = packet[ofs + event_len :]
+    if len(ll) < 4 + 2 + 3:
+        return None
+    if struct.unpack_from('<I', ll)[0] == _ADV_ACCESS_ADDRESS:
+        return None
+    return flags, ll[4:-3]
+
+
+def read_att(data):
+    """Yields an AttPacket for each ATT PDU sent over the data channel in a pcapng."""
+    last = {}  # The last LL PDU of each direction to detect retransmissions
+    partial = {}  # L2CAP PDUs being reassembled of each direction
+
+    for time_us, flags, pdu in read_frames(data):
+        if not flags & _FLAG_CRC_OK or flags & _FLAG_ENCRYPTED:
+            continue
+
+        sender = CENTRAL if flags & _FLAG_MASTER_TO_SLAVE else PERIPHERAL
+        header, length = pdu[0], pdu[1]
+        llid, sn = header & 0x03, (header >> 3) & 0x01
+        payload = pdu[2 : 2 + length]
+
+        # A retransmission carries the same SN and the same payload again
+        if last.get(sender) == (sn, payload):
+            continue
+        last[sender] = (sn, payload)
+
+        if llid == _LLID_START:
+            partial[sender] = bytearray(payload)
+        elif llid == _LLID_CONTINUATION and sender in partial:
+            partial[sender] += payload
+        else:
+            continue  # LL control PDUs or a continuation without its start
+
+        l2cap = partial[sender]
+        if len(l2cap) < 4:
+            continue
+        l2cap_len, cid = struct.unpack_from('<HH', l2cap)
+        if len(l2cap) < 4 + l2cap_len:
+            continue
+        del partial[sender]
+
+        if cid != _CID_ATT or l2cap_len == 0:
+            continue
+
+        att = bytes(l2cap[4 : 4 + l2cap_len])
+        opcode = att[0]
+        if opcode in _WITH_HANDLE and len(att) >= 3:
+            handle = struct.unpack_from('<H', att, 1)[0]
+            yield AttPacket(time_us, sender, opcode, handle, att[3:])
+        else:
+            yield AttPacket(time_us, sender, opcode, None, att[1:])
+
+
+def load(path):
+    """Returns a list of AttPacket in a pcapng file."""
+    with open(path, 'rb') as f:
+        return list(read_att(f.read()))
@@ -0,0 +1,112 @@
+"""A minimal stand-in for the nanoweb submodule, used when it's not checked out.
+
+It serves the routes in the same way as nanoweb does: one request per connection,
+only the headers in extract_headers are kept, and routes ending with '*' match
+URLs by prefix.
+"""
+
+import uasyncio as asyncio
+import uerrno
+
+
+class HttpError(Exception):
+    pass
+
+
+class Request:
+    def __init__(self):
+        self.url = ""
+        self.method = ""
+        self.headers = {}
+        self.route = ""
+        self.read = None
+        self.write = None
+        self.close = None
+
+
+async def error(request, code, reason):
+    await request.write("HTTP/1.1 %s %s\r\n\r\n" % (code, reason))
+    await request.write("<h1>%s</h1>" % (reason))
+
+
+class Nanoweb:
+    extract_headers = ('Authorization', 'Content-Length', 'Content-Type')
+    callback_request = None
+    callback_error = staticmethod(error)
+
+    def __init__(self, port=80, address='0.0.0.0'):
+        self.port = port
+        self.address = address
+        self.routes = {}
+
+    def route(self, route):
+        def decorator(func):
+            self.routes[route] = func
+            return func
+
+        return decorator
+
+    async def generate_output(self, request, handler):
+        while True:
+            handler = await handler(request)
+            if not handler:
+                break
+
+    async def handle(self, reader, writer):
+        items = await reader.readline()
+        items = items.decode('ascii').split()
+        if len(items) != 3:
+            return
+
+        request = Request()
+        request.read = reader.read
+        request.write = writer.awrite
+        request.close = writer.aclose
+
+        request.method, request.url, version = items
+
+        try:
+            try:
+                if version not in ("HTTP/1.0", "HTTP/1.1"):
+                    raise HttpError(request, 505, "Version Not Supported")
+
+                while True:
+                    items = await reader.readline()
+                    items = items.decode('ascii').split(":", 1)
+
+                    if len(items) == 2:
+                        header, value = items
+                        value = value.strip()
+
+                        if header in self.extract_headers:
+                            request.headers[header] = value
+                    elif len(items) == 1:
+                        break
+
+                if self.callback_request:
+                    self.callback_request(request)
+
+                if request.url in self.routes:
+                    request.route = request.url
+                    await self.generate_output(request, self.routes[request.url])
+                else:
+                    for route, handler in self.routes.items():
+                        if route == request.url or (
+                            route[-1] == '*' and request.url.startswith(route[:-1])
+                        ):
+                            request.route = route
+                            await self.generate_output(request, handler)
+                            break
+                    else:
+                        raise HttpError(request, 404, "File Not Found")
+            except HttpError as e:
+                request, code, message = e.args
+                await self.callback_error(request, code, message)
+        except OSError as e:
+            if e.args[0] != uerrno.ECONNRESET:
+                raise
+        finally:
+            await writer.aclose()
+
+    async def run(self):
+        return await asyncio.start_server(self.handle, self.address, self.port)
@@ -0,0 +1,253 @@
+"""A stand-in for "bluetooth" module of MicroPython.
+
+BLE talks to simulated peripherals registered with attach() instead of a radio.
+Every IRQ is delivered on the running asyncio loop after the latency which the
+peripheral decides, so the timing of the central is exercised as on a device.
+"""
+
+import asyncio
+
+_IRQ_SCAN_RESULT = 5
+_IRQ_SCAN_DONE = 6
+_IRQ_PERIPHERAL_CONNECT = 7
+_IRQ_PERIPHERAL_DISCONNECT = 8
+_IRQ_GATTC_SERVICE_RESULT = 9
+_IRQ_GATTC_SERVICE_DONE = 10
+_IRQ_GATTC_CHARACTERISTIC_RESULT = 11
+_IRQ_GATTC_CHARACTERISTIC_DONE = 12
+_IRQ_GATTC_DESCRIPTOR_RESULT = 13
+_IRQ_GATTC_DESCRIPTOR_DONE = 14
+_IRQ_GATTC_READ_RESULT = 15
+_IRQ_GATTC_READ_DONE = 16
+_IRQ_GATTC_WRITE_DONE = 17
+_IRQ_GATTC_NOTIFY = 18
+
+_CONN_HANDLE = 0
+_NO_CONN_HANDLE = 65535
+
+FLAG_READ = 0x02
+FLAG_WRITE_NO_RESPONSE = 0x04
+FLAG_WRITE = 0x08
+FLAG_NOTIFY = 0x10
+
+_peripherals = []
+
+
+def attach(peripheral):
+    """Make a simulated peripheral reachable from BLE."""
+    _peripherals.append(peripheral)
+
+
+def detach_all():
+    _peripherals.clear()
+
+
+class UUID:
+    def __init__(self, value):
+        if isinstance(value, UUID):
+            self._b = value._b
+        elif isinstance(value, int):
+            self._b = value.to_bytes(2, 'little')
+        elif isinstance(value, str):
+            self._b = bytes.fromhex(value.replace('-', ''))[::-1]
+        else:
+            self._b = bytes(value)
+
+    def __bytes__(self):
+        return self._b
+
+    def __len__(self):
+        return len(self._b)
+
+    def __getitem__(self, i):
+        return self._b[i]
+
+    def __eq__(self, other):
+        return isinstance(other, UUID) and self._b == other._b
+
+    def __hash__(self):
+        return hash(self._b)
+
+    def __str__(self):
+        if len(self._b) == 2:
+            return 'UUID(0x{:04x})'.format(int.from_bytes(self._b, 'little'))
+        return "UUID('{}')".format(self._b[::-1].hex())
+
+    __repr__ = __str__
+
+
+class BLE:
+    """The singleton BLE interface as in MicroPython."""
+
+    _instance = None
+
+    def __new__(cls, *_):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._init()
+        return cls._instance
+
+    def _init(self):
+        self._active = False
+        self._handler = None
+        self._scanning = []  # Pending scan results
+        self._peer = None
+
+    # Delivery of IRQs
+
+    def _deliver(self, delay_ms, event, data, handles=None):
+        def fire():
+            if handles is not None:
+                handles.remove(handle)
+            if self._active and self._handler is not None:
+                self._handler(event, data)
+
+        handle = asyncio.get_running_loop().call_later(max(delay_ms, 0) / 1000, fire)
+        if handles is not None:
+            handles.append(handle)
+        return handle
+
+    def notify(self, peripheral, delay_ms, value_handle, data):
+        """Called by the peripheral to notify the central."""
+        if self._peer is peripheral:
+            self._deliver(
+                delay_ms, _IRQ_GATTC_NOTIFY, (_CONN_HANDLE, value_handle, memoryview(data))
+            )
+
+    def disconnected(self, peripheral, delay_ms=0):
+        """Called by the peripheral to drop the connection."""
+        if self._peer is peripheral:
+            self._peer = None
+            self._deliver(
+                delay_ms,
+                _IRQ_PERIPHERAL_DISCONNECT,
+                (_CONN_HANDLE, peripheral.addr_type, memoryview(peripheral.addr)),
+            )
+
+    # API of MicroPython
+
+    def active(self, active=None):
+        if active is not None:
+            self._active = active
+            if not active:
+                self._stop_scan(notify=False)
+                if self._peer is not None:
+                    self._peer.on_disconnect()
+                    self._peer = None
+        return self._active
+
+    def irq(self, handler):
+        self._handler = handler
+
+    def config(self, *args, **kwargs):
+        return None
+
+    def gap_scan(self, duration_ms, interval_us=1280000, window_us=11250, active=False):
+        if duration_ms is None:
+            self._stop_scan(notify=True)
+            return
+
+        self._stop_scan(notify=False)
+        for peripheral in _peripherals:
+            for delay_ms, adv_type, adv_data in peripheral.advertise(
+                duration_ms, interval_us, window_us, active
+            ):
+                data = (
+                    peripheral.addr_type,
+                    memoryview(peripheral.addr),
+                    adv_type,
+                    peripheral.rssi,
+                    memoryview(adv_data),
+                )
+                self._deliver(delay_ms, _IRQ_SCAN_RESULT, data, self._scanning)
+
+        self._scan_done = self._deliver(duration_ms, _IRQ_SCAN_DONE, None)
+
+    def _stop_scan(self, notify):
+        for handle in self._scanning:
+            handle.cancel()
+        self._scanning.clear()
+
+        if getattr(self, '_scan_done', None) is not None:
+            self._scan_done.cancel()
+            self._scan_done = None
+            if notify:
+                self._deliver(0, _IRQ_SCAN_DONE, None)
+
+    def gap_connect(self, addr_type, addr=None, scan_duration_ms=2000, *_):
+        connecting = getattr(self, '_connecting', None)
+        if addr_type is None:
+            # Cancel the pending attempt
+            if connecting is None or connecting.cancelled():
+                raise OSError(114)  # EALREADY
+            connecting.cancel()
+            self._connecting = None
+            return
+        for peripheral in _peripherals:
+            if peripheral.addr_type == addr_type and peripheral.addr == bytes(addr):
+                delay_ms = peripheral.on_connect(self)
+                if delay_ms is not None:
+                    self._peer = peripheral
+                    data = (_CONN_HANDLE, addr_type, memoryview(peripheral.addr))
+                    self._connecting = self._deliver(delay_ms, _IRQ_PERIPHERAL_CONNECT, data)
+                    return
+
+        # The attempt fails after scan_duration_ms if the peripheral is absent
+        data = (_NO_CONN_HANDLE, addr_type, memoryview(bytes(addr)))
+        self._connecting = self._deliver(scan_duration_ms, _IRQ_PERIPHERAL_DISCONNECT, data)
+
+    def gap_disconnect(self, conn_handle):
+        if self._peer is None or conn_handle != _CONN_HANDLE:
+            return False
+        peripheral = self._peer
+        peripheral.on_disconnect()
+        self.disconnected(peripheral, peripheral.latency())
+        return True
+
+    def _connected(self, conn_handle):
+        if self._peer is None or conn_handle != _CONN_HANDLE:
+            raise OSError(128)  # ENOTCONN
+        return self._peer
+
+    def gattc_discover_services(self, conn_handle, uuid=None):
+        peer = self._connected(conn_handle)
+        delay_ms = peer.latency() * 2
+        for start, end, svc_uuid in peer.services():
+            if uuid is None or svc_uuid == uuid:
+                data = (conn_handle, start, end, svc_uuid)
+                self._deliver(delay_ms, _IRQ_GATTC_SERVICE_RESULT, data)
+        self._deliver(delay_ms, _IRQ_GATTC_SERVICE_DONE, (conn_handle, 0))
+
+    def gattc_discover_characteristics(self, conn_handle, start_handle, end_handle, uuid=None):
+        peer = self._connected(conn_handle)
+        delay_ms = peer.latency() * 2
+        for handle, value_handle, properties, chr_uuid in peer.characteristics():
+            if start_handle <= handle <= end_handle and (uuid is None or chr_uuid == uuid):
+                data = (conn_handle, handle, value_handle, properties, chr_uuid)
+                self._deliver(delay_ms, _IRQ_GATTC_CHARACTERISTIC_RESULT, data)
+        self._deliver(delay_ms, _IRQ_GATTC_CHARACTERISTIC_DONE, (conn_handle, 0))
+
+    def gattc_discover_descriptors(self, conn_handle, start_handle, end_handle):
+        peer = self._connected(conn_handle)
+        delay_ms = peer.latency() * 2
+        for handle, dsc_uuid in peer.descriptors():
+            if start_handle <= handle <= end_handle:
+                data = (conn_handle, handle, dsc_uuid)
+                self._deliver(delay_ms, _IRQ_GATTC_DESCRIPTOR_RESULT, data)
+        self._deliver(delay_ms, _IRQ_GATTC_DESCRIPTOR_DONE, (conn_handle, 0))
+
+    def gattc_read(self, conn_handle, value_handle):
+        peer = self._connected(conn_handle)
+        delay_ms = peer.latency() * 2
+        value, status = peer.on_read(value_handle)
+        if value is not None:
+            data = (conn_handle, value_handle, memoryview(value))
+            self._deliver(delay_ms, _IRQ_GATTC_READ_RESULT, data)
+        self._deliver(delay_ms, _IRQ_GATTC_READ_DONE, (conn_handle, value_handle, status))
+
+    def gattc_write(self, conn_handle, value_handle, data, mode=0):
+        peer = self._connected(conn_handle)
+        status = peer.on_write(value_handle, bytes(data), mode == 1)
+        if mode == 1:
+            done = (conn_handle, value_handle, status)
+            self._deliver(peer.latency() * 2, _IRQ_GATTC_WRITE_DONE, done)
@@ -0,0 +1,60 @@
+"""A stand-in for "deflate" module of MicroPython on top of zlib."""
+
+import errno
+import zlib
+
+RAW = 1
+ZLIB = 2
+GZIP = 3
+AUTO = 4
+
+_wbits = {RAW: -15, ZLIB: 15, GZIP: 31, AUTO: 47}
+
+
+class DeflateIO:
+    """Decompresses a stream like deflate.DeflateIO of MicroPython.
+
+    The underlying stream is read by small pieces on demand, and EOFError is raised
+    if it ends before the compressed data ends, as MicroPython does. Broken data
+    raises OSError(EINVAL) as well.
+    """
+
+    def __init__(self, stream, format=AUTO, wbits=0, close=False):
+        self._stream = stream
+        self._d = zlib.decompressobj(_wbits[format])
+        self._out = b''
+        self._piece = bytearray(16)
+
+    def readinto(self, buf):
+        while len(self._out) < len(buf) and not self._d.eof:
+            n = self._stream.readinto(self._piece)
+            if not n:
+                raise EOFError
+            try:
+                self._out += self._d.decompress(bytes(self._piece[:n]))
+            except zlib.error:
+                raise OSError(errno.EINVAL)
+
+        n = min(len(buf), len(self._out))
+        buf[:n] = self._out[:n]
+        self._out = self._out[n:]
+        return n
+
+    def read(self, n=-1):
+        chunks = []
+        buf = bytearray(256 if n < 0 else n)
+        while n < 0 or sum(len(c) for c in chunks) < n:
+            r = self.readinto(buf)
+            if not r:
+                break
+            chunks.append(bytes(buf[:r]))
+        return b''.join(chunks)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
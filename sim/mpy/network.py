@@ -0,0 +1,25 @@
+"""A stand-in for "network" module of MicroPython. The Wi-Fi is always up."""
+
+STA_IF = 0
+
+
+class WLAN:
+    def __init__(self, interface):
+        self._active = False
+
+    def active(self, active=None):
+        if active is not None:
+            self._active = active
+        return self._active
+
+    def config(self, **_):
+        pass
+
+    def connect(self, ssid, psk):
+        pass
+
+    def isconnected(self):
+        return True
+
+    def ifconfig(self):
+        return '127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1'
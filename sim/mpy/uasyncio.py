@@ -0,0 +1,66 @@
+"""A stand-in for "uasyncio" module of MicroPython on top of asyncio."""
+
+import asyncio
+from asyncio import (  # noqa: F401
+    CancelledError,
+    Event,
+    Lock,
+    TimeoutError,
+    create_task,
+    gather,
+    get_event_loop,
+    run,
+    sleep,
+    wait_for,
+)
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(aw, timeout):
+    return await asyncio.wait_for(aw, timeout / 1000)
+
+
+class ThreadSafeFlag:
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+class StreamWriter:
+    """Wraps asyncio.StreamWriter to have awrite() and aclose() of MicroPython."""
+
+    def __init__(self, writer):
+        self._writer = writer
+
+    async def awrite(self, data):
+        self._writer.write(data.encode() if isinstance(data, str) else data)
+        await self._writer.drain()
+
+    async def aclose(self):
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except OSError:
+            pass
+
+    def get_extra_info(self, name):
+        return self._writer.get_extra_info(name)
+
+
+async def start_server(callback, host, port, backlog=5):
+    async def handle(reader, writer):
+        await callback(reader, StreamWriter(writer))
+
+    return await asyncio.start_server(handle, host, port, backlog=backlog)
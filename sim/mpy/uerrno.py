@@ -0,0 +1,3 @@
+"""A stand-in for "uerrno" module of MicroPython."""
+
+from errno import *  # noqa: F401,F403
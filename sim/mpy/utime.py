@@ -0,0 +1,3 @@
+"""A stand-in for "utime" module of MicroPython."""
+
+from time import *  # noqa: F401,F403 (ticks_ms and others are patched by sim.install)
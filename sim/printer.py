@@ -0,0 +1,270 @@
+"""A simulated KING JIM TEPRA Lite LR30 speaking the protocol in doc/reverse_engineering.md."""
+
+import random
+import time
+
+import bluetooth
+
+_TEPRA = b'\xf1\x5a\x00\x02\x00\x54\x45\x50\x52\x41'  # f1 5a 00 02 00 "TEPRA"
+
+# Order of the Bytes of a pair of lines in a f0 5c chunk (see Tepra._print)
+_CHUNK_ORDER = (6, 7, 4, 5, 2, 3, 0, 1, 14, 15, 12, 13, 10, 11, 8, 9)
+
+_UUID_BATTERY_SERVICE = bluetooth.UUID(0x180F)
+_UUID_BATTERY_LEVEL = bluetooth.UUID(0x2A19)
+_UUID_TEPRA_SERVICE = bluetooth.UUID(0xFFF0)
+_UUID_RX = bluetooth.UUID(0xFFF1)
+_UUID_TX = bluetooth.UUID(0xFFF2)
+_UUID_USER_DESCRIPTION = bluetooth.UUID(0x2901)
+_UUID_CCCD = bluetooth.UUID(0x2902)
+
+_STATUS_OK = 0x00
+_STATUS_INVALID_HANDLE = 0x01
+_ENOMEM = 12
+
+
+def unchunk(chunk: bytes) -> bytes:
+    """Restore a pair of lines from the payload of a f0 5c chunk (without f0 5c)."""
+    pair = bytearray(16)
+    for dst, src in enumerate(_CHUNK_ORDER):
+        pair[src] = chunk[dst]
+    return bytes(pair)
+
+
+class Job:
+    """A print the simulated printer received."""
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.raster = bytearray()  # Lines of 8 Bytes as in the body of POST /prints
+        self.chunks = 0
+        self.started_at = time.monotonic()
+        self.first_chunk_at = None
+        self.lines_done_at = None
+        self.finished_at = None
+        self.status_polls = 0
+
+
+class SimulatedLR30:
+    """A simulated LR30 as a GATT server.
+
+    Timing parameters (milliseconds):
+     - latency_ms: one-way latency of each packet on the link
+     - packet_ms: time to transmit one packet, so that packets queue up on the link
+     - chunk_ms: time for the printer to process a chunk of 2 lines
+     - line_ms: time to physically print a line. Lines are printed as they're received
+     - settle_ms: time to feed and cut the tape after the last line is printed
+    Other parameters:
+     - drop_rate: probability to lose a write without response
+     - buffer_chunks: the printer drops chunks arriving beyond this many unprocessed ones
+     - tx_queue: writes in flight beyond this many fail with ENOMEM as NimBLE does
+     - window: the printer notifies f1 5c every this many chunks
+
+    Every print is recorded as a Job in jobs. Job.raster is the image reconstructed
+    from the chunks, which can be compared with what was sent.
+    """
+
+    def __init__(
+        self,
+        addr=b'\x74\xd5\xc6\x00\x00\x30',
+        addr_type=0,
+        name='LR30 SIM',
+        rssi=-50,
+        latency_ms=8.0,
+        packet_ms=1.25,
+        chunk_ms=2.0,
+        line_ms=2.0,
+        settle_ms=0.0,
+        drop_rate=0.0,
+        buffer_chunks=12,
+        tx_queue=8,
+        window=6,
+        battery=99,
+        seed=0,
+    ):
+        self.addr, self.addr_type, self.name, self.rssi = addr, addr_type, name, rssi
+        self.latency_ms, self.packet_ms = latency_ms, packet_ms
+        self.chunk_ms, self.line_ms, self.settle_ms = chunk_ms, line_ms, settle_ms
+        self.drop_rate, self.buffer_chunks, self.tx_queue = drop_rate, buffer_chunks, tx_queue
+        self.window = window
+        self.battery = battery
+        self._random = random.Random(seed)
+
+        self.jobs = []
+        self.writes = []  # (time, value handle, data) of every write, for inspection
+        self.notifications = []  # (time, data) of every notification
+        self.dropped = 0
+        self.enomem = 0
+        self.connections = 0
+
+        self._central = None
+        self._notifying = set()
+        self._link_free_at = 0.0  # When the link becomes free to transmit the next packet
+        self._busy_until = 0.0  # When the printer finishes processing the received chunks
+        self._in_flight = []
+        self._job = None
+        self._build_table()
+
+    def _build_table(self):
+        # Battery Service: 0x0001 - 0x0004
+        # TEPRA Lite Specific Service: 0x0005 - 0x000b
+        # A User Description is put before CCCD of RX so that value handle + 1 != CCCD
+        self._services = [
+            (0x0001, 0x0004, _UUID_BATTERY_SERVICE),
+            (0x0005, 0x000B, _UUID_TEPRA_SERVICE),
+        ]
+        self._characteristics = [
+            (0x0002, 0x0003, bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY, _UUID_BATTERY_LEVEL),
+            (0x0006, 0x0007, bluetooth.FLAG_NOTIFY, _UUID_RX),
+            (0x000A, 0x000B, bluetooth.FLAG_WRITE_NO_RESPONSE, _UUID_TX),
+        ]
+        self._descriptors = [
+            (0x0004, _UUID_CCCD),
+            (0x0008, _UUID_USER_DESCRIPTION),
+            (0x0009, _UUID_CCCD),
+        ]
+        self.battery_handle, self.rx_handle, self.tx_handle = 0x0003, 0x0007, 0x000B
+        self._cccds = {0x0004: 0x0003, 0x0009: 0x0007}
+
+    # Used by bluetooth.BLE
+
+    def services(self):
+        return self._services
+
+    def characteristics(self):
+        return self._characteristics
+
+    def descriptors(self):
+        return self._descriptors
+
+    def latency(self) -> float:
+        return self.latency_ms
+
+    def advertise(self, duration_ms, interval_us, window_us, active):
+        """Returns (delay, adv_type, payload) of advertisements seen during a scan."""
+        name = self.name.encode()
+        adv_ind = bytes((2, 0x01, 0x06))
+        scan_rsp = bytes((len(name) + 1, 0x09)) + name
+        first = self._random.uniform(0, interval_us / 1000)
+        results = [(first, 0x00, adv_ind)]
+        if active:
+            results.append((first + 1, 0x04, scan_rsp))
+        return results
+
+    def on_connect(self, central):
+        self._central = central
+        self._notifying.clear()
+        self.connections += 1
+        return self.latency_ms * 2
+
+    def on_disconnect(self):
+        self._central = None
+        self._notifying.clear()
+
+    def on_read(self, value_handle):
+        if value_handle == self.battery_handle:
+            return bytes((self.battery,)), _STATUS_OK
+        return None, _STATUS_INVALID_HANDLE
+
+    def on_write(self, value_handle, data, with_response):
+        now = time.monotonic() * 1000
+        self.writes.append((now, value_handle, data))
+
+        if value_handle in self._cccds:
+            chr_handle = self._cccds[value_handle]
+            if data[0] & 0x01:
+                self._notifying.add(chr_handle)
+            else:
+                self._notifying.discard(chr_handle)
+            return _STATUS_OK
+
+        if value_handle != self.tx_handle:
+            return _STATUS_INVALID_HANDLE
+
+        # Writes without response queue up on the link and may run out of buffers
+        self._in_flight = [t for t in self._in_flight if t > now]
+        if len(self._in_flight) >= self.tx_queue:
+            self.enomem += 1
+            raise OSError(_ENOMEM)
+
+        self._link_free_at = max(now, self._link_free_at) + self.packet_ms
+        arrives_at = self._link_free_at + self.latency_ms
+        self._in_flight.append(self._link_free_at)
+
+        if self._random.random() < self.drop_rate:
+            self.dropped += 1
+            return _STATUS_OK
+
+        self._receive(arrives_at, data)
+        return _STATUS_OK
+
+    # Protocol
+
+    def _notify(self, at_ms, data, handle=None):
+        handle = self.rx_handle if handle is None else handle
+        if self._central is None or handle not in self._notifying:
+            return
+        now = time.monotonic() * 1000
+        if handle == self.rx_handle:
+            self.notifications.append((max(at_ms, now), data))
+        self._central.notify(self, at_ms - now + self.latency_ms, handle, data)
+
+    def _receive(self, at_ms, data):
+        if data[:2] == b'\xf0\x5a':
+            self._notify(at_ms, _TEPRA)
+
+        elif data[:2] == b'\xf0\x5b':
+            d = data[2]
+            self._job = Job(-(d - 0x10) if d & 0x10 else d)
+            self._busy_until = at_ms
+            self._notify(at_ms, b'\xf1\x5b\x00' + data[3:4])
+
+        elif data[:2] == b'\xf0\x5c':
+            job = self._job
+            if job is None:
+                return
+
+            # Chunks arriving while the buffer is full are lost
+            queued = (self._busy_until - at_ms) / self.chunk_ms if self.chunk_ms else 0
+            if queued >= self.buffer_chunks:
+                self.dropped += 1
+                return
+
+            self._busy_until = max(at_ms, self._busy_until) + self.chunk_ms
+            if job.first_chunk_at is None:
+                job.first_chunk_at = self._busy_until
+            job.raster += unchunk(data[2:18])
+            job.chunks += 1
+            if job.chunks % self.window == 0:
+                # The last Byte counts the chunks received as in the capture
+                credit = b'\xf1\x5c\x00\x00\x00' + bytes((job.chunks & 0xFF,))
+                self._notify(self._busy_until, credit)
+
+        elif data[:2] == b'\xf0\x5d':
+            job = self._job
+            if job is None:
+                return
+            job.lines_done_at = max(at_ms, self._busy_until)
+            printed_at = (job.first_chunk_at or at_ms) + len(job.raster) // 8 * self.line_ms
+            job.finished_at = max(job.lines_done_at, printed_at) + self.settle_ms
+            self.jobs.append(job)
+            self._notify(job.lines_done_at, b'\xf1\x5d\x00')
+
+        elif data[:2] == b'\xf0\x5e':
+            job = self.jobs[-1] if self.jobs else None
+            printing = job is not None and job.finished_at > at_ms
+            if job is not None:
+                job.status_polls += 1
+            self._notify(at_ms, b'\xf1\x5e\x01\x00' if printing else b'\xf1\x5e\x00\x00')
+
+    def set_battery(self, level):
+        """Change the battery level and notify it if the central has subscribed."""
+        self.battery = level
+        self._notify(time.monotonic() * 1000, bytes((level,)), self.battery_handle)
+
+    def sleep(self):
+        """Fall asleep and drop the connection like LR30 does after a while."""
+        if self._central is not None:
+            central = self._central
+            self.on_disconnect()
+            central.disconnected(self)
@@ -0,0 +1,246 @@
+"""Replay the prints in a capture of the official app against Tepra on the simulated LR30.
+
+For each print found in the capture (f0 5b ... f1 5e 00 00):
+
+ - conformance: the lines are restored from the captured f0 5c chunks and printed
+   with Tepra. What Tepra writes must match the captured writes byte for byte.
+ - timing: the pacing of the official app (lines/s, gaps between chunks, chunks per
+   credit, credit latency) is compared with Tepra on the simulated LR30. The latency
+   of the simulated link is calibrated from the capture unless --latency-ms is given.
+
+The sniffer may miss packets. Chunks missing from the capture are counted from the
+f1 5c credits, whose last Byte is the number of chunks the printer has received.
+
+usage: python -m sim.replay [--latency-ms MS] [capture.pcapng]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+
+import sim
+from sim import capture
+
+_DEFAULT_CAPTURE = os.path.join(sim.root, 'doc', 'sniffed_packets.pcapng')
+
+
+class Print:
+    """Writes and notifications of a print as lists of (time in ms, data)."""
+
+    def __init__(self):
+        self.writes = []
+        self.notifications = []
+
+    @property
+    def depth(self) -> int:
+        d = self.writes[0][1][2]
+        return -(d - 0x10) if d & 0x10 else d
+
+    def chunks(self):
+        return [data for _, data in self.writes if data[:2] == b'\xf0\x5c']
+
+    def raster(self) -> bytes:
+        from sim.printer import unchunk
+
+        return b''.join(unchunk(chunk[2:]) for chunk in self.chunks())
+
+    def missing_chunks(self) -> int:
+        """Number of chunks the printer received but the capture lacks."""
+        credits = [data for _, data in self.notifications if data[:2] == b'\xf1\x5c']
+        received = 0
+        for credit in credits:
+            # The counter is a Byte: count the wraparounds
+            received += (credit[-1] - received) & 0xFF
+        sent = len(self.chunks())
+        return max(0, received - sent)
+
+
+def split_prints(packets):
+    """Returns a list of Print found in a list of capture.AttPacket."""
+    writes = [p for p in packets if p.opcode == capture.ATT_WRITE_COMMAND]
+    notifications = [p for p in packets if p.opcode == capture.ATT_NOTIFICATION]
+    tx = {p.handle for p in writes if p.value[:1] == b'\xf0'}
+    rx = {p.handle for p in notifications if p.value[:1] == b'\xf1'}
+
+    events = [p for p in writes if p.handle in tx] + [p for p in notifications if p.handle in rx]
+    events.sort(key=lambda p: p.time_us)
+
+    prints = []
+    for p in events:
+        t, data = p.time_us / 1000, p.value
+        if p.sender == capture.CENTRAL and data[:2] == b'\xf0\x5b':
+            prints.append(Print())
+        if not prints:
+            continue  # f0 5a is sent once before the first print
+        if p.sender == capture.CENTRAL:
+            prints[-1].writes.append((t, data))
+        else:
+            prints[-1].notifications.append((t, data))
+    return prints
+
+
+def _first(events, prefix):
+    for t, data in events:
+        if data.startswith(prefix):
+            return t
+    return None
+
+
+def _round_trips(pr):
+    """Returns the latencies between requests and their replies in ms."""
+    rtts = []
+    for request, reply in ((b'\xf0\x5b', b'\xf1\x5b'), (b'\xf0\x5d', b'\xf1\x5d')):
+        sent, received = _first(pr.writes, request), _first(pr.notifications, reply)
+        if sent is not None and received is not None and received > sent:
+            rtts.append(received - sent)
+    return rtts
+
+
+def timing(pr, missing=0) -> dict:
+    """Returns the pacing of a print. missing is the number of chunks the capture lacks."""
+    chunk_times = [t for t, data in pr.writes if data[:2] == b'\xf0\x5c']
+    credits = [t for t, data in pr.notifications if data[:2] == b'\xf1\x5c']
+    first, end = chunk_times[0], _first(pr.writes, b'\xf0\x5d')
+    lines = (len(chunk_times) + missing) * 2
+
+    # The latency of a credit is from the last chunk sent before it
+    credit_latencies = []
+    for credit in credits:
+        before = [t for t in chunk_times if t < credit]
+        if before:
+            credit_latencies.append(credit - before[-1])
+
+    # Chunks sent in a row until the credit for them arrives
+    windows, n = [], 0
+    events = sorted([(t, 0) for t in chunk_times] + [(t, 1) for t in credits])
+    for _, is_credit in events:
+        if is_credit:
+            windows.append(n)
+            n = 0
+        else:
+            n += 1
+
+    gaps = [b - a for a, b in zip(chunk_times, chunk_times[1:])]
+    polls = [t for t, data in pr.writes if data[:2] == b'\xf0\x5e']
+    return {
+        'lines': lines,
+        'lines_per_s': lines / ((end - first) / 1000) if end and end > first else 0.0,
+        'gap_ms': statistics.median(gaps) if gaps else 0.0,
+        'credit_latency_ms': statistics.median(credit_latencies) if credit_latencies else 0.0,
+        'window': statistics.median(windows) if windows else 0,
+        'polls': len(polls),
+    }
+
+
+def compare(expected, actual):
+    """Returns a list of differences between the captured writes and Tepra's writes."""
+    differences = []
+
+    def sequence(writes):
+        # f0 5a is sent once per connection by the app and once per print by Tepra, and
+        # the number of f0 5e depends on how long the printer takes
+        return [data for _, data in writes if data[:2] not in (b'\xf0\x5a', b'\xf0\x5e')]
+
+    e, a = sequence(expected), sequence(actual)
+    if len(e) != len(a):
+        differences.append('{} writes captured, {} written by Tepra'.format(len(e), len(a)))
+    for i, (x, y) in enumerate(zip(e, a)):
+        if x != y:
+            differences.append('write #{}: captured {} != {}'.format(i, x.hex(), y.hex()))
+            break
+    return differences
+
+
+async def print_on_sim(raster, depth, pacer, latency_ms):
+    """Prints the raster with Tepra on a SimulatedLR30 and returns it as a Print."""
+    from sim.printer import SimulatedLR30
+    from tepra import CompletionTracker, Tepra
+
+    sim.reset()
+    printer = sim.attach(SimulatedLR30(latency_ms=latency_ms))
+
+    with tempfile.TemporaryDirectory() as d:
+        tracker = CompletionTracker(line_ms=printer.line_ms, depth_line_ms=0)
+        t = Tepra(pacer=pacer, handles_path=os.path.join(d, 'handles.json'), tracker=tracker)
+        t.activate()
+        if not await t.connect():
+            raise RuntimeError('failed to connect to the simulated printer')
+        printer.writes.clear()
+        printer.notifications.clear()
+        ok, err = await t.print(raster, depth)
+        if not ok:
+            raise RuntimeError('print failed: {}'.format(err))
+
+    pr = Print()
+    pr.writes = [(t, data) for t, handle, data in printer.writes if handle == printer.tx_handle]
+    pr.notifications = printer.notifications
+    return pr
+
+
+def _format(name, t):
+    return (
+        '  {:28s} {:6.1f} lines/s  gap {:5.1f} ms  window {:3.0f}'
+        '  credit latency {:5.1f} ms  polls {}'
+    ).format(name, t['lines_per_s'], t['gap_ms'], t['window'], t['credit_latency_ms'], t['polls'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m sim.replay', description=__doc__.split('\n')[0]
+    )
+    parser.add_argument('capture', nargs='?', default=_DEFAULT_CAPTURE)
+    parser.add_argument('--latency-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    sim.install()
+    from tepra import Pacer
+
+    prints = split_prints(capture.load(args.capture))
+    if not prints:
+        print('no prints found in {}'.format(args.capture), file=sys.stderr)
+        return 1
+
+    latency_ms = args.latency_ms
+    if latency_ms is None:
+        rtts = [rtt for pr in prints for rtt in _round_trips(pr)]
+        latency_ms = statistics.median(rtts) / 2 if rtts else 8.0
+
+    print(
+        '{} prints in {}, simulated link latency: {:.1f} ms'.format(
+            len(prints), args.capture, latency_ms
+        )
+    )
+
+    failed = False
+    for i, pr in enumerate(prints):
+        missing = pr.missing_chunks()
+        raster = pr.raster()
+        print(
+            'print #{}: depth {}, {} chunks captured, {} missed by the sniffer'.format(
+                i, pr.depth, len(pr.chunks()), missing
+            )
+        )
+
+        pipelined = asyncio.run(print_on_sim(raster, pr.depth, Pacer(), latency_ms))
+        legacy = asyncio.run(print_on_sim(raster, pr.depth, Pacer(gap_ms=20), latency_ms))
+
+        differences = compare(pr.writes, pipelined.writes)
+        if differences:
+            failed = True
+            for d in differences:
+                print('  MISMATCH: {}'.format(d))
+        else:
+            print('  conformance: OK ({} chunks byte for byte)'.format(len(pr.chunks())))
+
+        print(_format('official app (captured)', timing(pr, missing)))
+        print(_format('Tepra, 20 ms gap (sim)', timing(legacy)))
+        print(_format('Tepra, Pacer (sim)', timing(pipelined)))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
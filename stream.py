@@ -0,0 +1,349 @@
+import array
+import deflate
+import io
+import micropython
+import time
+from micropython import const
+
+_CHUNK = const(512)  # Bytes to read from the request body at once
+_MARGIN = const(512)  # Compressed Bytes kept buffered to inflate a pair of lines at any point
+_PAIR = const(16)  # A pair of lines = 8 Bytes * 2
+
+# Content-Encoding of an image posted to /prints
+ZLIB = 'zlib'
+RLE = 'rle'
+IDENTITY = 'identity'
+encodings = (ZLIB, RLE, IDENTITY)
+
+
+class _Feeder(io.IOBase):
+    """A stream which deflate.DeflateIO reads the compressed data from.
+
+    The buffer is allocated once and refilled from the request body as the
+    inflater consumes it, so the memory usage doesn't depend on the body size.
+    """
+
+    def __init__(self, size):
+        self._buf = bytearray(size)
+        self._mv = memoryview(self._buf)
+        self._head = 0  # Position to read from
+        self._tail = 0  # Position to write to
+
+    def buffered(self) -> int:
+        return self._tail - self._head
+
+    async def fill(self, read, max_len) -> int:
+        # Move the unread data to the beginning of the buffer
+        if self._head > 0:
+            n = self._tail - self._head
+            self._mv[:n] = self._mv[self._head : self._tail]
+            self._head, self._tail = 0, n
+
+        chunk = await read(min(max_len, len(self._buf) - self._tail))
+        n = len(chunk)
+        self._mv[self._tail : self._tail + n] = chunk
+        self._tail += n
+        return n
+
+    def readinto(self, buf):
+        n = min(len(buf), self._tail - self._head)
+        buf[:n] = self._mv[self._head : self._head + n]
+        self._head += n
+        return n
+
+
+class BufferReader:
+    """Serves the same read() as a request body from a buffer on memory."""
+
+    def __init__(self, b):
+        self._mv = memoryview(b)
+        self._ofs = 0
+
+    async def read(self, n: int):
+        chunk = self._mv[self._ofs : self._ofs + n]
+        self._ofs += len(chunk)
+        return chunk
+
+
+class InflateReader:
+    """Reads a zlib-compressed image from the request body and inflates it by a pair of lines.
+
+    Only a small part of the body is held on memory at once: the request body is
+    read in chunks while the lines are decompressed and sent to the printer.
+    """
+
+    received: int
+    inflated: int
+    inflate_us: int
+
+    def __init__(self, read, length: int):
+        self._read = read
+        self._remaining = length
+        self._feeder = _Feeder(_CHUNK + _MARGIN)
+        self._inflater = deflate.DeflateIO(self._feeder, deflate.ZLIB)
+        self._pair = bytearray(_PAIR)
+        self._pair_mv = memoryview(self._pair)
+        self.received = 0
+        self.inflated = 0
+        self.inflate_us = 0  # Time spent decompressing, excluding reading the body
+
+    async def _fill(self):
+        # Keep enough compressed data buffered so that the inflater never sees the end
+        # of the feeder before the end of the body
+        while self._remaining > 0 and self._feeder.buffered() < _MARGIN:
+            n = await self._feeder.fill(self._read, min(_CHUNK, self._remaining))
+            if n == 0:
+                raise EOFError('the request body ended before Content-Length')
+            self._remaining -= n
+            self.received += n
+
+    async def read_pair(self):
+        """Returns a memoryview of the next 16 Bytes of the image, or None at the end.
+
+        The returned memoryview is valid until the next call.
+        """
+
+        n = 0
+        while n < _PAIR:
+            await self._fill()
+            # Avoid slicing a memoryview (= allocation) unless it has read a part of a pair
+            started = time.ticks_us()
+            r = self._inflater.readinto(self._pair_mv[n:] if n else self._pair)
+            self.inflate_us += time.ticks_diff(time.ticks_us(), started)
+            if not r:
+                break
+            n += r
+
+        self.inflated += n
+
+        if n == 0:
+            return None
+        elif n < _PAIR:
+            raise ValueError('insufficient length, image data length must be aligned to 16')
+        return self._pair_mv
+
+
+# Indexes of the state of RleReader shared with _unpack()
+_LITERAL = const(0)  # Literal Bytes left to copy
+_RUN = const(1)  # Times left to repeat the value
+_VALUE = const(2)
+_HEAD = const(3)  # Position in the buffer to read from
+_TAIL = const(4)  # End of the buffered data
+
+
+def _unpack_py(pair, n, buf, state):
+    """Decode PackBits from buf[state[_HEAD]:state[_TAIL]] into pair from n.
+
+    Returns the new n.
+
+    Stops when the pair is full or the buffered data ends, keeping a literal or a
+    run across the calls in state.
+    """
+
+    literal = state[_LITERAL]
+    run = state[_RUN]
+    value = state[_VALUE]
+    head = state[_HEAD]
+    tail = state[_TAIL]
+    while n < _PAIR:
+        if run:
+            k = min(run, _PAIR - n)
+            pair[n : n + k] = bytes((value,)) * k
+            run -= k
+            n += k
+        elif literal:
+            k = min(literal, _PAIR - n, tail - head)
+            if not k:
+                break
+            pair[n : n + k] = buf[head : head + k]
+            head += k
+            literal -= k
+            n += k
+        elif head < tail:
+            h = buf[head]
+            if h < 128:
+                literal = h + 1
+            elif h > 128:
+                if tail - head < 2:
+                    break
+                run = 257 - h
+                value = buf[head + 1]
+                head += 1
+            head += 1
+        else:
+            break
+    state[_LITERAL] = literal
+    state[_RUN] = run
+    state[_VALUE] = value
+    state[_HEAD] = head
+    return n
+
+
+try:
+
+    # The tail is passed in the state to keep viper within 4 arguments
+    @micropython.viper
+    def _unpack(pair: ptr8, n: int, buf: ptr8, state: ptr32) -> int:
+        literal = state[0]
+        run = state[1]
+        value = state[2]
+        head = state[3]
+        tail = state[4]
+        while n < 16:
+            if run > 0:
+                while run > 0 and n < 16:
+                    pair[n] = value
+                    n += 1
+                    run -= 1
+            elif literal > 0:
+                if head >= tail:
+                    break
+                while literal > 0 and n < 16 and head < tail:
+                    pair[n] = buf[head]
+                    n += 1
+                    head += 1
+                    literal -= 1
+            elif head < tail:
+                h = buf[head]
+                if h < 128:
+                    literal = h + 1
+                elif h > 128:
+                    if tail - head < 2:
+                        break
+                    run = 257 - h
+                    value = buf[head + 1]
+                    head += 1
+                head += 1
+            else:
+                break
+        state[0] = literal
+        state[1] = run
+        state[2] = value
+        state[3] = head
+        return n
+
+except (AttributeError, NameError):
+    # The viper emitter is unavailable (e.g. stand-in modules on CPython)
+    _unpack = _unpack_py
+
+
+class RleReader:
+    """Reads an image compressed with PackBits from the request body by a pair of lines.
+
+    A header byte n is followed by n + 1 literal Bytes if n < 128, or by a Byte
+    repeated 257 - n times if n > 128. 128 is skipped. Decoding needs no tables nor
+    window unlike inflate, and a run longer than a pair is resumed in the next one.
+    The Bytes are unpacked by _unpack(), compiled by viper where it's available.
+    """
+
+    received: int
+    inflated: int
+    inflate_us: int
+
+    def __init__(self, read, length: int):
+        self._read = read
+        self._remaining = length
+        self._feeder = _Feeder(_CHUNK + _PAIR * 2)
+        self._state = array.array('i', (0, 0, 0, 0, 0))  # Indexed by _LITERAL, _RUN, ...
+        self._pair = bytearray(_PAIR)
+        self._pair_mv = memoryview(self._pair)
+        self.received = 0
+        self.inflated = 0
+        self.inflate_us = 0
+
+    async def _fill(self):
+        # A pair takes 32 Bytes at most unless the encoder pads it with 128
+        while self._remaining > 0 and self._feeder.buffered() < _PAIR * 2:
+            n = await self._feeder.fill(self._read, min(_CHUNK, self._remaining))
+            if n == 0:
+                raise EOFError('the request body ended before Content-Length')
+            self._remaining -= n
+            self.received += n
+
+    def _decode(self, n: int) -> int:
+        """Decode the buffered data into the pair from n. Returns the new n."""
+        feeder, state = self._feeder, self._state
+        state[_HEAD] = feeder._head
+        state[_TAIL] = feeder._tail
+        n = _unpack(self._pair, n, feeder._mv, state)
+        feeder._head = state[_HEAD]
+        return n
+
+    async def read_pair(self):
+        """Returns a memoryview of the next 16 Bytes of the image, or None at the end.
+
+        The returned memoryview is valid until the next call.
+        """
+
+        n = 0
+        while n < _PAIR:
+            await self._fill()
+            started = time.ticks_us()
+            decoded = self._decode(n)
+            self.inflate_us += time.ticks_diff(time.ticks_us(), started)
+            if decoded == n and self._remaining == 0:
+                break
+            n = decoded
+
+        self.inflated += n
+
+        if n < _PAIR and (self._state[_LITERAL] or self._feeder.buffered()):
+            raise ValueError('the run-length encoded data is truncated')
+        elif n == 0:
+            return None
+        elif n < _PAIR:
+            raise ValueError('insufficient length, image data length must be aligned to 16')
+        return self._pair_mv
+
+
+class IdentityReader:
+    """Reads an uncompressed image from the request body by a pair of lines."""
+
+    received: int
+    inflated: int
+    inflate_us: int
+
+    def __init__(self, read, length: int):
+        self._read = read
+        self._remaining = length
+        self._pair = bytearray(_PAIR)
+        self._pair_mv = memoryview(self._pair)
+        self.received = 0
+        self.inflated = 0
+        self.inflate_us = 0  # Nothing to decode, kept for the same interface
+
+    async def read_pair(self):
+        """Returns a memoryview of the next 16 Bytes of the image, or None at the end.
+
+        The returned memoryview is valid until the next call.
+        """
+
+        n = 0
+        while n < _PAIR and self._remaining > 0:
+            chunk = await self._read(min(_PAIR - n, self._remaining))
+            k = len(chunk)
+            if k == 0:
+                raise EOFError('the request body ended before Content-Length')
+            self._pair_mv[n : n + k] = chunk
+            self._remaining -= k
+            self.received += k
+            n += k
+
+        self.inflated += n
+
+        if n == 0:
+            return None
+        elif n < _PAIR:
+            raise ValueError('insufficient length, image data length must be aligned to 16')
+        return self._pair_mv
+
+
+def open_reader(encoding: str, read, length: int):
+    """Returns the reader of an image in the encoding. Raises ValueError if it's unknown."""
+    if encoding == ZLIB:
+        return InflateReader(read, length)
+    elif encoding == RLE:
+        return RleReader(read, length)
+    elif encoding == IDENTITY:
+        return IdentityReader(read, length)
+    raise ValueError('unknown encoding: {}'.format(encoding))
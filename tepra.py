@@ -4,9 +4,12 @@
 import binascii
 import bluetooth
 import gc
+import json
+import metrics
+import micropython
 import time
 import uasyncio
-from ble_advertising import decode_name
+from ble_advertising import decode_name, decode_services
 from micropython import const
 
 # Silence type checkers
@@ -35,12 +38,126 @@ _IRQ_GATTC_WRITE_DONE = const(17)
 _IRQ_GATTC_NOTIFY = const(18)
 _IRQ_GATTC_INDICATE = const(19)
 
+_SCAN_DURATION_MS = const(5000)
+_SCAN_INTERVAL_US = const(100000)
+_SCAN_WINDOW_US = const(10000)
+_NAME_PREFIXES = (b'LR30', b'TepraBLE')
+_ADV_TYPE_SHORT_NAME = const(0x08)
+_ADV_TYPE_NAME = const(0x09)
+_TIMEOUT_MS = const(5000)  # Default timeout of operations waiting for a response
+_DIRECT_CONNECT_MS = const(2000)  # Give up connecting to the last printer directly after this
+_BATTERY_MAX_AGE_MS = const(60000)
+_WRITE_RETRIES = const(10)
+_WRITE_RETRY_MS = const(5)
 
-def new_logger(name):
-    def _log(fmt, *o):
-        print('[{:08.3f}] {}'.format(time.ticks_ms() / 1000, name), fmt.format(*o))
+_CHUNK_LEN = const(18)  # f0 5c + a pair of lines
 
-    return _log
+_UUID_CCCD = bluetooth.UUID(0x2902)
+
+_get_ready_ms = metrics.Histogram(
+    'tepra_get_ready_ms', 'Time to get the printer ready.', (50, 100, 200, 500, 1000, 5000)
+)
+_credit_rtt_ms = metrics.Histogram(
+    'tepra_credit_rtt_ms',
+    'Time from the last chunk of a window until its f1 5c credit.',
+    (10, 20, 50, 100, 200, 500),
+)
+_print_ms = metrics.Histogram(
+    'tepra_print_ms',
+    'Time from getting ready until the printer finishes.',
+    (1000, 2000, 5000, 10000, 30000, 60000),
+)
+_status_polls = metrics.Histogram(
+    'tepra_status_polls', 'f0 5e status requests until a label is printed.', (1, 2, 3, 5, 10, 20)
+)
+_sent_bytes = metrics.Counter('tepra_sent_bytes_total', 'Bytes of chunks of lines sent.')
+_connections = metrics.Counter('tepra_connections_total', 'Connections to a printer.')
+_reconnects = metrics.Counter('tepra_reconnects_total', 'Connections after the first one.')
+
+
+DEBUG = const(10)
+INFO = const(20)
+WARNING = const(30)
+ERROR = const(40)
+
+
+class LogBuffer:
+    """Keeps the last lines of logs on RAM to fetch them without the serial console."""
+
+    def __init__(self, size):
+        self._lines = [None] * size
+        self._next = 0
+
+    def append(self, line):
+        self._lines[self._next % len(self._lines)] = line
+        self._next += 1
+
+    def lines(self) -> list:
+        size = len(self._lines)
+        start = max(0, self._next - size)
+        return [self._lines[i % size] for i in range(start, self._next)]
+
+
+_log_console = True
+_log_buffer = None  # type: Optional[LogBuffer]
+
+
+def configure_logging(console=True, buffer_lines=0):
+    """Choose where logs go: the console (print) and/or a LogBuffer of the given lines."""
+    global _log_console, _log_buffer
+    _log_console = console
+    _log_buffer = LogBuffer(buffer_lines) if buffer_lines > 0 else None
+
+
+def log_buffer() -> Optional[LogBuffer]:
+    return _log_buffer
+
+
+class Logger:
+    """Formats and emits a log only if its level is enabled.
+
+    Calling the logger itself logs at INFO. The arguments are formatted lazily, but
+    they're still evaluated by the caller: check debug before computing expensive
+    ones (e.g. hexstr) in hot paths.
+    """
+
+    def __init__(self, name, debug=False):
+        self.name = name
+        self.level = DEBUG if debug else INFO
+
+    def set_debug(self, debug):
+        self.level = DEBUG if debug else INFO
+
+    def _emit(self, fmt, o):
+        if not _log_console and _log_buffer is None:
+            return
+        line = '[{:08.3f}] {} {}'.format(time.ticks_ms() / 1000, self.name, fmt.format(*o))
+        if _log_console:
+            print(line)
+        if _log_buffer is not None:
+            _log_buffer.append(line)
+
+    def debug(self, fmt, *o):
+        if self.level <= DEBUG:
+            self._emit(fmt, o)
+
+    def __call__(self, fmt, *o):
+        if self.level <= INFO:
+            self._emit(fmt, o)
+
+    info = __call__
+
+    def warning(self, fmt, *o):
+        if self.level <= WARNING:
+            self._emit(fmt, o)
+
+    def error(self, fmt, *o):
+        if self.level <= ERROR:
+            self._emit(fmt, o)
+
+
+def new_logger(name, debug=False) -> Logger:
+    return Logger(name, debug)
 
 
 class Service:
@@ -152,13 +269,30 @@ class BLESimpleCentral:
     # Connected device
     _conn_handle = None
 
+    # Scan configuration
+    _scan_names = None
+    _scan_service = None
+    _scan_addrs = None
+    _scan_params = None
+
+    # Value handle of characteristic -> handle of its CCCD
+    _cccds = None
+
+    # Value handle of characteristic -> callback for its notifications
+    _subscriptions = None
+
     _debug = False
 
     def __init__(self, ble, debug=False):
         self._ble = ble
         self._reset()
         self._debug = debug
-        self._log = new_logger('Central:')
+        self._log = new_logger('Central:', debug)
+        self.configure_scan()
+
+    def set_debug(self, debug):
+        self._debug = debug
+        self._log.set_debug(debug)
 
     def _reset(self):
         self._name = None
@@ -180,35 +314,41 @@ class BLESimpleCentral:
         self._notify_callback = None
 
         self._conn_handle = None
+        self._cccds = {}
+        self._subscriptions = {}
 
     def _irq(self, event, data):
         if event == _IRQ_SCAN_RESULT:
             addr_type, addr, adv_type, rssi, adv_data = data
-            if adv_type != 0x04:
+            if adv_type != 0x04 or self._addr is not None:
+                return
+
+            # Filter out other advertisers before decoding or formatting anything
+            if self._scan_addrs and bytes(addr) not in self._scan_addrs:
+                return
+            if not self._match_adv(adv_data):
                 return
 
-            addr_hex = ':'.join('{:02x}'.format(x) for x in addr)
             name = decode_name(adv_data) or '?'
             name = name.strip('\x00')
-            self._log(
-                'adv_type={} addr={} name={} {} rssi={} adv_data={}',
-                adv_type,
-                addr_hex,
-                name,
-                len(name),
-                rssi,
-                str(bytes(adv_data)),
-            )
+            if self._debug:
+                self._log.debug(
+                    'adv_type={} addr={} name={} rssi={} adv_data={}',
+                    adv_type,
+                    addrstr(addr),
+                    name,
+                    rssi,
+                    str(bytes(adv_data)),
+                )
 
-            if name.startswith('LR30') or name.startswith('TepraBLE'):
-                # Found a potential device, remember it and stop scanning
-                self._addr_type = addr_type
-                self._addr = bytes(addr)  # Note: addr buffer is owned by caller so need to copy it
-                self._name = name
-                self._ble.gap_scan(None)  # Stop scanning
+            # Found a potential device, remember it and stop scanning
+            self._addr_type = addr_type
+            self._addr = bytes(addr)  # Note: addr buffer is owned by caller so need to copy it
+            self._name = name
+            self._ble.gap_scan(None)  # Stop scanning
 
         elif event == _IRQ_SCAN_DONE:
-            self._log('Scanning done')
+            self._log.debug('Scanning done')
             if self._scan_callback:
                 self._scan_callback(self._addr is not None)
 
@@ -216,19 +356,28 @@ class BLESimpleCentral:
             # Connected successfully
             conn_handle, addr_type, addr = data
             if addr_type == self._addr_type and addr == self._addr:
-                self._log('Connected')
+                self._log.debug('Connected')
                 self._conn_handle = conn_handle
+                if self._conn_callback is not None:
+                    self._conn_callback()
 
         elif event == _IRQ_PERIPHERAL_DISCONNECT:
-            self._log('Disconnected')
+            self._log.debug('Disconnected')
             # Disconnected (either initiated by us or the remote end)
-            conn_handle, _, _ = data
+            conn_handle, addr_type, addr = data
             if conn_handle == self._conn_handle:
                 if self._disconn_callback is not None:
                     self._disconn_callback()
 
                 # If it was initiated by us, it'll already be reset
                 self._reset()
+            elif (
+                self._conn_callback is not None
+                and addr_type == self._addr_type
+                and addr == self._addr
+            ):
+                # An attempt to connect failed, e.g. the peripheral is absent
+                self._conn_callback()
 
         elif event == _IRQ_GATTC_SERVICE_RESULT:
             # Connected device returned a service
@@ -237,7 +386,7 @@ class BLESimpleCentral:
                 self._svc_scan_callback(start_handle, end_handle, uuid)
 
         elif event == _IRQ_GATTC_SERVICE_DONE:
-            self._log('Discovering service done')
+            self._log.debug('Discovering service done')
             # Service query complete
             if self._svc_done_callback is not None:
                 self._svc_done_callback()
@@ -249,7 +398,7 @@ class BLESimpleCentral:
                 self._chr_scan_callback(Characteristic(def_handle, value_handle, properties, uuid))
 
         elif event == _IRQ_GATTC_CHARACTERISTIC_DONE:
-            self._log('Discovering characteristics done')
+            self._log.debug('Discovering characteristics done')
             # Characteristic query complete
             if self._chr_done_callback is not None:
                 self._chr_done_callback()
@@ -261,7 +410,7 @@ class BLESimpleCentral:
                 self._desc_scan_callback(dsc_handle, uuid)
 
         elif event == _IRQ_GATTC_DESCRIPTOR_DONE:
-            self._log('Discovering descriptor done')
+            self._log.debug('Discovering descriptor done')
             # Descriptor query complete
             if self._desc_done_callback is not None:
                 self._desc_done_callback()
@@ -272,21 +421,24 @@ class BLESimpleCentral:
                 self._read_callback(char_data)
 
         elif event == _IRQ_GATTC_READ_DONE:
-            self._log('Reading characteristics done')
+            self._log.debug('Reading characteristics done')
             conn_handle, value_handle, status = data
             if conn_handle == self._conn_handle:
                 self._read_done_callback()
 
         elif event == _IRQ_GATTC_WRITE_DONE:
-            self._log('Writing characteristics done')
+            self._log.debug('Writing characteristics done')
             conn_handle, value_handle, status = data
             if conn_handle == self._conn_handle:
                 self._write_done_callback(value_handle, status)
 
         elif event == _IRQ_GATTC_NOTIFY:
-            self._log('Notification received')
+            self._log.debug('Notification received')
             conn_handle, value_handle, data = data
             if conn_handle == self._conn_handle:
+                subscription = self._subscriptions.get(value_handle)
+                if subscription is not None:
+                    subscription(data)
                 if self._notify_callback is not None:
                     self._notify_callback(value_handle, data)
 
@@ -297,35 +449,115 @@ class BLESimpleCentral:
     def deactivate(self):
         self._ble.active(False)
 
-    def scan(self) -> bool:
-        """Find a device advertising the environmental sensor service."""
-        found = None
+    async def _wait(self, flag, timeout_ms: int) -> bool:
+        """Wait until the flag is set by the IRQ handler. Returns False if it timed out."""
+        try:
+            await uasyncio.wait_for_ms(flag.wait(), timeout_ms)
+        except uasyncio.TimeoutError:
+            return False
+        return True
+
+    def configure_scan(
+        self,
+        name_prefixes=_NAME_PREFIXES,
+        service: Optional[bluetooth.UUID] = None,
+        addrs=None,
+        duration_ms=_SCAN_DURATION_MS,
+        interval_us=_SCAN_INTERVAL_US,
+        window_us=_SCAN_WINDOW_US,
+    ):
+        """Configure which advertisers to look for and how to scan.
+
+        An advertiser matches if its name starts with one of name_prefixes or it
+        advertises the service. If addrs (list of 'xx:xx:xx:xx:xx:xx') is given, the
+        others are ignored regardless of their names.
+        """
+        self._scan_names = tuple(
+            prefix.encode() if isinstance(prefix, str) else prefix for prefix in name_prefixes
+        )
+        self._scan_service = service
+        self._scan_addrs = set(addrbytes(addr) for addr in addrs) if addrs else None
+        self._scan_params = (duration_ms, interval_us, window_us)
+
+    def allows(self, addr: str) -> bool:
+        """Returns if the address is allowed to connect to by the scan configuration."""
+        return not self._scan_addrs or addrbytes(addr) in self._scan_addrs
+
+    def _match_adv(self, adv_data) -> bool:
+        if self._scan_service is not None and self._scan_service in decode_services(adv_data):
+            return True
+
+        # Look for the name prefixes in the payload without decoding it into a str
+        n = len(adv_data)
+        i = 0
+        while i + 1 < n:
+            length = adv_data[i]
+            if length == 0 or i + 1 + length > n:
+                # A malformed or truncated payload: don't read past it in the IRQ handler
+                break
+            typ = adv_data[i + 1]
+            if typ == _ADV_TYPE_SHORT_NAME or typ == _ADV_TYPE_NAME:
+                for prefix in self._scan_names:
+                    if _startswith(adv_data, i + 2, length - 1, prefix):
+                        return True
+            i += 1 + length
+        return False
+
+    async def scan(self, timeout_ms=_TIMEOUT_MS) -> bool:
+        """Find a device matching the scan configuration (see configure_scan)."""
+        flag = uasyncio.ThreadSafeFlag()
+        found = False
 
         def callback(_found):
             nonlocal found
             found = _found
+            flag.set()
 
         self._addr_type = None
         self._addr = None
         self._scan_callback = callback
-        self._ble.gap_scan(5000, 100000, 10000, True)
+        duration_ms, interval_us, window_us = self._scan_params
+        self._ble.gap_scan(duration_ms, interval_us, window_us, True)
 
-        while found is None:
-            time.sleep_ms(10)
+        if not await self._wait(flag, duration_ms + timeout_ms):
+            self._log.warning('Scanning timed out')
+            self._ble.gap_scan(None)
 
         self._scan_callback = None
         return found
 
-    def connect(self):
-        """Connect to the specified device (otherwise use cached address from a scan)."""
+    async def connect(
+        self, addr_type=None, addr: Optional[str] = None, timeout_ms=_TIMEOUT_MS
+    ) -> bool:
+        """Connect to the specified device (otherwise use cached address from a scan).
+
+        The attempt is given up after timeout_ms or when the stack reports it failed.
+        """
+        if addr is not None:
+            self._addr_type, self._addr = addr_type, addrbytes(addr)
+
         if self._addr_type is None or self._addr is None:
             return False
 
-        self._ble.gap_connect(self._addr_type, self._addr)
+        flag = uasyncio.ThreadSafeFlag()
+
+        def callback():
+            flag.set()
+
+        self._conn_callback = callback
+        self._ble.gap_connect(self._addr_type, self._addr, timeout_ms)
 
-        while self._conn_handle is None:
-            time.sleep_ms(10)
+        if not await self._wait(flag, timeout_ms):
+            self._log.warning('Connecting timed out')
 
+        self._conn_callback = None
+        if self._conn_handle is None:
+            # Cancel the attempt not to collide with a scan or the next attempt
+            try:
+                self._ble.gap_connect(None)
+            except OSError:
+                pass  # It has already ended
+            return False
         return True
 
     def disconnect(self):
@@ -335,9 +567,9 @@ class BLESimpleCentral:
         self._ble.gap_disconnect(self._conn_handle)
         self._reset()
 
-    def discover_services(self):
+    async def discover_services(self, timeout_ms=_TIMEOUT_MS):
         svcs = []
-        done = False
+        flag = uasyncio.ThreadSafeFlag()
 
         if self._conn_handle is None:
             return []
@@ -347,24 +579,24 @@ class BLESimpleCentral:
             svcs.append(Service(start_handle, end_handle, uuid))
 
         def callback_done():
-            nonlocal self, done
-            done = True
+            flag.set()
 
         self._svc_scan_callback = callback_scan
         self._svc_done_callback = callback_done
         self._ble.gattc_discover_services(self._conn_handle)
 
-        while not done:
-            time.sleep_ms(10)
+        if not await self._wait(flag, timeout_ms):
+            self._log.warning('Discovering services timed out')
+            svcs = []
 
         self._svc_scan_callback = None
         self._svc_done_callback = None
 
         return svcs
 
-    def discover_characteristics(self, service: Service):
+    async def discover_characteristics(self, service: Service, timeout_ms=_TIMEOUT_MS):
         chrs = []
-        done = False
+        flag = uasyncio.ThreadSafeFlag()
 
         if self._conn_handle is None:
             return []
@@ -374,8 +606,7 @@ class BLESimpleCentral:
             chrs.append(c)
 
         def callback_done():
-            nonlocal done
-            done = True
+            flag.set()
 
         self._chr_scan_callback = callback_scan
         self._chr_done_callback = callback_done
@@ -383,17 +614,23 @@ class BLESimpleCentral:
             self._conn_handle, service.start_handle, service.end_handle
         )
 
-        while not done:
-            time.sleep_ms(10)
+        if not await self._wait(flag, timeout_ms):
+            self._log.warning('Discovering characteristics timed out')
+            chrs = []
 
         self._chr_scan_callback = None
         self._chr_done_callback = None
 
         return chrs
 
-    def discover_descriptors(self, service: Service):
+    async def discover_descriptors(self, service: Service, timeout_ms=_TIMEOUT_MS):
+        return await self._discover_descriptors(
+            service.start_handle, service.end_handle, timeout_ms
+        )
+
+    async def _discover_descriptors(self, start_handle: int, end_handle: int, timeout_ms):
         descs = []
-        done = False
+        flag = uasyncio.ThreadSafeFlag()
 
         if self._conn_handle is None:
             return []
@@ -403,26 +640,24 @@ class BLESimpleCentral:
             descs.append(Descriptor(handle, uuid))
 
         def callback_done():
-            nonlocal done
-            done = True
+            flag.set()
 
         self._desc_scan_callback = callback_scan
         self._desc_done_callback = callback_done
-        self._ble.gattc_discover_descriptors(
-            self._conn_handle, service.start_handle, service.end_handle
-        )
+        self._ble.gattc_discover_descriptors(self._conn_handle, start_handle, end_handle)
 
-        while not done:
-            time.sleep_ms(10)
+        if not await self._wait(flag, timeout_ms):
+            self._log.warning('Discovering descriptors timed out')
+            descs = []
 
         self._desc_scan_callback = None
         self._desc_done_callback = None
 
         return descs
 
-    def _read(self, handle: int) -> Optional[bytes]:
+    async def _read(self, handle: int, timeout_ms=_TIMEOUT_MS) -> Optional[bytes]:
         data = None
-        done = False
+        flag = uasyncio.ThreadSafeFlag()
 
         if self._conn_handle is None:
             return data
@@ -432,118 +667,212 @@ class BLESimpleCentral:
             data = bytes(d)  # Copy the value from the memoryview
 
         def callback_done():
-            nonlocal done
-            done = True
+            flag.set()
 
         self._read_callback = callback_read
         self._read_done_callback = callback_done
         self._ble.gattc_read(self._conn_handle, handle)
 
-        while not done:
-            time.sleep_ms(10)
+        if not await self._wait(flag, timeout_ms):
+            self._log.warning('Reading characteristics timed out')
+            data = None
 
         self._read_callback = None
         self._read_done_callback = None
 
         return data
 
-    def read(self, c: Characteristic):
-        return self._read(c.value_handle)
+    async def read(self, c: Characteristic, timeout_ms=_TIMEOUT_MS):
+        return await self._read(c.value_handle, timeout_ms)
 
-    def write(self, c: Characteristic, data: bytes):
+    def write(self, c: Characteristic, data: bytes) -> bool:
         """Send data without response."""
         if not c.prop_write_without_response():
-            return
+            return False
 
         if self._conn_handle is None:
-            return
+            return False
 
-        self._log('Writing without response: {}', hexstr(data))
-        self._ble.gattc_write(self._conn_handle, c.value_handle, data, 0)
-        return
+        if self._debug:
+            self._log.debug('Writing without response: {}', hexstr(data))
+        try:
+            self._ble.gattc_write(self._conn_handle, c.value_handle, data, 0)
+        except OSError as e:
+            # The BLE stack may run out of buffers when writes are pipelined
+            self._log.debug('Failed to write without response: {}', e)
+            return False
+        return True
 
-    def write_request(self, c: Characteristic, data: bytes, callback):
+    async def write_retrying(self, c: Characteristic, data: bytes, retries=_WRITE_RETRIES) -> bool:
+        """Send data without response, retrying while the BLE stack is busy."""
+        for _ in range(retries):
+            if self.write(c, data):
+                return True
+            await uasyncio.sleep_ms(_WRITE_RETRY_MS)
+        return False
+
+    async def write_request(self, c: Characteristic, data: bytes, callback, timeout_ms=_TIMEOUT_MS):
         """Send data with response."""
-        done = False
+        flag = uasyncio.ThreadSafeFlag()
 
         if not c.prop_write():
-            return
+            return False
 
         if self._conn_handle is None:
-            return
+            return False
 
         def callback_done(handle, status):
-            nonlocal done
-            done = True
+            flag.set()
             callback(handle, status)
 
         self._write_done_callback = callback_done
 
-        self._log('Writing with response')
+        self._log.debug('Writing with response')
         self._ble.gattc_write(self._conn_handle, c.value_handle, data, 1)
 
-        while not done:
-            time.sleep_ms(10)
+        done = await self._wait(flag, timeout_ms)
+        if not done:
+            self._log.warning('Writing with response timed out')
 
         self._write_done_callback = None
 
-        return
+        return done
 
-    def write_cccd(self, c: Characteristic, indication=False, notification=False):
-        """Write the Client Characteristic Configuration Descriptor of a characteristic."""
-        done = False
+    async def index_cccds(
+        self, chrs: list[Characteristic], end_handle: int, timeout_ms=_TIMEOUT_MS
+    ):
+        """Discover descriptors of characteristics which notify or indicate and index their CCCDs.
+
+        Only the handles between the value of each characteristic and the next one are
+        discovered. end_handle is the end handle of the service which has the characteristics.
+        """
+        chrs = sorted(chrs, key=lambda c: c.handle)
+        for n, c in enumerate(chrs):
+            if not c.prop_notify() and not c.prop_indicate():
+                continue
+
+            end = chrs[n + 1].handle - 1 if n + 1 < len(chrs) else end_handle
+            if c.value_handle >= end:
+                continue
+
+            for d in await self._discover_descriptors(c.value_handle + 1, end, timeout_ms):
+                if d.uuid == _UUID_CCCD:
+                    self._cccds[c.value_handle] = d.handle
+
+    def subscribe(self, c: Characteristic, callback):
+        """Call back with every notification of the characteristic until disconnected.
+
+        The callback is called in the IRQ with a memoryview which is valid only during
+        the call. Notifications must be enabled separately with write_cccd().
+        """
+        self._subscriptions[c.value_handle] = callback
+
+    def cccd_handle(self, c: Characteristic) -> Optional[int]:
+        """Returns the handle of the Client Characteristic Configuration Descriptor.
+
+        The descriptors must be indexed with index_cccds() beforehand.
+        """
+        return self._cccds.get(c.value_handle)
+
+    async def write_cccd(
+        self,
+        c: Characteristic,
+        indication=False,
+        notification=False,
+        handle: Optional[int] = None,
+        timeout_ms=_TIMEOUT_MS,
+    ) -> bool:
+        """Write the Client Characteristic Configuration Descriptor of a characteristic.
+
+        The handle of the CCCD can be given if it's known, e.g. from the handle cache.
+        """
+        flag = uasyncio.ThreadSafeFlag()
+        ok = False
 
         if not c.prop_indicate() and not c.prop_notify():
-            return
+            return False
 
         if self._conn_handle is None:
-            return
+            return False
 
-        def callback_done(*_):
-            nonlocal done
-            done = True
+        def callback_done(_, status):
+            nonlocal ok
+            ok = status == 0
+            flag.set()
 
         self._write_done_callback = callback_done
         value = (0b10 if indication else 0b00) + (0b01 if notification else 0b00)
 
-        # FIXME: it should lookup the actual handle of CCCD from descriptors, not adding 1 to the value handle
-        self._ble.gattc_write(self._conn_handle, c.value_handle + 1, bytes([value]), 1)
+        if handle is None:
+            handle = self.cccd_handle(c)
+        if handle is None:
+            self._log.warning('CCCD of {} is not found', c)
+            self._write_done_callback = None
+            return False
+        self._ble.gattc_write(self._conn_handle, handle, bytes([value]), 1)
 
-        while not done:
-            time.sleep_ms(10)
+        if not await self._wait(flag, timeout_ms):
+            self._log.warning('Writing CCCD timed out')
+        elif not ok:
+            self._log.warning('Writing CCCD failed')
 
         self._write_done_callback = None
-        return
+        return ok
 
-    def write_wait_notification(
-        self, tx: Characteristic, tx_data: bytes, rx: Characteristic
+    def addr(self) -> Optional[str]:
+        """Returns the address of the found or connected device."""
+        if self._addr is None:
+            return None
+        return addrstr(self._addr)
+
+    def addr_type(self) -> Optional[int]:
+        return self._addr_type
+
+    async def write_wait_notification(
+        self, tx: Characteristic, tx_data: bytes, rx: Characteristic, timeout_ms=_TIMEOUT_MS
     ) -> Optional[bytes]:
         """Write without response and wait for a notification"""
+        _, rx_data = await self.write_and_wait(tx, tx_data, rx, timeout_ms)
+        return rx_data
+
+    async def write_and_wait(
+        self, tx: Characteristic, tx_data: bytes, rx: Characteristic, timeout_ms=_TIMEOUT_MS
+    ) -> (bool, Optional[bytes]):
+        """Same as write_wait_notification() but tells if the data was written apart
+        from the notification: returns (written, notification or None)."""
         rx_data = None
+        flag = uasyncio.ThreadSafeFlag()
 
         if not tx.prop_write_without_response() or not rx.prop_notify():
-            return rx_data
+            return False, rx_data
 
         if self._conn_handle is None:
-            return rx_data
+            return False, rx_data
 
         def callback(handle, d):
             nonlocal rx_data
             if handle == rx.value_handle:
-                rx_data = d
+                rx_data = bytes(d)  # Copy the value from the memoryview
+                flag.set()
 
+        # Register the callback before writing not to miss a quick notification
         self._notify_callback = callback
-        self.write(tx, tx_data)
 
-        while rx_data is None:
-            time.sleep_ms(10)
+        written = await self.write_retrying(tx, tx_data)
+        if not written:
+            self._log.warning('Failed to write before waiting for a notification')
+        elif not await self._wait(flag, timeout_ms):
+            self._log.warning('Waiting for a notification timed out')
 
         self._notify_callback = None
-        return rx_data
+        return written, rx_data
 
-    def wait_notification(self, rx: Characteristic) -> Optional[bytes]:
+    async def wait_notification(
+        self, rx: Characteristic, timeout_ms=_TIMEOUT_MS
+    ) -> Optional[bytes]:
         """Wait for a notification from the characteristic"""
         rx_data = None
+        flag = uasyncio.ThreadSafeFlag()
 
         if not rx.prop_notify():
             return
@@ -554,12 +883,13 @@ class BLESimpleCentral:
         def callback(handle, d):
             nonlocal rx_data
             if handle == rx.value_handle:
-                rx_data = d
+                rx_data = bytes(d)  # Copy the value from the memoryview
+                flag.set()
 
         self._notify_callback = callback
 
-        while rx_data is None:
-            time.sleep_ms(10)
+        if not await self._wait(flag, timeout_ms):
+            self._log.warning('Waiting for a notification timed out')
 
         self._notify_callback = None
         return rx_data
@@ -580,10 +910,33 @@ def hexstr(b: bytes):
     return str(binascii.hexlify(bytes(b)))
 
 
+def addrstr(addr: bytes):
+    return ':'.join('{:02x}'.format(x) for x in addr)
+
+
+def addrbytes(addr: str) -> bytes:
+    return binascii.unhexlify(addr.replace(':', ''))
+
+
+def _startswith(b, ofs: int, length: int, prefix: bytes) -> bool:
+    if length < len(prefix) or ofs + len(prefix) > len(b):
+        return False
+    for i in range(len(prefix)):
+        if b[ofs + i] != prefix[i]:
+            return False
+    return True
+
+
 def p(*b):
     return bytes(b)
 
 
+def lookup_service(svcs: list[Service], uuid: bluetooth.UUID):
+    for s in svcs:
+        if s.uuid == uuid:
+            return s
+
+
 def lookup_characteristic(chrs: list[list[Characteristic]], uuid: bluetooth.UUID):
     for cl in chrs:
         for c in cl:
@@ -591,6 +944,271 @@ def lookup_characteristic(chrs: list[list[Characteristic]], uuid: bluetooth.UUID
                 return c
 
 
+def _reorder_py(dst, src):
+    # Put the 2-Byte words of each line in the reversed order after f0 5c
+    # One assignment per Byte as unpacking more than 3 items allocates a tuple
+    dst[2] = src[6]
+    dst[3] = src[7]
+    dst[4] = src[4]
+    dst[5] = src[5]
+    dst[6] = src[2]
+    dst[7] = src[3]
+    dst[8] = src[0]
+    dst[9] = src[1]
+    dst[10] = src[14]
+    dst[11] = src[15]
+    dst[12] = src[12]
+    dst[13] = src[13]
+    dst[14] = src[10]
+    dst[15] = src[11]
+    dst[16] = src[8]
+    dst[17] = src[9]
+
+
+try:
+
+    @micropython.viper
+    def _reorder(dst: ptr8, src: ptr8):
+        dst[2] = src[6]
+        dst[3] = src[7]
+        dst[4] = src[4]
+        dst[5] = src[5]
+        dst[6] = src[2]
+        dst[7] = src[3]
+        dst[8] = src[0]
+        dst[9] = src[1]
+        dst[10] = src[14]
+        dst[11] = src[15]
+        dst[12] = src[12]
+        dst[13] = src[13]
+        dst[14] = src[10]
+        dst[15] = src[11]
+        dst[16] = src[8]
+        dst[17] = src[9]
+
+except (AttributeError, NameError):
+    # The viper emitter is unavailable (e.g. stand-in modules on CPython)
+    _reorder = _reorder_py
+
+
+class BytesReader:
+    """Reads an uncompressed image on memory by a pair of lines."""
+
+    def __init__(self, b: bytes):
+        self._mv = memoryview(b)
+        self._ofs = 0
+
+    async def read_pair(self) -> Optional[memoryview]:
+        if self._ofs >= len(self._mv):
+            return None
+        pair = self._mv[self._ofs : self._ofs + 16]
+        self._ofs += 16
+        return pair
+
+
+class Pacer:
+    """Paces chunks of lines treating the f1 5c notification as a flow-control credit.
+
+    The LR30 notifies f1 5c once per 6 chunks when it's ready for the next ones. The
+    chunks in a window are sent back to back (gap_ms apart) and the next window starts
+    as soon as the credit for the previous one arrives. The credit latency is measured
+    to learn how long to wait for it. If a credit doesn't arrive in time, it assumes
+    that the printer dropped data and falls back to the former timing that sleeps
+    fallback_gap_ms between every chunk for the rest of the print.
+    """
+
+    window: int
+    gap_ms: int
+    fallback_gap_ms: int
+    rtt_ms: int
+    fallen_back: bool
+
+    def __init__(
+        self,
+        window=6,
+        gap_ms=0,
+        fallback_gap_ms=20,
+        min_timeout_ms=200,
+        max_timeout_ms=_TIMEOUT_MS,
+    ):
+        self.window = window
+        self.gap_ms = gap_ms
+        self.fallback_gap_ms = fallback_gap_ms
+        self._min_timeout_ms = min_timeout_ms
+        self._max_timeout_ms = max_timeout_ms
+        self.rtt_ms = 0  # Moving average of the credit latency
+        self.fallen_back = False
+
+    def reset(self):
+        self.fallen_back = False
+
+    def ends_window(self, i: int) -> bool:
+        return i % self.window == 0
+
+    def gap(self) -> int:
+        return self.fallback_gap_ms if self.fallen_back else self.gap_ms
+
+    def timeout(self) -> int:
+        if not self.rtt_ms:
+            return self._max_timeout_ms
+        return min(self._max_timeout_ms, max(self._min_timeout_ms, self.rtt_ms * 4))
+
+    def credit(self, granted: bool, rtt_ms: int):
+        if not granted:
+            self.fallen_back = True
+        elif not self.rtt_ms:
+            self.rtt_ms = rtt_ms
+        else:
+            self.rtt_ms = (self.rtt_ms * 7 + rtt_ms) // 8
+
+
+class CompletionTracker:
+    """Waits for the printer to finish a label with as few f0 5e status requests as possible.
+
+    LR30 prints lines as it receives them, line_ms per line plus depth_line_ms per
+    step of depth, then feeds and cuts the tape. The time left after f0 5d is
+    estimated from the number of lines and the depth, and most of it is slept before
+    the first request. The requests are then repeated with a backoff from min_poll_ms
+    doubling up to max_poll_ms. The time to feed and cut (settle_ms) is learned from
+    the finished prints.
+    """
+
+    line_ms: int
+    depth_line_ms: int
+    settle_ms: int
+    min_poll_ms: int
+    max_poll_ms: int
+
+    def __init__(self, line_ms=16, depth_line_ms=1, settle_ms=0, min_poll_ms=50, max_poll_ms=1000):
+        self.line_ms = line_ms
+        self.depth_line_ms = depth_line_ms
+        self.settle_ms = settle_ms
+        self.min_poll_ms = min_poll_ms
+        self.max_poll_ms = max_poll_ms
+        self._poll_ms = min_poll_ms
+        self._learned = False
+
+    def _printing_ms(self, lines: int, d: int, sending_ms: int) -> int:
+        """Time to print the lines left after sending them for sending_ms."""
+        return max(0, int(lines * (self.line_ms + d * self.depth_line_ms)) - sending_ms)
+
+    def start(self, lines: int, d: int, sending_ms: int) -> int:
+        """Returns how long to sleep before the first status request."""
+        self._poll_ms = self.min_poll_ms
+        return (self._printing_ms(lines, d, sending_ms) + self.settle_ms) * 7 // 8
+
+    def backoff(self) -> int:
+        """Returns how long to sleep before the next status request."""
+        poll_ms = self._poll_ms
+        self._poll_ms = min(self.max_poll_ms, poll_ms * 2)
+        return poll_ms
+
+    def finish(self, lines: int, d: int, sending_ms: int, elapsed_ms: int):
+        """Learn from a print which took elapsed_ms to finish after f0 5d."""
+        settle_ms = max(0, elapsed_ms - self._printing_ms(lines, d, sending_ms))
+        if not self._learned:
+            self.settle_ms = settle_ms
+            self._learned = True
+        else:
+            self.settle_ms = (self.settle_ms * 7 + settle_ms) // 8
+
+
+class HandleCache:
+    """Caches GATT handles of printers by their address in a JSON file.
+
+    Each entry has the address type, [handle, value handle, properties] of the
+    battery, TX and RX characteristics and the handles of the CCCDs of RX and the
+    battery. The address of the printer connected last time is also remembered.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._cache = None
+        self._log = new_logger('Handles:')
+
+    def _load(self) -> dict:
+        if self._cache is None:
+            try:
+                with open(self._path, 'r') as f:
+                    self._cache = json.load(f)
+                self._cache['printers']
+            except (OSError, ValueError, KeyError, TypeError):
+                self._cache = {'last': None, 'printers': {}}
+        return self._cache
+
+    def _save(self):
+        try:
+            with open(self._path, 'w') as f:
+                json.dump(self._cache, f)
+        except OSError as e:
+            self._log.warning('Failed to save the handle cache: {}', e)
+
+    def get(self, addr: str) -> Optional[dict]:
+        return self._load()['printers'].get(addr)
+
+    def last(self) -> Optional[str]:
+        return self._load().get('last')
+
+    def put(self, addr: str, entry: dict):
+        cache = self._load()
+        cache['printers'][addr] = entry
+        cache['last'] = addr
+        self._save()
+
+    def touch(self, addr: str):
+        """Remember the address as the printer connected last time."""
+        cache = self._load()
+        if cache.get('last') != addr:
+            cache['last'] = addr
+            self._save()
+
+    def remove(self, addr: str):
+        cache = self._load()
+        if cache['printers'].pop(addr, None) is not None:
+            if cache.get('last') == addr:
+                cache['last'] = None
+            self._save()
+
+
+def dump_characteristic(c: Optional[Characteristic]) -> Optional[list]:
+    if c is None:
+        return None
+    return [c.handle, c.value_handle, c.properties]
+
+
+def load_characteristic(dumped: Optional[list], uuid: bluetooth.UUID) -> Optional[Characteristic]:
+    if dumped is None:
+        return None
+    return Characteristic(dumped[0], dumped[1], dumped[2], uuid)
+
+
+class PrintSession:
+    """Prints labels back to back while holding the printer. See Tepra.session().
+
+    f0 5a is sent only before the first label, as the official app does once per
+    connection, and again after a label failed. f0 5b carrying the depth starts
+    every label.
+    """
+
+    def __init__(self, tepra):
+        self._tepra = tepra
+        self._greeted = False
+
+    async def __aenter__(self):
+        await self._tepra._print_lock.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._tepra._print_lock.release()
+        gc.collect()
+
+    async def print(self, reader, d: int) -> (bool, str):
+        """Print an image from the reader. See Tepra.print_stream()."""
+        ok, err = await self._tepra._print(reader, d, hello=not self._greeted)
+        self._greeted = ok
+        return ok, err
+
+
 class Tepra:
     _battery_svc: Service
     _print_svc: Service
@@ -598,14 +1216,55 @@ class Tepra:
     _battery_chr: Characteristic
     _tx: Characteristic
     _rx: Characteristic
+    _cccd: int
+    _battery_cccd: Optional[int]
 
     _central = BLESimpleCentral
     _debug = False
 
-    def __init__(self, debug=False):
+    def __init__(
+        self,
+        debug=False,
+        pacer: Optional[Pacer] = None,
+        handles_path: str = 'handles.json',
+        tracker: Optional[CompletionTracker] = None,
+    ):
         self._central = BLESimpleCentral(bluetooth.BLE(), debug=debug)
         self._debug = debug
-        self._log = new_logger('TEPRA  :')
+        self._pacer = pacer if pacer is not None else Pacer()
+        self._tracker = tracker if tracker is not None else CompletionTracker()
+        self._handles = HandleCache(handles_path)
+
+        # A chunk of lines is reordered into this buffer not to allocate one for each chunk
+        self._chunk = bytearray(_CHUNK_LEN)
+        self._chunk[0], self._chunk[1] = 0xF0, 0x5C
+        self._log = new_logger('TEPRA  :', debug)
+        self._print_lock = uasyncio.Lock()
+        self._connected_before = False
+
+        # The battery level is cached with when it's received to answer without the radio
+        self._battery_chr = None
+        self._battery_cccd = None
+        self._battery = None
+        self._battery_at = 0
+
+    def set_debug(self, debug):
+        self._debug = debug
+        self._log.set_debug(debug)
+        self._central.set_debug(debug)
+
+    def configure_scan(self, addresses=None, service=None, **kwargs):
+        """Configure how to find a TEPRA Lite. See BLESimpleCentral.configure_scan.
+
+        Only the addresses are connected to if they're given. service is a 16-bit UUID.
+        """
+        if service is not None:
+            service = bluetooth.UUID(service)
+        self._central.configure_scan(service=service, addrs=addresses, **kwargs)
+
+    def configure_completion(self, **kwargs):
+        """Configure how to wait for a print to finish. See CompletionTracker."""
+        self._tracker = CompletionTracker(**kwargs)
 
     def activate(self):
         self._central.activate()
@@ -613,42 +1272,110 @@ class Tepra:
     def deactivate(self):
         self._central.deactivate()
 
-    def connect(self) -> bool:
-        # Scan and find a TEPRA Lite
-        success = self._central.scan()
-        if not success:
-            self._log('TEPRA Lite was not found')
+    async def connect(self) -> bool:
+        started = time.ticks_ms()
+
+        # Connect directly to the printer connected last time, otherwise scan and find one
+        scanned = False
+        last = self._handles.last()
+        entry = self._handles.get(last) if last is not None else None
+        if (
+            entry is None
+            or not self._central.allows(last)
+            or not await self._central.connect(
+                entry.get('addr_type'), last, timeout_ms=_DIRECT_CONNECT_MS
+            )
+        ):
+            scanned = True
+
+            # Scan and find a TEPRA Lite
+            success = await self._central.scan()
+            if not success:
+                self._log.warning('TEPRA Lite was not found')
+                return False
+
+            # Connect to it
+            success = await self._central.connect()
+            if not success:
+                self._log.warning('Failed to connect to the TEPRA Lite')
+                return False
+
+        # Use the cached handles and fall back to the full discovery only if they don't work
+        addr = self._central.addr()
+        entry = self._handles.get(addr)
+        if entry is not None and await self._restore_handles(entry):
+            self._handles.touch(addr)
+            how = 'cached'
+        else:
+            if entry is not None:
+                self._log.warning('Cached handles of {} did not work, discovering', addr)
+                self._handles.remove(addr)
+
+            if not await self._discover():
+                return False
+
+            self._handles.put(addr, self._dump_handles())
+            how = 'discovered'
+
+        _connections.inc()
+        if self._connected_before:
+            _reconnects.inc()
+        self._connected_before = True
+
+        self._log(
+            'Connected to {} {} in {} ms with {} handles',
+            addr,
+            'after scanning' if scanned else 'directly',
+            time.ticks_diff(time.ticks_ms(), started),
+            how,
+        )
+        return True
+
+    def _dump_handles(self) -> dict:
+        return {
+            'addr_type': self._central.addr_type(),
+            'battery': dump_characteristic(self._battery_chr),
+            'tx': dump_characteristic(self._tx),
+            'rx': dump_characteristic(self._rx),
+            'cccd': self._cccd,
+            'battery_cccd': self._battery_cccd,
+        }
+
+    async def _restore_handles(self, entry: dict) -> bool:
+        try:
+            self._battery_chr = load_characteristic(entry['battery'], bluetooth.UUID(0x2A19))
+            self._tx = load_characteristic(entry['tx'], bluetooth.UUID(0xFFF2))
+            self._rx = load_characteristic(entry['rx'], bluetooth.UUID(0xFFF1))
+            self._cccd = entry['cccd']
+            self._battery_cccd = entry.get('battery_cccd')
+        except (KeyError, IndexError, TypeError):
             return False
 
-        # Connect to it
-        success = self._central.connect()
-        if not success:
-            self._log('Failed to connect to the TEPRA Lite')
+        if self._tx is None or self._rx is None:
             return False
 
+        # Enabling notifications also verifies that the cached handles are still valid
+        return await self._central.write_cccd(
+            self._rx, indication=False, notification=True, handle=self._cccd
+        )
+
+    async def _discover(self) -> bool:
         # Discover all services
-        svcs = self._central.discover_services()
+        svcs = await self._central.discover_services()
         if not svcs:
-            self._log('Failed to discover any service of TEPRA Lite')
+            self._log.warning('Failed to discover any service of TEPRA Lite')
             return False
 
-        # Discover all characteristics in all services
-        chrs = []
-        for svc in svcs:
-            chrs.append(self._central.discover_characteristics(svc))
-
-        if not chrs:
-            self._log('Failed to discover any characteristic of the service')
+        self._battery_svc = lookup_service(svcs, bluetooth.UUID(0x180F))
+        self._print_svc = lookup_service(svcs, bluetooth.UUID(0xFFF0))
+        if self._print_svc is None:
+            self._log.warning('Failed to lookup the TEPRA Lite specific service')
             return False
 
-        # Discover all descriptors in all services
-        descs = []
-        for svc in svcs:
-            descs.append(self._central.discover_descriptors(svc))
-
-        if len(chrs) < 2:
-            self._log('Insufficient number of characteristics')
-            return False
+        # Discover characteristics only in the services in use
+        chrs = [await self._central.discover_characteristics(self._print_svc)]
+        if self._battery_svc is not None:
+            chrs.append(await self._central.discover_characteristics(self._battery_svc))
 
         # Look for characteristics
         self._battery_chr = lookup_characteristic(chrs, bluetooth.UUID(0x2A19))
@@ -656,112 +1383,250 @@ class Tepra:
         self._rx = lookup_characteristic(chrs, bluetooth.UUID(0xFFF1))
 
         if self._tx is None or self._rx is None:
-            self._log('Failed to lookup the printer status characteristic')
+            self._log.warning('Failed to lookup the printer status characteristic')
             return False
 
+        # Discover descriptors only in the range of the TEPRA Lite specific service
+        await self._central.index_cccds(chrs[0], self._print_svc.end_handle)
+
+        # The battery level may be notified instead of reading it periodically
+        self._battery_cccd = None
+        if self._battery_chr is not None and self._battery_chr.prop_notify():
+            await self._central.index_cccds(chrs[1], self._battery_svc.end_handle)
+            self._battery_cccd = self._central.cccd_handle(self._battery_chr)
+
         # Set CCCD of RX characteristics
-        self._central.write_cccd(self._rx, indication=False, notification=True)
+        self._cccd = self._central.cccd_handle(self._rx)
+        if self._cccd is None:
+            self._log.warning('Failed to lookup the CCCD of the printer status characteristic')
+            return False
+        if not await self._central.write_cccd(
+            self._rx, indication=False, notification=True, handle=self._cccd
+        ):
+            self._log.warning('Failed to enable notifications of the printer status characteristic')
+            return False
         return True
 
     async def wait_disconnection(self):
         await self._central.wait_disconnection()
 
-    def fetch_remaining_battery(self) -> (bool, int):
-        recv = self._central.read(self._battery_chr)
+    async def fetch_remaining_battery(self) -> (bool, int):
+        """Read the battery level from the printer. Prefer remaining_battery() not to
+        use the radio, especially during a print."""
+        if self._battery_chr is None:
+            return False, 0
+        recv = await self._central.read(self._battery_chr)
         if recv is None or len(recv) < 1:
-            self._log('Failed to read the battery information')
+            self._log.warning('Failed to read the battery information')
             return False, 0
+        self._update_battery(recv)
         return True, recv[0]
 
-    def get_ready(self, depth=0) -> bool:
-        recv = self._central.write_wait_notification(self._tx, b'\xf0\x5a', self._rx)
-        if not recv:
-            return False
-        self._log('Recv: {}', hexstr(recv))
+    def _update_battery(self, data):
+        if len(data) >= 1:
+            self._battery = data[0]
+            self._battery_at = time.ticks_ms()
+
+    def remaining_battery(self) -> (Optional[int], int):
+        """Returns the cached battery level (or None if unknown) and its age in ms."""
+        if self._battery is None:
+            return None, 0
+        return self._battery, time.ticks_diff(time.ticks_ms(), self._battery_at)
+
+    async def keep_battery_fresh(self, max_age_ms=_BATTERY_MAX_AGE_MS):
+        """Keep the cached battery level younger than max_age_ms while connected.
+
+        Notifications of the battery level are enabled if it supports them, and it's
+        still read when no notification arrived for a while. Otherwise it's read
+        periodically. It doesn't read during a print not to slow it down.
+        Run it as a task and cancel it on disconnection.
+        """
+        if self._battery_chr is None:
+            return
+
+        notified = False
+        if self._battery_cccd is not None:
+            self._central.subscribe(self._battery_chr, self._update_battery)
+            notified = await self._central.write_cccd(
+                self._battery_chr, notification=True, handle=self._battery_cccd
+            )
+            self._log.debug('Battery notifications: {}', notified)
+
+        # Notifications arrive only on changes, and may stop without an error: read
+        # until the first value is known and whenever none arrived for a while, leaving
+        # a period of the loop before it gets older than max_age_ms
+        limit_ms = max_age_ms * 3 // 4 if notified else max_age_ms // 2
+        while True:
+            _, age_ms = self.remaining_battery()
+            stale = self._battery is None or age_ms >= limit_ms
+            if stale and not self._print_lock.locked():
+                async with self._print_lock:
+                    await self.fetch_remaining_battery()
+            await uasyncio.sleep_ms(max_age_ms // 4)
+
+    async def get_ready(self, depth=0, hello=True) -> bool:
+        """Start a label. hello can be False if a label was printed in the same session."""
+        if hello:
+            recv = await self._central.write_wait_notification(self._tx, b'\xf0\x5a', self._rx)
+            if not recv:
+                return False
+            if self._debug:
+                self._log.debug('Recv: {}', hexstr(recv))
 
         if depth < -3 or depth > 3:
             raise ValueError('invalid depth: {}'.format(depth))
 
         d = 0x10 - depth if depth < 0 else 0x00 + depth
-        self._log('Depth: {} ({:02x})', depth, d)
+        self._log.debug('Depth: {} ({:02x})', depth, d)
 
-        recv = self._central.write_wait_notification(self._tx, p(0xF0, 0x5B, d, 0x06), self._rx)
+        recv = await self._central.write_wait_notification(
+            self._tx, p(0xF0, 0x5B, d, 0x06), self._rx
+        )
         if not recv:
             return False
-        self._log('Recv: {}', hexstr(recv))
+        if self._debug:
+            self._log.debug('Recv: {}', hexstr(recv))
 
         return True
 
-    def print(self, b: bytes, d: int) -> (bool, str):
-        ret = self._print(b, d)
-        gc.collect()
-        return ret
-
-    def _print(self, b: bytes, d: int) -> (bool, str):
+    async def print(self, b: bytes, d: int) -> (bool, str):
         if len(b) % 16 != 0:
             return False, "insufficient length, image data length must be aligned to 16"
+        return await self.print_stream(BytesReader(b), d)
+
+    async def print_stream(self, reader, d: int) -> (bool, str):
+        """Print an image while reading it from the reader by a pair of lines.
+
+        The reader must have an awaitable read_pair() that returns 16 Bytes of the
+        image or None at the end of the image, like BytesReader or stream.InflateReader.
+        """
+        async with self.session() as session:
+            return await session.print(reader, d)
+
+    def session(self) -> PrintSession:
+        """Returns a context to print labels back to back, e.g.
+
+            async with tepra.session() as session:
+                for reader, depth in labels:
+                    ok, err = await session.print(reader, depth)
+
+        Prints are serialized as the notification callback is shared among them.
+        """
+        return PrintSession(self)
+
+    async def _print(self, reader, d: int, hello=True) -> (bool, str):
+        # Read the first lines before getting ready to fail fast on a broken image
+        try:
+            pair = await reader.read_pair()
+        except (OSError, ValueError, EOFError) as e:
+            return False, 'failed to read the image: {}'.format(e)
+
+        if pair is None:
+            return False, 'has no pixels'
 
         # Get ready
-        recv = self.get_ready(depth=d)
-        self._log('Get ready: {}', recv)
+        started = time.ticks_ms()
+        recv = await self.get_ready(depth=d, hello=hello)
+        self._log.debug('Get ready: {}', recv)
         if not recv:
             return False, 'failed to get ready'
+        _get_ready_ms.observe(time.ticks_diff(time.ticks_ms(), started))
+        sending_at = time.ticks_ms()
 
+        pacer = self._pacer
+        pacer.reset()
+        buf = self._chunk
         i = 1
         err = ""
+        allocated = gc.mem_alloc() if self._debug else 0
 
-        for ofs in range(0, len(b) - 1, 16):
-            # Print until EOF
-            # The stream returns 16 bytes or shorter bytes if there are no body to read
-
-            buf = bytes(
-                (
-                    0xF0,
-                    0x5C,
-                    b[ofs + 6],
-                    b[ofs + 7],
-                    b[ofs + 4],
-                    b[ofs + 5],
-                    b[ofs + 2],
-                    b[ofs + 3],
-                    b[ofs + 0],
-                    b[ofs + 1],
-                    b[ofs + 14],
-                    b[ofs + 15],
-                    b[ofs + 12],
-                    b[ofs + 13],
-                    b[ofs + 10],
-                    b[ofs + 11],
-                    b[ofs + 8],
-                    b[ofs + 9],
-                )
-            )
+        while pair is not None:
+            # Print until the reader reaches EOF
 
-            self._central.write(self._tx, buf)
+            _reorder(buf, pair)
 
-            if i % 6 == 0:
-                self._log('Wait for a notification...')
-                self._central.wait_notification(self._rx)
+            if pacer.ends_window(i):
+                # Wait for a credit to send the next window
+                self._log.debug('Wait for a notification...')
+                sent_at = time.ticks_ms()
+                written, recv = await self._central.write_and_wait(
+                    self._tx, buf, self._rx, timeout_ms=pacer.timeout()
+                )
+                if not written:
+                    # The chunk is lost: only a missing credit is recovered by falling back
+                    err = 'failed to send lines'
+                    self._log.error(err)
+                    break
+                rtt_ms = time.ticks_diff(time.ticks_ms(), sent_at)
+                pacer.credit(recv is not None, rtt_ms)
+                if recv is None:
+                    self._log.warning('No notification for the chunk {}, falling back', i)
+                else:
+                    _credit_rtt_ms.observe(rtt_ms)
             else:
-                time.sleep_ms(20)
+                # Retry only when the BLE stack is busy not to await a coroutine for each chunk
+                sent = self._central.write(self._tx, buf)
+                if not sent and not await self._central.write_retrying(self._tx, buf):
+                    err = 'failed to send lines'
+                    self._log.error(err)
+                    break
+                if pacer.gap():
+                    await uasyncio.sleep_ms(pacer.gap())
 
             i += 1
 
-        # End sending lines
-        recv = self._central.write_wait_notification(self._tx, p(0xF0, 0x5D, 0x00), self._rx)
-        self._log('End sending lines: {}', hexstr(recv))
+            try:
+                pair = await reader.read_pair()
+            except (OSError, ValueError, EOFError) as e:
+                # Stop sending lines but finish the print not to leave the printer printing
+                err = 'failed to read the image: {}'.format(e)
+                self._log.error(err)
+                break
+
+        self._log(
+            'Sent {} chunks, credit latency: {} ms, fell back: {}',
+            i - 1,
+            pacer.rtt_ms,
+            pacer.fallen_back,
+        )
+        if self._debug:
+            self._log.debug('Allocated {} Bytes while sending lines', gc.mem_alloc() - allocated)
+        _sent_bytes.inc((i - 1) * _CHUNK_LEN)
+        metrics.sample_heap()
 
-        self._log('Waiting for the print to finish...')
+        # End sending lines
+        recv = await self._central.write_wait_notification(self._tx, p(0xF0, 0x5D, 0x00), self._rx)
+        if self._debug:
+            self._log.debug('End sending lines: {}', hexstr(recv or b''))
+
+        # Sleep while the printer is expected to be printing instead of flooding the link
+        lines = (i - 1) * 2
+        ended_at = time.ticks_ms()
+        sending_ms = time.ticks_diff(ended_at, sending_at)
+        tracker = self._tracker
+        wait_ms = tracker.start(lines, d, sending_ms)
+        self._log.debug('Waiting for the print to finish in {} ms...', wait_ms)
+        polls = 0
         done = False
         while not done:
-            recv = self._central.write_wait_notification(self._tx, p(0xF0, 0x5E), self._rx)
+            if wait_ms:
+                await uasyncio.sleep_ms(wait_ms)
+            recv = await self._central.write_wait_notification(self._tx, p(0xF0, 0x5E), self._rx)
+            polls += 1
+            if recv is None:
+                self._log.warning('No reply for the status request')
+                return False, 'no reply for the status request'
             if len(recv) < 4:
-                self._log('Received an invalid reply: {}', hexstr(recv))
+                self._log.warning('Received an invalid reply: {}', hexstr(recv))
                 return False, 'received an invalid reply: ' + hexstr(recv)
             done = recv[2] != 0x01
+            wait_ms = tracker.backoff()
 
-        self._log('Done!')
-        return True, err
+        tracker.finish(lines, d, sending_ms, time.ticks_diff(time.ticks_ms(), ended_at))
+        _status_polls.observe(polls)
+        self._log('Done! Polled the status {} times', polls)
+        _print_ms.observe(time.ticks_diff(time.ticks_ms(), started))
+        return not err, err
 
     @staticmethod
     def validate(pixels: list[bytes]) -> tuple[bool, str]:
@@ -3,3 +3,15 @@
 def sleep_ms(duration) -> None:
     """Sleep specified milliseconds."""
     ...
+
+def ticks_ms() -> int:
+    """Returns an increasing millisecond counter with an arbitrary reference point."""
+    ...
+
+def ticks_diff(ticks1, ticks2) -> int:
+    """Measure the period between consecutive calls of ticks_ms()."""
+    ...
+
+def ticks_us() -> int:
+    """Returns an increasing microsecond counter with an arbitrary reference point."""
+    ...